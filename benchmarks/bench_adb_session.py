@@ -0,0 +1,88 @@
+import argparse
+import os
+import statistics
+import stat
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+from and_controller import AdbShellSession, execute_adb
+from utils import print_with_color
+
+arg_desc = "AppAgent - adb command latency benchmark"
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=arg_desc)
+parser.add_argument("--iterations", type=int, default=100)
+parser.add_argument("--device", default="emulator-5554")
+parser.add_argument("--real_adb", action="store_true", help="use the adb on PATH instead of the fake one")
+args = vars(parser.parse_args())
+
+# A stand-in for the adb client: it costs one interpreter start-up per invocation, like the real client does, and
+# forwards shell commands to the local /bin/sh where no-op `input` and `wm` executables live.
+FAKE_ADB = f"""#!{sys.executable}
+import os
+import sys
+
+args = sys.argv[1:]
+if args[:1] == ["-s"]:
+    args = args[2:]
+if args[:1] == ["shell"]:
+    if len(args) > 1:
+        os.execvp("sh", ["sh", "-c", " ".join(args[1:])])
+    os.execvp("sh", ["sh"])
+sys.exit(0)
+"""
+FAKE_INPUT = "#!/bin/sh\nexit 0\n"
+FAKE_WM = "#!/bin/sh\necho 'Physical size: 1080x2400'\n"
+
+
+def install_fake_adb(bin_dir):
+    for name, content in (("adb", FAKE_ADB), ("input", FAKE_INPUT), ("wm", FAKE_WM)):
+        path = os.path.join(bin_dir, name)
+        with open(path, "w") as f:
+            f.write(content)
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ["PATH"]
+
+
+def measure(fn, iterations):
+    latencies = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        ret = fn(i)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if ret == "ERROR":
+            print_with_color(f"ERROR: command failed in iteration {i}", "red")
+            break
+    return latencies
+
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print_with_color(f"{name:<24} n={len(latencies):<5} mean={statistics.mean(latencies):8.2f} ms  "
+                     f"p50={statistics.median(latencies):8.2f} ms  p95={p95:8.2f} ms", "yellow")
+
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+    if not args["real_adb"]:
+        install_fake_adb(tmp_dir)
+    device = args["device"]
+    iterations = args["iterations"]
+
+    legacy = measure(lambda i: execute_adb(f"adb -s {device} shell input tap {i} {i}"), iterations)
+    session = AdbShellSession(device)
+    session.run("wm size")
+    persistent = measure(lambda i: session.run(f"input tap {i} {i}"), iterations)
+
+    # Simulate the device or adb server going away halfway through and make sure the session recovers.
+    session.process.kill()
+    session.process.wait()
+    recovered = measure(lambda i: session.run(f"input tap {i} {i}"), iterations)
+    session.close()
+
+    report("subprocess per command", legacy)
+    report("persistent shell", persistent)
+    report("after reconnect", recovered)
+    print_with_color(f"Speed-up: {statistics.mean(legacy) / statistics.mean(persistent):.1f}x", "green")
@@ -0,0 +1,85 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+import model
+from fake_llm_server import FakeLLMServer
+from model import OpenAIModel
+from utils import print_with_color
+
+arg_desc = "AppAgent - concurrent model request benchmark"
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=arg_desc)
+parser.add_argument("--requests", type=int, default=16)
+parser.add_argument("--delay", type=float, default=0.3, help="model latency in seconds")
+parser.add_argument("--device_time", type=float, default=0.25,
+                    help="device I/O per round (capture and action) that can overlap with a request")
+args = vars(parser.parse_args())
+
+# Keep the request costs out of the table
+model.print_with_color = lambda *_args, **_kwargs: None
+
+
+def report(name, elapsed, sent):
+    print_with_color(f"{name:<40} {elapsed:>8.2f} {sent:>6}", "yellow")
+
+
+async def concurrent(client, count):
+    results = await asyncio.gather(*(client.get_model_response_async(f"prompt {i}", []) for i in range(count)))
+    assert all(status for status, _ in results)
+
+
+async def overlapped_rounds(client, rounds):
+    # While the model answers one task, the device serves another: capture and act in a worker thread
+    async def task_round(i):
+        await asyncio.to_thread(time.sleep, args["device_time"])
+        await client.get_model_response_async(f"prompt {i}", [])
+
+    await asyncio.gather(*(task_round(i) for i in range(rounds)))
+
+
+async def cancelled(client, count, after):
+    tasks = [asyncio.ensure_future(client.get_model_response_async(f"prompt {i}", [])) for i in range(count)]
+    await asyncio.sleep(after)
+    for task in tasks:
+        task.cancel()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    return sum(isinstance(result, asyncio.CancelledError) for result in results)
+
+
+with FakeLLMServer(delay=args["delay"]) as server:
+    count = args["requests"]
+    print_with_color(f"{count} requests, {args['delay']}s model latency", "yellow")
+    print_with_color(f"{'client':<40} {'wall s':>8} {'sent':>6}", "yellow")
+    client = OpenAIModel(server.url, "sk-", "fake", 0.0, 300)
+    start = time.perf_counter()
+    for i in range(count):
+        client.get_model_response(f"prompt {i}", [])
+    report("sync, one after another", time.perf_counter() - start, server.requests)
+    for max_concurrency in (1, 4, 8):
+        server.requests = 0
+        client = OpenAIModel(server.url, "sk-", "fake", 0.0, 300, max_concurrency=max_concurrency)
+        start = time.perf_counter()
+        asyncio.run(concurrent(client, count))
+        report(f"async, {max_concurrency} in flight", time.perf_counter() - start, server.requests)
+
+    server.requests = 0
+    client = OpenAIModel(server.url, "sk-", "fake", 0.0, 300)
+    start = time.perf_counter()
+    for i in range(count):
+        time.sleep(args["device_time"])
+        client.get_model_response(f"prompt {i}", [])
+    report(f"sync rounds with {args['device_time']}s device I/O", time.perf_counter() - start, server.requests)
+    server.requests = 0
+    start = time.perf_counter()
+    asyncio.run(overlapped_rounds(client, count))
+    report(f"async rounds with {args['device_time']}s device I/O", time.perf_counter() - start, server.requests)
+
+    server.requests = 0
+    client = OpenAIModel(server.url, "sk-", "fake", 0.0, 300, max_concurrency=2)
+    start = time.perf_counter()
+    cancelled_count = asyncio.run(cancelled(client, count, args["delay"] / 2))
+    report(f"async, {cancelled_count} cancelled in flight or waiting", time.perf_counter() - start, server.requests)
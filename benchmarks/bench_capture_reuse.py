@@ -0,0 +1,92 @@
+import argparse
+import os
+import random
+import struct
+import sys
+import time
+
+import cv2
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+import and_controller
+from and_controller import AndroidController
+from utils import print_with_color
+
+arg_desc = "AppAgent - reuse of the after-action capture benchmark"
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=arg_desc)
+parser.add_argument("--image", default=os.path.join(os.path.dirname(__file__), "..", "assets", "demo.png"))
+parser.add_argument("--rounds", type=int, default=12)
+parser.add_argument("--back_rate", type=float, default=0.25, help="share of rounds whose reflection decides BACK")
+parser.add_argument("--png_cost", type=float, default=0.5, help="seconds one PNG screencap takes over adb")
+parser.add_argument("--raw_cost", type=float, default=0.15, help="seconds one raw screencap takes over adb")
+parser.add_argument("--dump_cost", type=float, default=1.2, help="seconds one uiautomator dump takes")
+parser.add_argument("--reflect_cost", type=float, default=1.5, help="seconds the reflection model call takes")
+args = vars(parser.parse_args())
+
+
+class SimulatedDevice:
+    """A device that shows one of two pages and answers captures after the time they take on a real one."""
+
+    def __init__(self, image):
+        self.pages = [image, cv2.flip(image, 1)]
+        self.page = 0
+        self.xml = b'<?xml version="1.0" ?><hierarchy rotation="0"><node bounds="[0,0][1080,2400]" /></hierarchy>'
+
+    def screencap(self, adb_args):
+        raw = adb_args[-1] == "screencap"
+        time.sleep(args["raw_cost"] if raw else args["png_cost"])
+        image = self.pages[self.page]
+        if raw:
+            rgba = cv2.cvtColor(image, cv2.COLOR_BGR2RGBA)
+            return struct.pack("<III", rgba.shape[1], rgba.shape[0], 1) + rgba.tobytes()
+        return cv2.imencode(".png", image)[1].tobytes()
+
+    def dump_hierarchy(self, compressed=None):
+        time.sleep(args["dump_cost"])
+        return self.xml.replace(b"0\" />", f"{self.page}\" />".encode())
+
+
+device = SimulatedDevice(cv2.imread(args["image"]))
+and_controller.configs.update(ADB_SHELL_SESSION=False, SCREENSHOT_STREAM=True, SCREENSHOT_RAW=False, XML_STREAM=True,
+                              PERSIST_SCREENSHOTS=False, PERSIST_XML=False)
+and_controller.execute_adb = lambda command: "Physical size: 1080x2400"
+and_controller.execute_adb_binary = device.screencap
+controller = AndroidController("emulator-5554")
+controller.dump_hierarchy = device.dump_hierarchy
+
+
+def explore(reuse):
+    """Rounds of capture, action, after-capture and reflection, with BACK at the same rounds every time."""
+    rng = random.Random(0)
+    capture_time, reused = 0.0, 0
+    state_after = None
+    start = time.perf_counter()
+    for _ in range(args["rounds"]):
+        capture_start = time.perf_counter()
+        state = controller.reuse_state(state_after)
+        state_after = None
+        if state is not None:
+            reused += 1
+        else:
+            state = controller.capture_state("before", "before", None)
+        capture_time += time.perf_counter() - capture_start
+        # The action opens the other page, the reflection sometimes goes back
+        device.page = 1 - device.page
+        capture_start = time.perf_counter()
+        state_after = controller.capture_after("after", None, with_hierarchy=reuse)
+        capture_time += time.perf_counter() - capture_start
+        time.sleep(args["reflect_cost"])
+        if rng.random() < args["back_rate"]:
+            state_after = None
+            device.page = 1 - device.page
+    return time.perf_counter() - start, capture_time, reused
+
+
+print_with_color(f"{args['rounds']} rounds, {args['back_rate']:.0%} BACK, PNG screencap {args['png_cost']}s, raw "
+                 f"{args['raw_cost']}s, dump {args['dump_cost']}s, reflection {args['reflect_cost']}s", "yellow")
+print_with_color(f"{'mode':<28} {'total s':>8} {'capture s':>10} {'per round s':>12} {'reused':>7}", "yellow")
+for name, reuse in (("capture every round", False), ("reuse the after capture", True)):
+    total, capture_time, reused = explore(reuse)
+    print_with_color(f"{name:<28} {total:>8.2f} {capture_time:>10.2f} {capture_time / args['rounds']:>12.2f} "
+                     f"{reused:>7}", "yellow")
@@ -0,0 +1,60 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+from and_controller import configs, extract_elements, traverse_tree
+from synthetic_ui import make_hierarchy
+from utils import print_with_color
+
+arg_desc = "AppAgent - element extraction scaling benchmark"
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=arg_desc)
+parser.add_argument("--sizes", default="100,500,1000,5000,10000,20000")
+parser.add_argument("--repeat", type=int, default=3)
+args = vars(parser.parse_args())
+
+
+def legacy_extract(xml):
+    # The per-round code the agent loops used before extract_elements existed
+    clickable_list = []
+    focusable_list = []
+    traverse_tree(xml, clickable_list, "clickable", True)
+    traverse_tree(xml, focusable_list, "focusable", True)
+    elem_list = clickable_list.copy()
+    for elem in focusable_list:
+        bbox = elem.bbox
+        center = (bbox[0][0] + bbox[1][0]) // 2, (bbox[0][1] + bbox[1][1]) // 2
+        close = False
+        for e in clickable_list:
+            bbox = e.bbox
+            center_ = (bbox[0][0] + bbox[1][0]) // 2, (bbox[0][1] + bbox[1][1]) // 2
+            dist = (abs(center[0] - center_[0]) ** 2 + abs(center[1] - center_[1]) ** 2) ** 0.5
+            if dist <= configs["MIN_DIST"]:
+                close = True
+                break
+        if not close:
+            elem_list.append(elem)
+    return elem_list
+
+
+def best_of(fn, xml, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(xml)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+print_with_color(f"{'nodes':>7} {'elements':>9} {'legacy ms':>10} {'single-pass ms':>15} {'speed-up':>9}", "yellow")
+for size in map(int, args["sizes"].split(",")):
+    xml = make_hierarchy(size)
+    legacy_time, legacy_list = best_of(legacy_extract, xml, args["repeat"])
+    new_time, new_list = best_of(extract_elements, xml, args["repeat"])
+    if [(e.uid, e.bbox) for e in legacy_list] != [(e.uid, e.bbox) for e in new_list]:
+        print_with_color(f"ERROR: extract_elements disagrees with the legacy path at {size} nodes", "red")
+    print_with_color(f"{size:>7} {len(new_list):>9} {legacy_time * 1000:>10.1f} {new_time * 1000:>15.1f} "
+                     f"{legacy_time / new_time:>8.1f}x", "yellow")
@@ -0,0 +1,87 @@
+import argparse
+import io
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+from and_controller import NodeFrame, get_id_from_element
+from synthetic_ui import make_hierarchy
+from utils import print_with_color
+
+arg_desc = "AppAgent - per-node cost of element ID computation"
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=arg_desc)
+parser.add_argument("--nodes", type=int, default=20000)
+parser.add_argument("--depths", default="4,8,12")
+parser.add_argument("--fanout", type=int, default=8)
+parser.add_argument("--repeat", type=int, default=5)
+args = vars(parser.parse_args())
+
+
+def parse_only(xml):
+    for event, elem in ET.iterparse(io.BytesIO(xml), ['start', 'end']):
+        if event == 'end':
+            elem.clear()
+
+
+def uncached_ids(xml):
+    # What traversal did before IDs were memoized: reparse bounds and rebuild the parent ID for every match
+    path = []
+    for event, elem in ET.iterparse(io.BytesIO(xml), ['start', 'end']):
+        if event == 'end':
+            path.pop()
+            elem.clear()
+            continue
+        path.append(elem)
+        for attrib in ("clickable", "focusable"):
+            if elem.attrib.get(attrib) != "true":
+                continue
+            bounds = elem.attrib["bounds"][1:-1].split("][")
+            x1, y1 = map(int, bounds[0].split(","))
+            x2, y2 = map(int, bounds[1].split(","))
+            elem_id = get_id_from_element(elem)
+            if len(path) > 1:
+                elem_id = get_id_from_element(path[-2]) + "_" + elem_id
+
+
+def memoized_ids(xml):
+    # The same walk with a NodeFrame per node, as extract_elements and traverse_tree keep on their stacks
+    path = []
+    for event, elem in ET.iterparse(io.BytesIO(xml), ['start', 'end']):
+        if event == 'end':
+            path.pop()
+            elem.clear()
+            continue
+        frame = NodeFrame(elem.attrib)
+        path.append(frame)
+        for attrib in ("clickable", "focusable"):
+            if frame.attrib.get(attrib) != "true":
+                continue
+            x1, y1, x2, y2 = frame.bounds
+            elem_id = frame.elem_id
+            if len(path) > 1:
+                elem_id = path[-2].elem_id + "_" + elem_id
+
+
+def best_of(fn, xml):
+    best = float("inf")
+    for _ in range(args["repeat"]):
+        start = time.perf_counter()
+        fn(xml)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+print_with_color(f"{'depth':>5} {'nodes':>7} {'parse ns/node':>14} {'uncached ns/node':>17} "
+                 f"{'memoized ns/node':>17}", "yellow")
+for depth in map(int, args["depths"].split(",")):
+    xml = make_hierarchy(args["nodes"], depth=depth, max_fanout=args["fanout"])
+    nodes = xml.count(b"<node ")
+    base = best_of(parse_only, xml)
+    uncached = best_of(uncached_ids, xml)
+    memoized = best_of(memoized_ids, xml)
+    # Report the work done on top of the bare iterparse walk, which both ID walks share
+    print_with_color(f"{depth:>5} {nodes:>7} {base / nodes * 1e9:>14.0f} {(uncached - base) / nodes * 1e9:>17.0f} "
+                     f"{(memoized - base) / nodes * 1e9:>17.0f}", "yellow")
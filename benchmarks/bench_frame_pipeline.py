@@ -0,0 +1,72 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+from and_controller import ElementTable
+from frame import Frame
+from image_encoder import ImageEncoder
+from utils import draw_bbox_multi, encode_image, print_with_color
+
+arg_desc = "AppAgent - per round image pipeline benchmark"
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=arg_desc)
+parser.add_argument("--image", default=os.path.join(os.path.dirname(__file__), "..", "assets", "demo.png"))
+parser.add_argument("--labels", type=int, default=40)
+parser.add_argument("--repeat", type=int, default=5)
+args = vars(parser.parse_args())
+
+
+def best_of(fn):
+    best = float("inf")
+    for _ in range(args["repeat"]):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+with open(args["image"], "rb") as f:
+    png = f.read()
+height, width, _ = Frame.from_png(png).shape
+rng = random.Random(0)
+elements = []
+for i in range(args["labels"]):
+    x1, y1 = rng.randrange(0, width - 100), rng.randrange(0, height - 100)
+    elements.append((f"elem_{i}", (x1, y1, x1 + rng.randrange(20, 100), y1 + rng.randrange(20, 100)), "clickable"))
+elem_list = ElementTable([uid for uid, _, _ in elements], [bounds for _, bounds, _ in elements],
+                         [attrib for _, _, attrib in elements], [1] * len(elements))
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+    screenshot_path = os.path.join(tmp_dir, "screenshot.png")
+    labeled_path = os.path.join(tmp_dir, "labeled.png")
+
+    def legacy_round():
+        # The screenshot goes to disk, is read back to be labeled, and the labeled PNG is read back to be sent
+        with open(screenshot_path, "wb") as f:
+            f.write(png)
+        draw_bbox_multi(screenshot_path, labeled_path, elem_list)
+        return f"data:image/jpeg;base64,{encode_image(labeled_path)}"
+
+    def frame_round(encoder, persist):
+        screenshot = Frame.from_png(png)
+        labeled = Frame(image=draw_bbox_multi(screenshot.image, None, elem_list))
+        saved = labeled.save_async(labeled_path) if persist else None
+        data_url = encoder.data_url(labeled)
+        return data_url, saved
+
+    print_with_color(f"Image {width}x{height}, {args['labels']} labels", "yellow")
+    # The labeled screenshot is written in the background, so the time to the payload is what delays the request
+    print_with_color(f"{'pipeline':<36} {'ms to payload':>14} {'ms with write':>14}", "yellow")
+    legacy_time = best_of(legacy_round) * 1000
+    print_with_color(f"{'disk round trips':<36} {legacy_time:>14.2f} {legacy_time:>14.2f}", "yellow")
+    for image_format, max_long_edge in (("png", 0), ("jpeg", 2048)):
+        for persist in (True, False):
+            encoder = ImageEncoder(image_format, max_long_edge=max_long_edge)
+            payload_time = best_of(lambda: frame_round(encoder, persist)) * 1000
+            total_time = best_of(lambda: [saved.result() for saved in frame_round(encoder, persist)[1:] if saved])
+            name = f"frames, {image_format}, {'persisted' if persist else 'not persisted'}"
+            print_with_color(f"{name:<36} {payload_time:>14.2f} {total_time * 1000:>14.2f}", "yellow")
@@ -0,0 +1,61 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+import model
+from fake_llm_server import FakeLLMServer
+from model import HedgedModel, OpenAIModel
+from utils import print_with_color
+
+arg_desc = "AppAgent - hedged model request benchmark"
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=arg_desc)
+parser.add_argument("--requests", type=int, default=100)
+parser.add_argument("--delay", type=float, default=0.1, help="median latency of the primary in seconds")
+parser.add_argument("--tail_rate", type=float, default=0.08, help="share of primary requests that stall")
+parser.add_argument("--tail", type=float, default=1.0, help="extra latency of a stalled primary request in seconds")
+parser.add_argument("--secondary_delay", type=float, default=0.2, help="latency of the secondary in seconds")
+parser.add_argument("--percentile", type=int, default=90)
+args = vars(parser.parse_args())
+
+# Keep the request costs out of the table
+model.print_with_color = lambda *_args, **_kwargs: None
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, len(ordered) * p // 100)]
+
+
+def run(name, mllm, servers):
+    latencies = []
+    for i in range(args["requests"]):
+        start = time.perf_counter()
+        status, rsp = mllm.get_model_response(f"prompt {i}", [])
+        assert status, rsp
+        latencies.append((time.perf_counter() - start) * 1000)
+    sent = "/".join(str(server.requests) for server in servers)
+    print_with_color(f"{name:<18} {statistics.median(latencies):>8.1f} {percentile(latencies, 95):>8.1f} "
+                     f"{percentile(latencies, 99):>8.1f} {max(latencies):>8.1f} {sent:>10}", "yellow")
+
+
+# The primary is fast but stalls now and then, the secondary is slower but steady
+primary_server = FakeLLMServer(delay=args["delay"], jitter=args["delay"] / 5, error_rate=args["tail_rate"],
+                               faults=("hang",), hang=args["tail"])
+secondary_server = FakeLLMServer(delay=args["secondary_delay"], jitter=args["secondary_delay"] / 10, seed=1)
+with primary_server, secondary_server:
+    primary = OpenAIModel(primary_server.url, "sk-", "fake", 0.0, 300)
+    secondary = OpenAIModel(secondary_server.url, "sk-", "fake", 0.0, 300)
+    print_with_color(f"{args['requests']} requests, primary {args['delay']}s with {args['tail_rate']:.0%} stalling "
+                     f"{args['tail']}s longer, secondary {args['secondary_delay']}s", "yellow")
+    print_with_color(f"{'client':<18} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'sent p/s':>10}",
+                     "yellow")
+    run("primary only", primary, (primary_server, secondary_server))
+    primary_server.requests = 0
+    primary_server.random.seed(0)
+    hedged = HedgedModel(primary, secondary, percentile=args["percentile"], initial_deadline=args["delay"] * 2)
+    run(f"hedged at p{args['percentile']}", hedged, (primary_server, secondary_server))
+    print_with_color(f"Hedging: {hedged.stats()}", "yellow")
@@ -0,0 +1,54 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+from frame import Frame
+from image_encoder import ImageEncoder, vision_tokens
+from utils import encode_image, print_with_color
+
+arg_desc = "AppAgent - model payload encoding benchmark"
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=arg_desc)
+parser.add_argument("--image", default=os.path.join(os.path.dirname(__file__), "..", "assets", "demo.png"))
+parser.add_argument("--settings", default="png:100:0:0,jpeg:85:0:0,jpeg:85:2048:0,jpeg:70:1568:0,webp:80:2048:0,"
+                                          "jpeg:85:0:1105,jpeg:85:0:765",
+                    help="comma separated format:quality:max_long_edge:max_tokens")
+parser.add_argument("--repeat", type=int, default=5)
+args = vars(parser.parse_args())
+
+
+def best_of(fn):
+    best = float("inf")
+    result = None
+    for _ in range(args["repeat"]):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+frame = Frame.from_file(args["image"])
+height, width, _ = frame.shape
+# What used to be sent: the PNG from disk, base64 encoded as is
+legacy_time, legacy_b64 = best_of(lambda: encode_image(args["image"]))
+print_with_color(f"Image {width}x{height}", "yellow")
+print_with_color(f"{'setting':<20} {'size':>10} {'payload KB':>11} {'tokens':>7} {'encode ms':>10} {'cached ms':>10}",
+                 "yellow")
+print_with_color(f"{'legacy png':<20} {f'{width}x{height}':>10} {len(legacy_b64) / 1024:>11.1f} "
+                 f"{vision_tokens(width, height):>7} {legacy_time * 1000:>10.2f} {'-':>10}", "yellow")
+for setting in args["settings"].split(","):
+    image_format, quality, max_long_edge, max_tokens = setting.split(":")
+    encoder = ImageEncoder(image_format, int(quality), int(max_long_edge), int(max_tokens))
+
+    def encode_cold():
+        encoder.cache.clear()
+        return encoder.data_url(Frame(image=frame.image))
+
+    encode_time, data_url = best_of(encode_cold)
+    cached_time, _ = best_of(lambda: encoder.data_url(frame))
+    encoded = encoder.encode(frame)
+    print_with_color(f"{setting:<20} {f'{encoded.width}x{encoded.height}':>10} {len(data_url) / 1024:>11.1f} "
+                     f"{vision_tokens(encoded.width, encoded.height):>7} {encode_time * 1000:>10.2f} "
+                     f"{cached_time * 1000:>10.2f}", "yellow")
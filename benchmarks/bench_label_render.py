@@ -0,0 +1,116 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+from and_controller import AndroidElement
+from utils import draw_bbox_multi, draw_labels, print_with_color
+
+arg_desc = "AppAgent - label rendering benchmark"
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=arg_desc)
+parser.add_argument("--image", default=os.path.join(os.path.dirname(__file__), "..", "assets", "demo.png"))
+parser.add_argument("--counts", default="1,5,10,20,30,60,120,240")
+parser.add_argument("--repeat", type=int, default=50)
+args = vars(parser.parse_args())
+
+
+def put_b_text(img, text, text_offset_x=20, text_offset_y=20, vspace=10, hspace=10, font_scale=1.0,
+               background_RGB=(228, 225, 222), text_RGB=(1, 1, 1), font=cv2.FONT_HERSHEY_DUPLEX, thickness=2, alpha=0.6,
+               gamma=0):
+    # pyshine.putBText 0.0.9, which draw_bbox_multi called once per label before labels were batched
+    R, G, B = background_RGB[0], background_RGB[1], background_RGB[2]
+    text_R, text_G, text_B = text_RGB[0], text_RGB[1], text_RGB[2]
+    (text_width, text_height) = cv2.getTextSize(text, font, fontScale=font_scale, thickness=thickness)[0]
+    x, y, w, h = text_offset_x, text_offset_y, text_width, text_height
+    crop = img[y - vspace:y + h + vspace, x - hspace:x + w + hspace]
+    white_rect = np.ones(crop.shape, dtype=np.uint8)
+    b, g, r = cv2.split(white_rect)
+    rect_changed = cv2.merge((B * b, G * g, R * r))
+    res = cv2.addWeighted(crop, alpha, rect_changed, 1 - alpha, gamma)
+    img[y - vspace:y + vspace + h, x - hspace:x + w + hspace] = res
+    cv2.putText(img, text, (x, (y + h)), font, fontScale=font_scale, color=(text_B, text_G, text_R),
+                thickness=thickness)
+    return img
+
+
+def legacy_draw(imgcv, elem_list):
+    # One blended putBText call per label, as draw_bbox_multi did before labels were batched
+    for count, elem in enumerate(elem_list, start=1):
+        (left, top), (right, bottom) = elem.bbox
+        try:
+            imgcv = put_b_text(imgcv, str(count), text_offset_x=(left + right) // 2 + 10,
+                               text_offset_y=(top + bottom) // 2 + 10, vspace=10, hspace=10, font_scale=1,
+                               thickness=2, background_RGB=(10, 10, 10), text_RGB=(255, 250, 250), alpha=0.5)
+        except Exception:
+            pass
+    return imgcv
+
+
+def overlay_draw(imgcv, elem_list, alpha=0.5):
+    # The alternative to blending box by box: paint every box into one overlay and blend it in a single call
+    labels = [(str(count), (left + right) // 2 + 10, (top + bottom) // 2 + 10)
+              for count, ((left, top), (right, bottom)) in enumerate((elem.bbox for elem in elem_list), start=1)]
+    boxes = []
+    for text, x, y in labels:
+        text_width, text_height = cv2.getTextSize(text, cv2.FONT_HERSHEY_DUPLEX, fontScale=1, thickness=2)[0]
+        boxes.append((max(y - 10, 0), min(y + text_height + 10, height),
+                      max(x - 10, 0), min(x + text_width + 10, width)))
+    top, bottom = min(box[0] for box in boxes), max(box[1] for box in boxes)
+    left, right = min(box[2] for box in boxes), max(box[3] for box in boxes)
+    region = imgcv[top:bottom, left:right]
+    overlay = region.copy()
+    for top_, bottom_, left_, right_ in boxes:
+        overlay[top_ - top:bottom_ - top, left_ - left:right_ - left] = (10, 10, 10)
+    cv2.addWeighted(region, alpha, overlay, 1 - alpha, 0, dst=region)
+    for (text, x, y), (top_, bottom_, _, _) in zip(labels, boxes):
+        cv2.putText(imgcv, text, (x, top_ + bottom_ - y), cv2.FONT_HERSHEY_DUPLEX, fontScale=1, color=(250, 250, 255),
+                    thickness=2)
+    return imgcv
+
+
+def batched_draw(imgcv, elem_list):
+    # draw_bbox_multi without loading and copying the screenshot
+    draw_labels(imgcv, [(str(count), (left + right) // 2 + 10, (top + bottom) // 2 + 10, (10, 10, 10), (255, 250, 250))
+                        for count, ((left, top), (right, bottom)) in enumerate((e.bbox for e in elem_list), start=1)])
+    return imgcv
+
+
+def best_of(fn, elem_list):
+    # Only the drawing is timed, the copy of the screenshot every path starts from is made beforehand
+    best = float("inf")
+    result = None
+    for _ in range(args["repeat"]):
+        canvas = image.copy()
+        start = time.perf_counter()
+        result = fn(canvas, elem_list)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+image = cv2.imread(args["image"])
+height, width, _ = image.shape
+rng = random.Random(0)
+print_with_color(f"Image {width}x{height}", "yellow")
+print_with_color(f"{'labels':>6} {'per-label us':>13} {'batched us':>11} {'one blend us':>13} {'differing px':>13}",
+                 "yellow")
+for n in map(int, args["counts"].split(",")):
+    elem_list = []
+    for i in range(n):
+        x1, y1 = rng.randrange(0, width - 100), rng.randrange(0, height - 100)
+        elem_list.append(AndroidElement(f"elem_{i}", ((x1, y1), (x1 + rng.randrange(20, 100), y1 + rng.randrange(20, 100))),
+                                        "clickable"))
+    new_time, new_img = best_of(batched_draw, elem_list)
+    overlay_time, _ = best_of(overlay_draw, elem_list)
+    old_time, old_img = best_of(legacy_draw, elem_list)
+    if np.any(new_img != draw_bbox_multi(image, None, elem_list)):
+        print_with_color(f"ERROR: the timed copy of draw_bbox_multi disagrees with it at {n} labels", "red")
+    # Texts are drawn after all boxes instead of after their own box, so only overlapping labels may differ
+    differing = np.count_nonzero(np.any(old_img != new_img, axis=2)) / (width * height)
+    print_with_color(f"{n:>6} {old_time * 1e6:>13.0f} {new_time * 1e6:>11.0f} {overlay_time * 1e6:>13.0f} "
+                     f"{differing:>12.3%}", "yellow")
@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+import model
+from model import CachedModel, OpenAIModel, metrics, parse_explore_rsp, parse_merged_rsp, parse_reflect_rsp
+from response_cache import Cassette
+from utils import print_with_color
+
+arg_desc = "AppAgent - merged decide and reflect calls benchmark"
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=arg_desc)
+parser.add_argument("--responses", default=os.path.join(os.path.dirname(__file__), "fixtures",
+                                                        "explore_responses.jsonl"))
+parser.add_argument("--base_cost", type=float, default=2.0, help="seconds every model call takes")
+parser.add_argument("--image_cost", type=float, default=0.5, help="seconds every image adds to a model call")
+parser.add_argument("--chars_per_s", type=float, default=250, help="response characters generated per second")
+parser.add_argument("--device_cost", type=float, default=2.5, help="seconds of capture, action and settling per round")
+parser.add_argument("--scale", type=float, default=0.02, help="factor applied to every simulated wait")
+args = vars(parser.parse_args())
+
+model.print_with_color = lambda *_args, **_kwargs: None
+
+with open(args["responses"]) as f:
+    steps = [json.loads(line) for line in f if line.strip()]
+image = np.zeros((1080, 720, 3), dtype=np.uint8)
+
+
+def cassette_lines(merged):
+    """The responses a run asks for, in order: a decision and a reflection per action, or in merged mode the
+    reflection on the last action together with the next decision."""
+    lines = []
+    pending = None
+    for step in steps:
+        if pending is not None:
+            lines.append(pending["reflect"] + "\n" + step["explore"])
+            if pending["reflect"].startswith("Decision: BACK"):
+                # The decision came with the screen that was left, so it is asked for again
+                lines.append(step["explore"])
+        else:
+            lines.append(step["explore"])
+        if step["reflect"] is None:
+            pending = None
+        elif merged:
+            pending = step
+        else:
+            lines.append(step["reflect"])
+    if pending is not None:
+        lines.append(pending["reflect"])
+    return lines
+
+
+def ask(mllm, images):
+    status, rsp = mllm.get_model_response("recorded", images)
+    if not status:
+        raise RuntimeError(rsp)
+    time.sleep((args["base_cost"] + args["image_cost"] * len(images) + len(rsp) / args["chars_per_s"]) * args["scale"])
+    return rsp
+
+
+def explore(mllm, merged):
+    """The self_explorer loop on the recorded responses, with the device replaced by a fixed wait per round."""
+    rounds = docs = 0
+    pending = False
+    while True:
+        time.sleep(args["device_cost"] * args["scale"])
+        if pending:
+            reflection, res = parse_merged_rsp(ask(mllm, [image, image, image]))
+            pending = False
+            docs += reflection[0] != "INEFFECTIVE"
+            if reflection[0] == "BACK":
+                continue
+        else:
+            res = parse_explore_rsp(ask(mllm, [image]))
+        if res[0] == "FINISH":
+            break
+        rounds += 1
+        if res[0] == "text":
+            continue
+        if merged:
+            pending = True
+        else:
+            docs += parse_reflect_rsp(ask(mllm, [image, image]))[0] != "INEFFECTIVE"
+    if pending:
+        docs += parse_reflect_rsp(ask(mllm, [image, image]))[0] != "INEFFECTIVE"
+    return rounds, docs
+
+
+print_with_color(f"{len(steps)} recorded steps, model call {args['base_cost']}s + {args['image_cost']}s per image + "
+                 f"{args['chars_per_s']:.0f} chars/s, device {args['device_cost']}s per round", "yellow")
+print_with_color(f"{'mode':<10} {'actions':>8} {'calls':>6} {'docs':>5} {'docs/call':>10} {'rounds/min':>11} "
+                 f"{'unparsable':>11}", "yellow")
+with tempfile.TemporaryDirectory() as tmp_dir:
+    for name, merged in (("separate", False), ("merged", True)):
+        path = os.path.join(tmp_dir, f"{name}.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for i, rsp in enumerate(cassette_lines(merged)):
+                f.write(json.dumps({"key": f"{name}-{i}", "response": rsp}) + "\n")
+        mllm = CachedModel(OpenAIModel("http://127.0.0.1:9", "sk-", "recorded", 0.0, 300), None, Cassette(path),
+                           "replay")
+        metrics.start_task()
+        start = time.perf_counter()
+        rounds, docs = explore(mllm, merged)
+        elapsed = (time.perf_counter() - start) / args["scale"]
+        total = metrics.task_summary()[0]["total"]
+        print_with_color(f"{name:<10} {rounds:>8} {total['calls']:>6} {docs:>5} {docs / total['calls']:>10.2f} "
+                         f"{rounds / elapsed * 60:>11.2f} {total['unparsable']:>11}", "yellow")
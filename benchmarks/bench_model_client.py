@@ -0,0 +1,66 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import requests
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+from fake_llm_server import FakeLLMServer
+from model import OpenAIModel
+from utils import print_with_color
+
+arg_desc = "AppAgent - model client latency and fault tolerance benchmark"
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=arg_desc)
+parser.add_argument("--requests", type=int, default=50)
+parser.add_argument("--delay", type=float, default=0.02, help="server side latency of every response in seconds")
+parser.add_argument("--error_rate", type=float, default=0.3)
+args = vars(parser.parse_args())
+
+PAYLOAD = {"model": "fake", "messages": [{"role": "user", "content": [{"type": "text", "text": "hi"}]}],
+           "temperature": 0.0, "max_tokens": 300}
+
+
+def legacy_call(url):
+    # A fresh connection per call and no timeout, as OpenAIModel did before it kept a session
+    response = requests.post(url, headers={"Content-Type": "application/json", "Authorization": "Bearer sk-"},
+                             json=PAYLOAD).json()
+    return "error" not in response
+
+
+def run(name, server, call):
+    latencies, failures = [], 0
+    for _ in range(args["requests"]):
+        start = time.perf_counter()
+        try:
+            ok = call()
+        except (requests.RequestException, ValueError):
+            ok = False
+        latencies.append((time.perf_counter() - start) * 1000)
+        failures += not ok
+    print_with_color(f"{name:<28} ok={args['requests'] - failures:<4} failed={failures:<4} "
+                     f"connections={len(server.connections):<4} mean={statistics.mean(latencies):8.2f} ms  "
+                     f"p50={statistics.median(latencies):8.2f} ms  max={max(latencies):8.2f} ms", "yellow")
+    server.connections.clear()
+
+
+with FakeLLMServer(delay=args["delay"]) as server:
+    print_with_color("Healthy server", "blue")
+    run("requests.post per call", server, lambda: legacy_call(server.url))
+    model = OpenAIModel(server.url, "sk-", "fake", 0.0, 300)
+    run("pooled session", server, lambda: model.post(PAYLOAD)[0] is not None)
+
+# Every failure mode the client has to survive; hangs last longer than the read timeout
+faulty = FakeLLMServer(delay=args["delay"], error_rate=args["error_rate"], retry_after=0.2, hang=2.0)
+with faulty:
+    print_with_color(f"Server failing {args['error_rate']:.0%} of requests", "blue")
+    run("requests.post per call", faulty, lambda: legacy_call(faulty.url))
+    print_with_color(f"Injected: {faulty.injected}", "yellow")
+    faulty.injected = dict.fromkeys(faulty.injected, 0)
+    model = OpenAIModel(faulty.url, "sk-", "fake", 0.0, 300, read_timeout=0.5, max_retries=5, backoff=0.05,
+                        max_backoff=0.5)
+    run("session with retries", faulty, lambda: model.post(PAYLOAD)[0] is not None)
+    print_with_color(f"Injected: {faulty.injected}", "yellow")
+    model.perf.report()
@@ -0,0 +1,79 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+import model
+from fake_llm_server import ALL_FAULTS, FakeLLMServer
+from model import OpenAIModel, metrics, parse_explore_rsp
+from utils import print_with_color
+
+arg_desc = "AppAgent - model call metrics benchmark"
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=arg_desc)
+parser.add_argument("--tasks", type=int, default=5)
+parser.add_argument("--rounds", type=int, default=10, help="model calls per task")
+parser.add_argument("--delay", type=float, default=0.02, help="server side latency of every response in seconds")
+parser.add_argument("--error_rate", type=float, default=0.2)
+parser.add_argument("--overhead_calls", type=int, default=20000)
+args = vars(parser.parse_args())
+
+model.print_with_color = lambda *_args, **_kwargs: None
+
+# Retried faults and responses that come back cut off, so that retries and parse failures show up in the totals
+faults = ("429", "500", "truncated")
+image = np.zeros((1080, 720, 3), dtype=np.uint8)
+
+with tempfile.TemporaryDirectory() as tmp_dir, \
+        FakeLLMServer(delay=args["delay"], error_rate=args["error_rate"], faults=faults, retry_after=0.05) as server:
+    mllm = OpenAIModel(server.url, "sk-", "gpt-4o-2024-08-06", 0.0, 300, max_retries=5, backoff=0.02, max_backoff=0.1)
+    summary_path = os.path.join(tmp_dir, "metrics_summary.jsonl")
+    start = time.perf_counter()
+    for task in range(args["tasks"]):
+        metrics.start_task()
+        for _ in range(args["rounds"]):
+            status, rsp = mllm.get_model_response("What is on the screen?", [image])
+            if status:
+                parse_explore_rsp(rsp)
+        task_dir = os.path.join(tmp_dir, f"task_{task}")
+        os.makedirs(task_dir)
+        metrics.write_task(os.path.join(task_dir, "metrics.json"))
+        metrics.append_summary(summary_path, task=task)
+    elapsed = time.perf_counter() - start
+
+    print_with_color(f"{args['tasks']} tasks of {args['rounds']} calls in {elapsed:.2f}s, "
+                     f"injected: { {fault: server.injected[fault] for fault in ALL_FAULTS if server.injected[fault]} }",
+                     "yellow")
+    with open(os.path.join(tmp_dir, "task_0", "metrics.json")) as f:
+        task_metrics = json.load(f)
+    print_with_color(f"task_0/metrics.json: {len(task_metrics['calls'])} calls, totals {task_metrics['total']}",
+                     "yellow")
+    print_with_color(f"First call: {task_metrics['calls'][0]}", "yellow")
+    with open(summary_path) as f:
+        runs = [json.loads(line) for line in f]
+    print_with_color(f"{'task':<6} {'calls':>6} {'retries':>8} {'unparsable':>11} {'tokens':>8} {'p95 s':>7} "
+                     f"{'cost $':>9}", "yellow")
+    for run in runs:
+        total = run["total"]
+        print_with_color(f"{run['task']:<6} {total['calls']:>6} {total['retries']:>8} {total['unparsable']:>11} "
+                         f"{total['prompt_tokens'] + total['completion_tokens']:>8} {total['p95_latency_s']:>7.3f} "
+                         f"{total['cost']:>9.4f}", "yellow")
+    process = metrics.summary()["total"]
+    # The fake server reports 1000 prompt tokens for every answered request
+    print_with_color(f"Process: {process['calls']} calls, {process['prompt_tokens']} prompt tokens for "
+                     f"{server.requests - sum(server.injected[fault] for fault in ('429', '500'))} answered requests, "
+                     f"${process['cost']:.4f} at gpt-4o prices", "yellow")
+
+# What recording a call adds to it
+call = None
+start = time.perf_counter()
+for _ in range(args["overhead_calls"]):
+    call = metrics.begin("gpt-4o")
+    metrics.finish(call, True, "Action: FINISH")
+print_with_color(f"Recording overhead: {(time.perf_counter() - start) / args['overhead_calls'] * 1e6:.2f} us per call",
+                 "yellow")
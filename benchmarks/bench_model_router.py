@@ -0,0 +1,55 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+import model
+from fake_llm_server import FakeLLMServer
+from model import OpenAIModel, RoutedModel, parse_reflect_rsp
+from utils import print_with_color
+
+arg_desc = "AppAgent - model routing benchmark"
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=arg_desc)
+parser.add_argument("--requests", type=int, default=30)
+parser.add_argument("--strong_delay", type=float, default=0.4, help="latency of the default model in seconds")
+parser.add_argument("--cheap_delay", type=float, default=0.1, help="latency of the routed model in seconds")
+parser.add_argument("--garbled_rate", type=float, default=0.2,
+                    help="share of routed responses that are cut short and fail to parse")
+args = vars(parser.parse_args())
+
+REFLECTION = "Decision: CONTINUE\n" \
+             "Thought: The tap opened the settings page, which is not what the task needs yet.\n" \
+             "Documentation: Tapping this button opens the settings page of the app."
+# Keep the request costs and fallback notes out of the table
+model.print_with_color = lambda *_args, **_kwargs: None
+
+
+def run(name, reflect):
+    latencies, parsed = [], 0
+    for i in range(args["requests"]):
+        start = time.perf_counter()
+        status, rsp = reflect.get_model_response(f"reflection {i}", [])
+        latencies.append((time.perf_counter() - start) * 1000)
+        parsed += status and parse_reflect_rsp(rsp)[0] != "ERROR"
+    print_with_color(f"{name:<26} {statistics.mean(latencies):>8.1f} {max(latencies):>8.1f} "
+                     f"{parsed:>4}/{args['requests']}", "yellow")
+
+
+strong_server = FakeLLMServer(response=REFLECTION, delay=args["strong_delay"])
+cheap_server = FakeLLMServer(response=REFLECTION, delay=args["cheap_delay"], error_rate=args["garbled_rate"],
+                             faults=("truncated",))
+with strong_server, cheap_server:
+    strong = OpenAIModel(strong_server.url, "sk-", "strong", 0.0, 300)
+    cheap = OpenAIModel(cheap_server.url, "sk-", "cheap", 0.0, 300)
+    print_with_color(f"{args['requests']} reflections, default model {args['strong_delay']}s, routed model "
+                     f"{args['cheap_delay']}s with {args['garbled_rate']:.0%} unusable", "yellow")
+    print_with_color(f"{'reflections on':<26} {'mean ms':>8} {'max ms':>8} {'parsed':>9}", "yellow")
+    unrouted = RoutedModel(strong)
+    run("default model", unrouted.route("reflect"))
+    routed = RoutedModel(strong, {"reflect": cheap})
+    run("routed model, fallback", routed.route("reflect"))
+    for name, stats in routed.stats()["routes"].items():
+        print_with_color(f"route {name}: {stats}", "yellow")
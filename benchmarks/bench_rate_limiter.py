@@ -0,0 +1,57 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+import model
+from fake_llm_server import FakeLLMServer
+from model import OpenAIModel
+from rate_limiter import RateLimiter
+from utils import print_with_color
+
+arg_desc = "AppAgent - request pacing benchmark"
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=arg_desc)
+parser.add_argument("--rounds", type=int, default=12)
+parser.add_argument("--delay", type=float, default=0.1, help="model latency in seconds")
+parser.add_argument("--interval", type=float, default=0.5, help="the fixed REQUEST_INTERVAL sleep being replaced")
+parser.add_argument("--window", type=float, default=3.0, help="length of the quota window, standing in for a minute")
+parser.add_argument("--rpm", type=int, default=20, help="requests the server admits per window")
+args = vars(parser.parse_args())
+
+PAYLOAD = {"model": "fake", "messages": [{"role": "user", "content": [{"type": "text", "text": "hi"}]}]}
+# Keep the retry messages of the unpaced client out of the table
+model.print_with_color = lambda *_args, **_kwargs: None
+
+
+class Unpaced(RateLimiter):
+    # What the loops did before: no client side pacing, and the quota headers are ignored
+    def update(self, headers):
+        pass
+
+
+def run(name, rpm, limiter, interval):
+    with FakeLLMServer(delay=args["delay"], rpm=rpm, window=args["window"]) as server:
+        client = OpenAIModel(server.url, "sk-", "fake", 0.0, 300, max_retries=8, backoff=0.1, max_backoff=1.0,
+                             rate_limiter=limiter)
+        start = time.perf_counter()
+        failed = 0
+        for _ in range(args["rounds"]):
+            body, _ = client.post(PAYLOAD)
+            failed += body is None
+            time.sleep(interval)
+        elapsed = time.perf_counter() - start
+    waited = sum(client.perf.samples["rate_limit_wait"])
+    print_with_color(f"{name:<34} {elapsed:>8.2f} {server.throttled:>10} {failed:>7} {waited:>9.2f}", "yellow")
+
+
+print_with_color(f"{args['rounds']} rounds, {args['delay']}s model latency, quota {args['rpm']} requests per "
+                 f"{args['window']}s", "yellow")
+print_with_color(f"{'pacing':<34} {'wall s':>8} {'throttled':>10} {'failed':>7} {'waited s':>9}", "yellow")
+run("fixed sleep after every request", args["rpm"], Unpaced(), args["interval"])
+run("token bucket, quota from headers", args["rpm"], RateLimiter(1, period=args["window"]), 0.0)
+# A quota far below the request rate: the limiter spreads the requests out instead of running into 429s
+tight = max(1, args["rounds"] // 4)
+run(f"no pacing, quota {tight}", tight, Unpaced(), 0.0)
+run(f"token bucket, quota {tight}", tight, RateLimiter(tight, period=args["window"]), 0.0)
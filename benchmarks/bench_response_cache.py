@@ -0,0 +1,64 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+import model
+from fake_llm_server import FakeLLMServer
+from frame import Frame
+from model import CachedModel, OpenAIModel
+from response_cache import Cassette, ResponseCache
+from utils import print_with_color
+
+arg_desc = "AppAgent - model response cache and record/replay benchmark"
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=arg_desc)
+parser.add_argument("--rounds", type=int, default=20)
+parser.add_argument("--delay", type=float, default=0.3, help="model latency in seconds")
+args = vars(parser.parse_args())
+
+# Keep the request costs out of the table
+model.print_with_color = lambda *_args, **_kwargs: None
+
+
+def screens(clock):
+    # One distinct 1080x2400 screen per round, with a status bar clock that differs between runs
+    for i in range(args["rounds"]):
+        image = np.full((2400, 1080, 3), 255, dtype=np.uint8)
+        cv2.rectangle(image, (40, 200 + i * 100), (1040, 280 + i * 100), (200, 120, 40), -1)
+        cv2.putText(image, clock, (40, 60), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 0, 0), 2)
+        yield f"Round {i}: what should be done next?", Frame(image=image)
+
+
+def run(name, mllm, clock):
+    start = time.perf_counter()
+    responses = []
+    for prompt, frame in screens(clock):
+        status, rsp = mllm.get_model_response(prompt, [frame])
+        responses.append(rsp if status else None)
+    elapsed = time.perf_counter() - start
+    print_with_color(f"{name:<34} {elapsed:>8.2f} {elapsed / args['rounds'] * 1000:>10.1f} "
+                     f"{getattr(mllm, 'sent', args['rounds']):>6}", "yellow")
+    return responses
+
+
+with FakeLLMServer(delay=args["delay"]) as server, tempfile.TemporaryDirectory() as tmp_dir:
+    client = OpenAIModel(server.url, "sk-", "fake", 0.0, 300)
+    cache_dir = os.path.join(tmp_dir, "cache")
+    cassette_path = os.path.join(tmp_dir, "run.jsonl")
+    print_with_color(f"{args['rounds']} rounds, {args['delay']}s model latency", "yellow")
+    print_with_color(f"{'mode':<34} {'wall s':>8} {'ms/round':>10} {'sent':>6}", "yellow")
+    live = run("no cache", client, "12:00")
+    recorded = run("record", CachedModel(client, ResponseCache(cache_dir), Cassette(cassette_path), "record"), "12:00")
+    cached = run("live, rerun with the cache", CachedModel(client, ResponseCache(cache_dir)), "12:00")
+    replayed = run("replay, same screens", CachedModel(client, None, Cassette(cassette_path), "replay"), "12:00")
+    # Another clock changes every key, so the replay falls back to the recorded order
+    reordered = run("replay, clock changed", CachedModel(client, None, Cassette(cassette_path), "replay"), "12:01")
+    assert live == recorded == cached == replayed == reordered
+    bounded = ResponseCache(cache_dir, max_bytes=4096)
+    print_with_color(f"Cache bounded to 4 KB: {bounded.stats()}", "yellow")
@@ -0,0 +1,59 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+import model
+from fake_llm_server import FakeLLMServer
+from model import OpenAIModel, parse_explore_rsp, parse_summary
+from utils import print_with_color
+
+arg_desc = "AppAgent - streamed model response benchmark"
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=arg_desc)
+parser.add_argument("--rounds", type=int, default=5)
+parser.add_argument("--delay", type=float, default=0.5, help="time to the first token in seconds")
+parser.add_argument("--token_delay", type=float, default=0.02, help="time between tokens in seconds")
+args = vars(parser.parse_args())
+
+# Shaped like a typical task response: a long observation and thought ahead of the action
+RESPONSE = "Observation: " + " ".join(["The screen shows a list of settings with a search bar on top."] * 6) + "\n" \
+           "Thought: " + " ".join(["To open the display settings I should tap the matching entry."] * 5) + "\n" \
+           "Action: tap(7)\n" \
+           "Summary: I opened the settings app and tapped the display entry to change the brightness of the screen."
+# Keep the parsed responses and request costs out of the table
+model.print_with_color = lambda *_args, **_kwargs: None
+
+
+def blocking_round(client):
+    start = time.perf_counter()
+    status, rsp = client.get_model_response("prompt", [])
+    res = parse_explore_rsp(rsp)
+    elapsed = time.perf_counter() - start
+    return res, elapsed, elapsed
+
+
+def streamed_round(client):
+    start = time.perf_counter()
+    stream = client.stream_model_response("prompt", [])
+    status, rsp = stream.wait_for_line("Action:")
+    res = parse_explore_rsp(rsp, partial=True)
+    to_action = time.perf_counter() - start
+    status, rsp = stream.result()
+    res[-1] = parse_summary(rsp)
+    return res, to_action, time.perf_counter() - start
+
+
+with FakeLLMServer(response=RESPONSE, delay=args["delay"], token_delay=args["token_delay"]) as server:
+    client = OpenAIModel(server.url, "sk-", "fake", 0.0, 300)
+    print_with_color(f"{len(RESPONSE.split())} tokens, first after {args['delay']}s, then every "
+                     f"{args['token_delay']}s", "yellow")
+    print_with_color(f"{'mode':<12} {'to action s':>12} {'to completion s':>16}  action", "yellow")
+    for name, run_round in (("blocking", blocking_round), ("streamed", streamed_round)):
+        results = [run_round(client) for _ in range(args["rounds"])]
+        res = results[-1][0]
+        assert res == results[0][0] and res[-1] == parse_summary(RESPONSE), res
+        print_with_color(f"{name:<12} {statistics.mean(r[1] for r in results):>12.3f} "
+                         f"{statistics.mean(r[2] for r in results):>16.3f}  {res[:-1]}", "yellow")
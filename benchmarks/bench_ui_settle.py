@@ -0,0 +1,91 @@
+import argparse
+import os
+import random
+import struct
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+import and_controller
+from and_controller import AndroidController
+from utils import print_with_color
+
+arg_desc = "AppAgent - post-action settle time benchmark"
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=arg_desc)
+parser.add_argument("--image", default=os.path.join(os.path.dirname(__file__), "..", "assets", "demo.png"))
+parser.add_argument("--actions", type=int, default=20)
+parser.add_argument("--probe_cost", type=float, default=0.08, help="seconds one raw screencap takes over adb")
+parser.add_argument("--seed", type=int, default=0)
+args = vars(parser.parse_args())
+
+
+class SimulatedScreen:
+    """A device screen that slides to the next page over `duration` seconds after every action, and whose status bar
+    clock ticks every second."""
+
+    def __init__(self, image):
+        self.pages = [image, cv2.flip(image, 1)]
+        self.page = 0
+        self.started = time.perf_counter()
+        self.duration = 0.0
+
+    def act(self, duration):
+        self.page = 1 - self.page
+        self.started = time.perf_counter()
+        self.duration = duration
+
+    def render(self):
+        now = time.perf_counter()
+        current, previous = self.pages[self.page], self.pages[1 - self.page]
+        progress = min(1.0, (now - self.started) / self.duration) if self.duration else 1.0
+        shift = int(current.shape[1] * (1 - progress))
+        image = np.concatenate([previous[:, current.shape[1] - shift:], current[:, :current.shape[1] - shift]], axis=1)
+        image = image.copy()
+        cv2.putText(image, time.strftime("%H:%M:%S"), (20, 40), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (255, 255, 255), 2)
+        return image
+
+    def screencap(self):
+        time.sleep(args["probe_cost"])
+        rgba = cv2.cvtColor(self.render(), cv2.COLOR_BGR2RGBA)
+        height, width = rgba.shape[:2]
+        return struct.pack("<III", width, height, 1) + rgba.tobytes()
+
+
+screen = SimulatedScreen(cv2.imread(args["image"]))
+and_controller.configs["ADB_SHELL_SESSION"] = False
+and_controller.execute_adb = lambda command: "Physical size: 1080x2400"
+and_controller.execute_adb_binary = lambda adb_args: screen.screencap()
+controller = AndroidController("emulator-5554")
+
+# From instant toggles to slow page loads
+rng = random.Random(args["seed"])
+durations = [rng.choice([0.0, 0.0, 0.2, 0.35, 0.5, 1.5, 2.5]) for _ in range(args["actions"])]
+actions = [rng.choice(["tap", "swipe", "long_press"]) for _ in durations]
+
+print_with_color(f"{args['actions']} actions, transitions of {min(durations):.2f}-{max(durations):.2f}s, "
+                 f"{args['probe_cost'] * 1000:.0f} ms per screencap", "yellow")
+print_with_color(f"{'wait':<26} {'total wait s':>13} {'mean s':>8} {'mid-transition captures':>24}", "yellow")
+for fixed in (1.0, 3.0):
+    # A fixed sleep captures mid-transition whenever the transition takes longer than the sleep
+    mid = sum(duration > fixed for duration in durations)
+    print_with_color(f"{f'sleep {fixed:.0f}s':<26} {fixed * len(durations):>13.2f} {fixed:>8.2f} {mid:>24}", "yellow")
+
+waited, mid = [], 0
+by_duration = {}
+for action, duration in zip(actions, durations):
+    screen.act(duration)
+    waited.append(controller.wait_for_idle(action))
+    mid += time.perf_counter() - screen.started < duration
+    by_duration.setdefault(duration, []).append(waited[-1])
+print_with_color(f"{'wait_for_idle':<26} {sum(waited):>13.2f} {sum(waited) / len(waited):>8.2f} {mid:>24}", "yellow")
+for duration, settle_times in sorted(by_duration.items()):
+    print_with_color(f"{f'  {duration:.2f}s transition':<26} {sum(settle_times):>13.2f} "
+                     f"{sum(settle_times) / len(settle_times):>8.2f}", "yellow")
+for name, summary in controller.perf.summary().items():
+    if name.startswith("settle_"):
+        print_with_color(f"{name:<26} n={summary['count']:<4} mean={summary['mean_ms']:8.1f} ms  "
+                         f"max={summary['max_ms']:8.1f} ms", "yellow")
@@ -0,0 +1,66 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+from and_controller import hierarchy_digest
+from frame import Frame, hamming
+from synthetic_ui import make_hierarchy
+from utils import print_with_color
+
+arg_desc = "AppAgent - skipping the reflection of unchanged screens benchmark"
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=arg_desc)
+parser.add_argument("--nodes", type=int, default=2000)
+parser.add_argument("--repeat", type=int, default=20)
+parser.add_argument("--tolerance", type=int, default=2)
+parser.add_argument("--reflect_cost", type=float, default=4.0, help="seconds one reflection model call takes")
+args = vars(parser.parse_args())
+
+CLOCK = b'<node index="0" text="%s" class="android.widget.TextClock" package="com.example.feed" bounds="[0,0][200,60]" />'
+SPINNER = b'<node index="1" text="" class="android.widget.ProgressBar" package="com.example.feed" ' \
+          b'bounds="[%d,900][%d,1000]" />'
+
+xml = make_hierarchy(args["nodes"])
+
+
+def variant(clock="12:00", spinner=500, tapped=False):
+    """The synthetic screen with a clock and a spinner, and with the first clickable node checked if `tapped`."""
+    extra = CLOCK % clock.encode() + SPINNER % (spinner, spinner + 100)
+    screen = xml.replace(b"</hierarchy>", extra + b"</hierarchy>")
+    if tapped:
+        screen = screen.replace(b'clickable="true"', b'clickable="true" checked="true"', 1)
+    return screen
+
+
+rng = np.random.default_rng(0)
+image = rng.integers(0, 256, (2400, 1080, 3), dtype=np.uint8)
+moved = image.copy()
+moved[1200:1400, 100:900] = 255 - moved[1200:1400, 100:900]
+clock = image.copy()
+clock[0:60, 0:200] = rng.integers(0, 256, (60, 200, 3), dtype=np.uint8)
+
+cases = [
+    ("identical", image, variant(), False),
+    ("clock and spinner moved", clock, variant("12:01", 520), False),
+    ("checkbox toggled", image, variant(tapped=True), True),
+    ("content changed", moved, variant(), True),
+]
+before = Frame(image=image)
+print_with_color(f"{'after the action':<26} {'hash bits':>10} {'same xml':>9} {'skipped':>8} {'expected':>9} "
+                 f"{'check ms':>9}", "yellow")
+for name, after_image, after_xml, changed in cases:
+    start = time.perf_counter()
+    for _ in range(args["repeat"]):
+        after = Frame(image=after_image)
+        bits = hamming(before.dhash(16), after.dhash(16))
+        same_xml = hierarchy_digest(variant()) == hierarchy_digest(after_xml)
+    check_ms = (time.perf_counter() - start) / args["repeat"] * 1000
+    skipped = bits <= args["tolerance"] and same_xml
+    print_with_color(f"{name:<26} {bits:>10} {str(same_xml):>9} {str(skipped):>8} {str(not changed):>9} "
+                     f"{check_ms:>9.1f}", "yellow" if skipped != changed else "red")
+print_with_color(f"A skipped reflection saves about {args['reflect_cost']:.1f}s of model latency and one two image "
+                 f"request", "yellow")
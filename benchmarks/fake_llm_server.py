@@ -0,0 +1,244 @@
+import argparse
+import json
+import random
+import re
+import socket
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_RESPONSE = "Observation: The screen shows the home page of the app.\n" \
+                   "Thought: The task has been completed.\n" \
+                   "Action: FINISH\n" \
+                   "Summary: The task was completed on the home page."
+FAULTS = ("429", "500", "503", "html", "hang", "reset")
+# Faults that are only injected when asked for
+ALL_FAULTS = FAULTS + ("truncated",)
+
+
+class FakeLLMServer:
+    """A local stand-in for an OpenAI compatible chat completion endpoint that answers every request with the same
+    response after `delay` seconds, and fails a share `error_rate` of them with one of `faults`:
+
+    429 / 500 / 503   the status code with a JSON error body (429 also sends Retry-After: `retry_after`)
+    html              a 502-like HTML page with status 200, as returned by some proxies
+    hang              no answer for `hang` seconds
+    reset             the connection is closed without an answer
+    truncated         a normal answer with only the first half of the response, as a weaker model might give
+
+    With `rpm` set, requests beyond that many in the last `window` seconds are refused with 429, and every answer
+    carries x-ratelimit-* headers the way OpenAI reports its quota.
+
+    Requests with "stream": true are answered as server-sent events, one word of the response every `token_delay`
+    seconds after the first one arrives at `delay`. With `streaming` off the flag is ignored and the whole completion
+    is sent as JSON, as some OpenAI compatible servers do.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, response=DEFAULT_RESPONSE, delay=0.0, jitter=0.0, error_rate=0.0,
+                 faults=FAULTS, retry_after=1.0, hang=30.0, rpm=0, window=60.0, token_delay=0.0, seed=0,
+                 streaming=True):
+        self.response = response
+        self.delay = delay
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.faults = faults
+        self.retry_after = retry_after
+        self.hang = hang
+        self.rpm = rpm
+        self.window = window
+        self.token_delay = token_delay
+        self.streaming = streaming
+        self.accepted = deque()
+        self.throttled = 0
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = set()
+        self.injected = {fault: 0 for fault in ALL_FAULTS}
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def pick_fault(self):
+        with self.lock:
+            self.requests += 1
+            if self.random.random() >= self.error_rate:
+                return None
+            fault = self.random.choice(self.faults)
+            self.injected[fault] += 1
+            return fault
+
+    def admit(self):
+        """Apply the request quota and return whether the request is admitted and the rate limit headers."""
+        if not self.rpm:
+            return True, []
+        with self.lock:
+            now = time.monotonic()
+            while self.accepted and self.accepted[0] <= now - self.window:
+                self.accepted.popleft()
+            admitted = len(self.accepted) < self.rpm
+            if admitted:
+                self.accepted.append(now)
+            else:
+                self.throttled += 1
+            reset = self.accepted[0] + self.window - now if self.accepted else 0.0
+            headers = [("x-ratelimit-limit-requests", str(self.rpm)),
+                       ("x-ratelimit-remaining-requests", str(self.rpm - len(self.accepted))),
+                       ("x-ratelimit-reset-requests", f"{int(reset * 1000)}ms")]
+            return admitted, headers
+
+    def completion(self, request, content=None):
+        return {
+            "id": f"chatcmpl-{self.requests}",
+            "object": "chat.completion",
+            "model": request.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content or self.response},
+                         "finish_reason": "stop"}],
+            "usage": self.usage()
+        }
+
+    def usage(self):
+        completion_tokens = len(self.response.split())
+        return {"prompt_tokens": 1000, "completion_tokens": completion_tokens, "total_tokens": 1000 + completion_tokens}
+
+    def chunks(self, request):
+        """The server-sent events of a streamed completion, one word of the response each."""
+        base = {"id": f"chatcmpl-{self.requests}", "object": "chat.completion.chunk",
+                "model": request.get("model", "fake")}
+        words = re.findall(r"\S+\s*", self.response)
+        for i, word in enumerate(words):
+            choice = {"index": 0, "delta": {"content": word}, "finish_reason": "stop" if i == len(words) - 1 else None}
+            yield dict(base, choices=[choice])
+        if (request.get("stream_options") or {}).get("include_usage"):
+            yield dict(base, choices=[], usage=self.usage())
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # Like real API front ends, answer without waiting for the client's delayed ACK on kept-alive
+                # connections
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def send_body(self, status, body, content_type="application/json", headers=()):
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up waiting, e.g. after a hang
+                    self.close_connection = True
+
+            def send_events(self, request, headers):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                events = [f"data: {json.dumps(chunk)}\n\n" for chunk in fake.chunks(request)] + ["data: [DONE]\n\n"]
+                try:
+                    for i, event in enumerate(events):
+                        if i and fake.token_delay:
+                            time.sleep(fake.token_delay)
+                        data = event.encode("utf-8")
+                        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                        self.wfile.flush()
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True
+
+            def do_POST(self):
+                with fake.lock:
+                    fake.connections.add(self.client_address)
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    request = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    request = {}
+                admitted, quota_headers = fake.admit()
+                if not admitted:
+                    error = {"error": {"message": "Rate limit reached for requests", "type": "requests"}}
+                    self.send_body(429, json.dumps(error), headers=quota_headers)
+                    return
+                fault = fake.pick_fault()
+                time.sleep(max(0.0, fake.delay + fake.random.uniform(-fake.jitter, fake.jitter)))
+                if fault == "reset":
+                    self.close_connection = True
+                    return
+                if fault == "hang":
+                    time.sleep(fake.hang)
+                if fault in ("429", "500", "503"):
+                    error = {"error": {"message": f"Injected {fault} error", "type": "fake_error"}}
+                    headers = [("Retry-After", str(fake.retry_after))] if fault == "429" else []
+                    self.send_body(int(fault), json.dumps(error), headers=headers)
+                elif fault == "html":
+                    self.send_body(200, "<html><body><h1>502 Bad Gateway</h1></body></html>", "text/html")
+                elif fault == "truncated":
+                    content = fake.response[:len(fake.response) // 2]
+                    self.send_body(200, json.dumps(fake.completion(request, content)), headers=quota_headers)
+                elif request.get("stream") and fake.streaming:
+                    self.send_events(request, quota_headers)
+                else:
+                    # The whole completion takes as long to generate as its stream would
+                    time.sleep(fake.token_delay * max(0, len(fake.response.split()) - 1))
+                    self.send_body(200, json.dumps(fake.completion(request)), headers=quota_headers)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    arg_desc = "AppAgent - local stand-in for the model API"
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=arg_desc)
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--faults", default=",".join(FAULTS))
+    parser.add_argument("--retry_after", type=float, default=1.0)
+    parser.add_argument("--hang", type=float, default=30.0)
+    parser.add_argument("--rpm", type=int, default=0)
+    parser.add_argument("--token_delay", type=float, default=0.0)
+    args = vars(parser.parse_args())
+    server = FakeLLMServer(port=args["port"], delay=args["delay"], jitter=args["jitter"],
+                           error_rate=args["error_rate"], faults=tuple(args["faults"].split(",")),
+                           retry_after=args["retry_after"], hang=args["hang"], rpm=args["rpm"],
+                           token_delay=args["token_delay"])
+    print(f"Serving fake chat completions on {server.url}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        server.server.server_close()
@@ -0,0 +1,78 @@
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+from and_controller import UiEvent, UiEventStream
+from utils import print_with_color
+
+arg_desc = "AppAgent - replay of a recorded `uiautomator events` stream"
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=arg_desc)
+parser.add_argument("--events", default=os.path.join(os.path.dirname(__file__), "fixtures", "uiautomator_events.txt"))
+parser.add_argument("--quiet_ms", type=int, default=300, help="pause in events after which the screen counts as settled")
+parser.add_argument("--min_ms", type=int, default=500, help="least time the screen takes to settle")
+parser.add_argument("--first_timeout", type=float, default=1.0, help="seconds to wait for the first event of an action")
+parser.add_argument("--gap", type=float, default=1.0, help="pause in seconds that separates the events of two actions")
+args = vars(parser.parse_args())
+
+with open(args["events"], "r", encoding="utf-8") as f:
+    lines = f.read().splitlines()
+
+# Every event line of the recording has to parse, everything else has to be skipped
+events, unparsed = [], []
+for line in lines:
+    event = UiEvent.parse(line)
+    if event is not None:
+        events.append(event)
+    elif line.startswith("EventType: "):
+        unparsed.append(line)
+print_with_color(f"{len(lines)} lines, {len(events)} events, {len(unparsed)} event lines not parsed", "yellow")
+for line in unparsed:
+    print_with_color(f"  {line[:120]}", "red")
+for (event_type, package), count in sorted(Counter((e.event_type, e.package) for e in events).items()):
+    print_with_color(f"  {event_type:<36} {package:<24} {count}", "yellow")
+print_with_color(f"Texts: {[event.text for event in events if event.text]}", "yellow")
+
+
+def timed_lines(start):
+    """The recorded lines, each at the time it was printed relative to the first event, which is printed at `start`."""
+    for line in lines:
+        event = UiEvent.parse(line)
+        if event is not None:
+            time.sleep(max(0.0, start + (event.event_time - events[0].event_time) / 1000 - time.monotonic()))
+        yield line
+    # A live stream stays open after the last event
+    time.sleep(args["gap"])
+
+
+# The actions of the recording start wherever the events pause for longer than `gap`
+screen_events = [e for e in events if e.changes_screen and e.package != "com.android.systemui"]
+bursts = [[screen_events[0]]]
+for previous, event in zip(screen_events, screen_events[1:]):
+    if event.event_time - previous.event_time > args["gap"] * 1000:
+        bursts.append([])
+    bursts[-1].append(event)
+
+replay_start = time.monotonic() + 0.5
+stream = UiEventStream(timed_lines(replay_start))
+quiet = args["quiet_ms"] / 1000
+too_early = 0
+print_with_color(f"{'action':<8} {'events':>7} {'updating ms':>12} {'settled after ms':>17} {'too early':>10} "
+                 f"{'sleep 1s late by ms':>20}", "yellow")
+for i, burst in enumerate(bursts):
+    # The action is taken just before the first event of its burst, the screen is settled once the burst ends
+    action = replay_start + (burst[0].event_time - events[0].event_time) / 1000 - 0.01
+    time.sleep(max(0.0, action - time.monotonic()))
+    start = time.monotonic()
+    stream.wait_for_quiet(quiet, timeout=5, first_timeout=args["first_timeout"], min_wait=args["min_ms"] / 1000)
+    settled = (time.monotonic() - start) * 1000
+    updating = burst[-1].event_time - burst[0].event_time
+    early = "yes" if settled < updating else "no"
+    too_early += settled < updating
+    print_with_color(f"{i:<8} {len(burst):>7} {updating:>12} {settled:>17.0f} {early:>10} "
+                     f"{max(0, 1000 - updating):>20}", "yellow")
+print_with_color(f"Stream: {stream.stats()}", "yellow")
+sys.exit(1 if unparsed or too_early else 0)
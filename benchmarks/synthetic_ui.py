@@ -0,0 +1,66 @@
+import random
+from xml.sax.saxutils import quoteattr
+
+WIDTH, HEIGHT = 1080, 2400
+CLASSES = ["android.widget.TextView", "android.widget.ImageView", "android.widget.Button",
+           "android.view.ViewGroup", "android.widget.LinearLayout"]
+
+
+def node_xml(index, cls, bounds, clickable=False, focusable=False, resource_id="", content_desc="", children=""):
+    (x1, y1), (x2, y2) = bounds
+    attrs = {
+        "index": str(index),
+        "text": "",
+        "resource-id": resource_id,
+        "class": cls,
+        "package": "com.example.feed",
+        "content-desc": content_desc,
+        "clickable": "true" if clickable else "false",
+        "focusable": "true" if focusable else "false",
+        "bounds": f"[{x1},{y1}][{x2},{y2}]",
+    }
+    attr_str = " ".join(f"{k}={quoteattr(v)}" for k, v in attrs.items())
+    if children:
+        return f"<node {attr_str}>{children}</node>"
+    return f"<node {attr_str} />"
+
+
+def make_hierarchy(n_nodes, depth=6, max_fanout=3, seed=0):
+    """Build a feed-like uiautomator dump with roughly `n_nodes` nodes.
+
+    The screen is a scrolling list of rows; every row nests `depth` levels of layouts with up to `max_fanout` children
+    each, which mirrors the deep, repetitive trees of the YouTube and Temu home feeds.
+    """
+    rng = random.Random(seed)
+    rows = []
+    count = 0
+    row_index = 0
+    while count < n_nodes:
+        top = rng.randrange(0, HEIGHT - 200)
+        left = rng.randrange(0, WIDTH - 300)
+        row_w, row_h = rng.randrange(300, WIDTH - left + 1), rng.randrange(100, 200)
+
+        def build(level, x1, y1, x2, y2, index):
+            nonlocal count
+            count += 1
+            if level == depth or count >= n_nodes:
+                cls = rng.choice(CLASSES[:3])
+                clickable = rng.random() < 0.4
+                return node_xml(index, cls, ((x1, y1), (x2, y2)), clickable, clickable or rng.random() < 0.2,
+                                f"com.example.feed:id/item_{rng.randrange(50)}" if rng.random() < 0.6 else "",
+                                f"item {index}" if rng.random() < 0.3 else "")
+            children = []
+            fanout = rng.randrange(1, max_fanout + 1)
+            w = max((x2 - x1) // fanout, 1)
+            for k in range(fanout):
+                children.append(build(level + 1, x1 + k * w, y1, x1 + (k + 1) * w, y2, k))
+            return node_xml(index, CLASSES[3 + level % 2], ((x1, y1), (x2, y2)),
+                            clickable=rng.random() < 0.1, children="".join(children))
+
+        rows.append(build(1, left, top, left + row_w, top + row_h, row_index))
+        row_index += 1
+    body = node_xml(0, "androidx.recyclerview.widget.RecyclerView", ((0, 0), (WIDTH, HEIGHT)),
+                    focusable=True, resource_id="com.example.feed:id/list", children="".join(rows))
+    root = node_xml(0, "android.widget.FrameLayout", ((0, 0), (WIDTH, HEIGHT)), children=body)
+    return ("<?xml version='1.0' encoding='UTF-8' standalone='yes' ?>"
+            f"<hierarchy rotation=\"0\">{root}</hierarchy>").encode("utf-8")
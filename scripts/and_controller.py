@@ -1,9 +1,22 @@
+import atexit
+import hashlib
+import io
 import os
+import queue
 import subprocess
+import sys
+import threading
+import time
+import uuid
 import xml.etree.ElementTree as ET
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 
 from config import load_config
-from utils import print_with_color
+from frame import Frame, hamming, writer, write_bytes
+from utils import print_with_color, PerfStats
 
 
 configs = load_config()
@@ -16,6 +29,124 @@ class AndroidElement:
         self.attrib = attrib
 
 
+ATTRIB_FLAGS = {"clickable": 1, "focusable": 2, "long-clickable": 4, "scrollable": 8, "checkable": 16}
+
+
+class ElementView:
+    __slots__ = ("table", "index")
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def uid(self):
+        return self.table.uids[self.index]
+
+    @property
+    def bbox(self):
+        x1, y1, x2, y2 = self.table.bounds[self.index].tolist()
+        return (x1, y1), (x2, y2)
+
+    @property
+    def attrib(self):
+        return self.table.attribs[self.index]
+
+    @property
+    def flags(self):
+        return int(self.table.flags[self.index])
+
+    @property
+    def center(self):
+        x, y = self.table.centers[self.index].tolist()
+        return x, y
+
+
+class ElementTable:
+    """Column-oriented list of UI elements.
+
+    Bounds, centers and areas live in NumPy arrays so that proximity and hit-testing queries run over the whole
+    screen at once. Indexing returns a lightweight ElementView exposing the same uid/bbox/attrib fields as
+    AndroidElement, so code written against a list of elements keeps working.
+    """
+
+    def __init__(self, uids=(), bounds=(), attribs=(), flags=()):
+        self.uids = [sys.intern(uid) for uid in uids]
+        self.attribs = [sys.intern(attrib) for attrib in attribs]
+        self.bounds = np.asarray(bounds, dtype=np.int32).reshape(-1, 4)
+        self.flags = np.asarray(flags, dtype=np.uint8).reshape(-1)
+        self.centers = (self.bounds[:, :2] + self.bounds[:, 2:]) // 2
+        self.areas = (self.bounds[:, 2] - self.bounds[:, 0]).astype(np.int64) * (self.bounds[:, 3] - self.bounds[:, 1])
+
+    @classmethod
+    def from_elements(cls, elem_list):
+        return cls([e.uid for e in elem_list], [e.bbox[0] + e.bbox[1] for e in elem_list],
+                   [e.attrib for e in elem_list], [ATTRIB_FLAGS.get(e.attrib, 0) for e in elem_list])
+
+    def __len__(self):
+        return len(self.uids)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("element index out of range")
+        return ElementView(self, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield ElementView(self, i)
+
+    def take(self, indices):
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+        return ElementTable([self.uids[i] for i in indices], self.bounds[indices],
+                            [self.attribs[i] for i in indices], self.flags[indices])
+
+    def exclude(self, uids):
+        """Return the table without the elements whose uid is in `uids`."""
+        if not any(uid in uids for uid in self.uids):
+            return self
+        return self.take([i for i, uid in enumerate(self.uids) if uid not in uids])
+
+    def concat(self, other):
+        return ElementTable(self.uids + other.uids, np.concatenate([self.bounds, other.bounds]),
+                            self.attribs + other.attribs, np.concatenate([self.flags, other.flags]))
+
+    def near(self, points, dist, chunk=4096):
+        """Return a mask telling, for each (x, y) in `points`, whether any element center is within `dist` of it."""
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        mask = np.zeros(len(points), dtype=bool)
+        if not len(self) or not len(points):
+            return mask
+        centers = self.centers.astype(np.int64)
+        for start in range(0, len(points), chunk):
+            diff = points[start:start + chunk, None, :] - centers[None, :, :]
+            mask[start:start + chunk] = ((diff ** 2).sum(axis=2) <= dist * dist).any(axis=1)
+        return mask
+
+    def dedupe(self, dist):
+        """Drop every element whose center is within `dist` of an earlier kept element, keeping the table order."""
+        if len(self) < 2:
+            return self
+        diff = self.centers[:, None, :].astype(np.int64) - self.centers[None, :, :]
+        close = (diff ** 2).sum(axis=2) <= dist * dist
+        keep = np.ones(len(self), dtype=bool)
+        for i in range(len(self)):
+            if keep[i]:
+                keep[i + 1:] &= ~close[i, i + 1:]
+        return self.take(np.flatnonzero(keep))
+
+    def contains(self, x, y):
+        return (self.bounds[:, 0] <= x) & (x <= self.bounds[:, 2]) & (self.bounds[:, 1] <= y) & (y <= self.bounds[:, 3])
+
+    def element_at(self, x, y):
+        """Return the index of the smallest element containing (x, y), or -1 if there is none."""
+        hits = np.flatnonzero(self.contains(x, y))
+        if not len(hits):
+            return -1
+        return int(hits[np.argmin(self.areas[hits])])
+
+
 def execute_adb(adb_command):
     # print(adb_command)
     result = subprocess.run(adb_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
@@ -26,6 +157,294 @@ def execute_adb(adb_command):
     return "ERROR"
 
 
+def execute_adb_binary(adb_args):
+    result = subprocess.run(adb_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode == 0:
+        return result.stdout
+    print_with_color(f"Command execution failed: {' '.join(adb_args)}", "red")
+    print_with_color(result.stderr.decode("utf-8", errors="replace"), "red")
+    return "ERROR"
+
+
+class AdbShellSession:
+    """A long-lived `adb -s <device> shell` process that commands are written to over stdin.
+
+    Every command is followed by a unique marker line carrying its exit status, so the output of one command can be
+    told apart from the next without starting a new shell. A dead or hung process is replaced transparently.
+    """
+
+    def __init__(self, device, timeout=30):
+        self.device = device
+        self.timeout = timeout
+        self.process = None
+        self.output = None
+        self.lock = threading.Lock()
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        self.process = subprocess.Popen(["adb", "-s", self.device, "shell"], stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0)
+        self.output = queue.Queue()
+        reader = threading.Thread(target=self._read_output, args=(self.process.stdout, self.output), daemon=True)
+        reader.start()
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def reconnect(self):
+        self.close()
+        try:
+            subprocess.run(["adb", "-s", self.device, "wait-for-device"], stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, timeout=self.timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+        self.start()
+
+    @staticmethod
+    def _read_output(stream, output):
+        for line in iter(stream.readline, b""):
+            output.put(line)
+        output.put(None)
+
+    def _send(self, command, marker):
+        self.process.stdin.write(f"{{ {command}; }} 2>&1; printf '\\n%s%d\\n' {marker} $?\n".encode())
+        self.process.stdin.flush()
+
+    def _receive(self, marker):
+        lines = []
+        deadline = time.time() + self.timeout
+        while True:
+            line = self.output.get(timeout=max(deadline - time.time(), 0))
+            if line is None:
+                raise EOFError("adb shell exited")
+            line = line.decode("utf-8", errors="replace")
+            if line.startswith(marker):
+                return int(line[len(marker):].strip() or 1), "".join(lines).strip()
+            lines.append(line)
+
+    def run(self, command):
+        with self.lock:
+            marker = f"__APPAGENT_{uuid.uuid4().hex}__"
+            for attempt in range(2):
+                try:
+                    if not self.is_alive():
+                        if attempt:
+                            self.reconnect()
+                        else:
+                            self.start()
+                    self._send(command, marker)
+                except OSError:
+                    # Nothing reached the device, so the command is safe to resend on a fresh shell.
+                    self.close()
+                    continue
+                try:
+                    returncode, output = self._receive(marker)
+                except (EOFError, queue.Empty):
+                    # The command may already have run on the device; do not replay it.
+                    self.close()
+                    print_with_color(f"Command execution failed: {command}", "red")
+                    print_with_color(f"The adb shell session on {self.device} was lost or timed out", "red")
+                    return "ERROR"
+                if returncode == 0:
+                    return output
+                print_with_color(f"Command execution failed: {command}", "red")
+                print_with_color(output, "red")
+                return "ERROR"
+            print_with_color(f"Command execution failed: {command}", "red")
+            print_with_color(f"Unable to open an adb shell session on {self.device}", "red")
+            return "ERROR"
+
+
+shell_sessions = {}
+
+
+def get_shell_session(device):
+    if device not in shell_sessions:
+        shell_sessions[device] = AdbShellSession(device, configs.get("ADB_SESSION_TIMEOUT", 30))
+    return shell_sessions[device]
+
+
+def close_shell_sessions():
+    for session in shell_sessions.values():
+        session.close()
+    shell_sessions.clear()
+
+
+atexit.register(close_shell_sessions)
+
+# Accessibility events that mean the content of the screen changed
+SCREEN_CHANGE_EVENTS = {"TYPE_WINDOW_STATE_CHANGED", "TYPE_WINDOW_CONTENT_CHANGED", "TYPE_WINDOWS_CHANGED",
+                        "TYPE_VIEW_SCROLLED", "TYPE_VIEW_TEXT_CHANGED", "TYPE_VIEW_SELECTED",
+                        "TYPE_VIEW_FOCUSED", "TYPE_VIEW_CLICKED", "TYPE_VIEW_LONG_CLICKED"}
+
+
+def split_fields(text):
+    """Split `Key: value; Key: value` into pairs, leaving separators inside [...] alone, e.g. in `Text: [a; b]`."""
+    fields, depth, start = {}, 0, 0
+    for i, char in enumerate(text + ";"):
+        if char == "[":
+            depth += 1
+        elif char == "]":
+            depth = max(0, depth - 1)
+        elif char == ";" and depth == 0:
+            key, sep, value = text[start:i].partition(": ")
+            if sep:
+                fields[key.strip()] = value.strip()
+            start = i + 1
+    return fields
+
+
+class UiEvent:
+    """One accessibility event as printed by `uiautomator events`."""
+
+    def __init__(self, event_type, event_time, package, class_name="", text="", fields=None, received=None):
+        self.event_type = event_type
+        self.event_time = event_time
+        self.package = package
+        self.class_name = class_name
+        self.text = text
+        self.fields = fields or {}
+        self.received = time.monotonic() if received is None else received
+
+    @classmethod
+    def parse(cls, line):
+        """Parse a line of `uiautomator events` output, or return None if it does not describe an event.
+
+        An event line holds the event's fields, then the fields of its source record in [ ... ]:
+        EventType: TYPE_VIEW_CLICKED; EventTime: 1234; PackageName: com.app; ... [ ClassName: android.widget.Button;
+        Text: [OK]; ... ]; recordCount: 0
+        """
+        line = line.strip()
+        if not line.startswith("EventType: "):
+            return None
+        head, _, record = line.partition(" [ ")
+        fields = split_fields(head)
+        record, _, _ = record.rpartition(" ]")
+        fields.update(split_fields(record))
+        try:
+            event_time = int(fields.get("EventTime", ""))
+        except ValueError:
+            return None
+        text = fields.get("Text", "")
+        if text.startswith("[") and text.endswith("]"):
+            text = text[1:-1]
+        return cls(fields["EventType"], event_time, fields.get("PackageName", ""), fields.get("ClassName", ""), text,
+                   fields)
+
+    @property
+    def changes_screen(self):
+        return self.event_type in SCREEN_CHANGE_EVENTS
+
+    def __repr__(self):
+        return f"UiEvent({self.event_type}, {self.package}, {self.class_name}, t={self.event_time})"
+
+
+class UiEventStream:
+    """Accessibility events of a device, read from a persistent `uiautomator events` process into `queue`.
+
+    Events of `ignored_packages`, such as the status bar with its clock, and events that do not change the screen
+    are dropped. The queue holds at most `max_events`, the oldest are dropped first when nobody takes them.
+    """
+
+    def __init__(self, lines, process=None, ignored_packages=("com.android.systemui",), max_events=1000):
+        self.process = process
+        self.ignored_packages = set(ignored_packages)
+        self.queue = queue.Queue(maxsize=max_events)
+        self.received = 0
+        self.dropped = 0
+        self.closed = threading.Event()
+        self.reader = threading.Thread(target=self._read, args=(lines,), daemon=True)
+        self.reader.start()
+
+    @classmethod
+    def open(cls, device, **kwargs):
+        process = subprocess.Popen(["adb", "-s", device, "shell", "uiautomator", "events"], stdout=subprocess.PIPE,
+                                   stderr=subprocess.DEVNULL, bufsize=0)
+        lines = (line.decode("utf-8", errors="replace") for line in iter(process.stdout.readline, b""))
+        return cls(lines, process, **kwargs)
+
+    def _read(self, lines):
+        try:
+            for line in lines:
+                event = UiEvent.parse(line)
+                if event is None or not event.changes_screen or event.package in self.ignored_packages:
+                    continue
+                self.received += 1
+                while True:
+                    try:
+                        self.queue.put_nowait(event)
+                        break
+                    except queue.Full:
+                        try:
+                            self.queue.get_nowait()
+                            self.dropped += 1
+                        except queue.Empty:
+                            pass
+        finally:
+            self.closed.set()
+
+    @property
+    def alive(self):
+        return not self.closed.is_set()
+
+    def get(self, timeout=None):
+        """Block until the next event arrives and return it, or None after `timeout` seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def drain(self):
+        """Take every event that has arrived so far."""
+        events = []
+        while True:
+            try:
+                events.append(self.queue.get_nowait())
+            except queue.Empty:
+                return events
+
+    def wait_for_quiet(self, quiet, timeout, first_timeout=None, min_wait=0.0):
+        """Block until the screen has settled after an action and return True, or False once `timeout` seconds passed
+        without settling. Returns None if no event arrived within `first_timeout` seconds or the stream ended, so that
+        the caller has to look at the screen instead.
+
+        Events queued before the call are stale and dropped. The screen counts as settled once at least one event
+        arrived and then none for `quiet` seconds, but never sooner than `min_wait` seconds after the call, so that an
+        app that is slow to react or pauses during its update is not taken as settled."""
+        start = time.monotonic()
+        deadline = start + timeout
+        self.drain()
+        if self.get(timeout if first_timeout is None else min(first_timeout, timeout)) is None:
+            return None
+        while self.alive or not self.queue.empty():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            wait = max(quiet, start + min_wait - time.monotonic())
+            if self.get(min(wait, remaining)) is None:
+                return remaining >= wait
+        return None
+
+    def close(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+    def stats(self):
+        return {"received": self.received, "dropped": self.dropped, "alive": self.alive}
+
+
 def list_all_devices():
     adb_command = "adb devices"
     device_list = []
@@ -38,52 +457,213 @@ def list_all_devices():
     return device_list
 
 
-def get_id_from_element(elem):
-    bounds = elem.attrib["bounds"][1:-1].split("][")
+def parse_bounds(bounds):
+    bounds = bounds[1:-1].split("][")
     x1, y1 = map(int, bounds[0].split(","))
     x2, y2 = map(int, bounds[1].split(","))
+    return x1, y1, x2, y2
+
+
+def build_element_id(attrib, bounds):
+    x1, y1, x2, y2 = bounds
     elem_w, elem_h = x2 - x1, y2 - y1
-    if "resource-id" in elem.attrib and elem.attrib["resource-id"]:
-        elem_id = elem.attrib["resource-id"].replace(":", ".").replace("/", "_")
+    if "resource-id" in attrib and attrib["resource-id"]:
+        elem_id = attrib["resource-id"].replace(":", ".").replace("/", "_")
     else:
-        elem_id = f"{elem.attrib['class']}_{elem_w}_{elem_h}"
-    if "content-desc" in elem.attrib and elem.attrib["content-desc"] and len(elem.attrib["content-desc"]) < 20:
-        content_desc = elem.attrib['content-desc'].replace("/", "_").replace(" ", "").replace(":", "_")
+        elem_id = f"{attrib['class']}_{elem_w}_{elem_h}"
+    if "content-desc" in attrib and attrib["content-desc"] and len(attrib["content-desc"]) < 20:
+        content_desc = attrib['content-desc'].replace("/", "_").replace(" ", "").replace(":", "_")
         elem_id += f"_{content_desc}"
     return elem_id
 
 
+def get_id_from_element(elem):
+    return build_element_id(elem.attrib, parse_bounds(elem.attrib["bounds"]))
+
+
+class NodeFrame:
+    """Traversal stack entry that parses a node's bounds and builds its ID at most once.
+
+    Siblings in long lists share a parent, so caching the parent's ID here saves rebuilding it for every child.
+    """
+    __slots__ = ("attrib", "_bounds", "_elem_id")
+
+    def __init__(self, attrib):
+        self.attrib = attrib
+        self._bounds = None
+        self._elem_id = None
+
+    @property
+    def bounds(self):
+        if self._bounds is None:
+            self._bounds = parse_bounds(self.attrib["bounds"])
+        return self._bounds
+
+    @property
+    def elem_id(self):
+        if self._elem_id is None:
+            self._elem_id = build_element_id(self.attrib, self.bounds)
+        return self._elem_id
+
+
 def traverse_tree(xml_path, elem_list, attrib, add_index=False):
+    if isinstance(xml_path, bytes):
+        xml_path = io.BytesIO(xml_path)
+    elif hasattr(xml_path, "seek"):
+        xml_path.seek(0)
     path = []
     for event, elem in ET.iterparse(xml_path, ['start', 'end']):
-        if event == 'start':
-            path.append(elem)
-            if attrib in elem.attrib and elem.attrib[attrib] == "true":
-                parent_prefix = ""
+        if event == 'end':
+            path.pop()
+            elem.clear()
+            continue
+        frame = NodeFrame(elem.attrib)
+        path.append(frame)
+        if frame.attrib.get(attrib) != "true":
+            continue
+        x1, y1, x2, y2 = frame.bounds
+        center = (x1 + x2) // 2, (y1 + y2) // 2
+        close = False
+        for e in elem_list:
+            bbox = e.bbox
+            center_ = (bbox[0][0] + bbox[1][0]) // 2, (bbox[0][1] + bbox[1][1]) // 2
+            dist = (abs(center[0] - center_[0]) ** 2 + abs(center[1] - center_[1]) ** 2) ** 0.5
+            if dist <= configs["MIN_DIST"]:
+                close = True
+                break
+        if close:
+            continue
+        elem_id = frame.elem_id
+        if len(path) > 1:
+            elem_id = path[-2].elem_id + "_" + elem_id
+        if add_index:
+            elem_id += f"_{frame.attrib['index']}"
+        elem_list.append(AndroidElement(elem_id, ((x1, y1), (x2, y2)), attrib))
+
+
+class SpatialGrid:
+    """Uniform grid over element centers with cells as wide as the suppression distance.
+
+    Any center within `dist` of a query point lies in the query's cell or one of its eight neighbours, so a proximity
+    check only looks at a handful of points however many elements the screen has.
+    """
+
+    def __init__(self, dist):
+        self.dist_sq = dist * dist
+        self.cell_size = max(int(dist), 1)
+        self.cells = defaultdict(list)
+
+    def add(self, x, y):
+        self.cells[(x // self.cell_size, y // self.cell_size)].append((x, y))
+
+    def has_neighbour(self, x, y):
+        cell_x, cell_y = x // self.cell_size, y // self.cell_size
+        for i in (cell_x - 1, cell_x, cell_x + 1):
+            for j in (cell_y - 1, cell_y, cell_y + 1):
+                for x_, y_ in self.cells.get((i, j), ()):
+                    if (x - x_) ** 2 + (y - y_) ** 2 <= self.dist_sq:
+                        return True
+        return False
+
+
+def extract_elements(xml, attribs=("clickable", "focusable"), add_index=True, min_dist=None, exclude=()):
+    """Parse the hierarchy once and return an ElementTable with the labeled elements of all attribute classes.
+
+    Within a class an element is dropped if its center is within `min_dist` of an element already kept for that
+    class. Elements of later classes are also dropped if they are that close to any kept element of an earlier class,
+    so the result matches running traverse_tree once per class and merging the lists. Elements whose uid is in
+    `exclude` are left out of the result but still suppress their neighbours.
+    """
+    if min_dist is None:
+        min_dist = configs["MIN_DIST"]
+    if isinstance(xml, bytes):
+        xml = io.BytesIO(xml)
+    elif hasattr(xml, "seek"):
+        xml.seek(0)
+    grids = [SpatialGrid(min_dist) for _ in attribs]
+    columns = [([], [], []) for _ in attribs]
+    path = []
+    for event, elem in ET.iterparse(xml, ['start', 'end']):
+        if event == 'end':
+            path.pop()
+            elem.clear()
+            continue
+        frame = NodeFrame(elem.attrib)
+        path.append(frame)
+        elem_id = None
+        for attrib, grid, (uids, bounds_list, flags) in zip(attribs, grids, columns):
+            if frame.attrib.get(attrib) != "true":
+                continue
+            x1, y1, x2, y2 = frame.bounds
+            center = (x1 + x2) // 2, (y1 + y2) // 2
+            if grid.has_neighbour(*center):
+                continue
+            grid.add(*center)
+            if elem_id is None:
+                elem_id = frame.elem_id
                 if len(path) > 1:
-                    parent_prefix = get_id_from_element(path[-2])
-                bounds = elem.attrib["bounds"][1:-1].split("][")
-                x1, y1 = map(int, bounds[0].split(","))
-                x2, y2 = map(int, bounds[1].split(","))
-                center = (x1 + x2) // 2, (y1 + y2) // 2
-                elem_id = get_id_from_element(elem)
-                if parent_prefix:
-                    elem_id = parent_prefix + "_" + elem_id
+                    elem_id = path[-2].elem_id + "_" + elem_id
                 if add_index:
-                    elem_id += f"_{elem.attrib['index']}"
-                close = False
-                for e in elem_list:
-                    bbox = e.bbox
-                    center_ = (bbox[0][0] + bbox[1][0]) // 2, (bbox[0][1] + bbox[1][1]) // 2
-                    dist = (abs(center[0] - center_[0]) ** 2 + abs(center[1] - center_[1]) ** 2) ** 0.5
-                    if dist <= configs["MIN_DIST"]:
-                        close = True
-                        break
-                if not close:
-                    elem_list.append(AndroidElement(elem_id, ((x1, y1), (x2, y2)), attrib))
+                    elem_id += f"_{frame.attrib['index']}"
+            uids.append(elem_id)
+            bounds_list.append(frame.bounds)
+            flags.append(sum(flag for name, flag in ATTRIB_FLAGS.items() if frame.attrib.get(name) == "true"))
+    tables = [ElementTable(uids, bounds_list, [attrib] * len(uids), flags)
+              for attrib, (uids, bounds_list, flags) in zip(attribs, columns)]
+    merged = tables[0]
+    for i in range(1, len(tables)):
+        suppressed = np.zeros(len(tables[i]), dtype=bool)
+        for earlier in tables[:i]:
+            suppressed |= earlier.near(tables[i].centers, min_dist)
+        merged = merged.concat(tables[i].take(np.flatnonzero(~suppressed)))
+    return merged.exclude(exclude)
+
 
+VOLATILE_CLASSES = ("android.widget.ProgressBar", "android.widget.TextClock", "android.widget.Chronometer")
+
+
+def hierarchy_digest(xml, ignored_packages=(), volatile_classes=VOLATILE_CLASSES):
+    """SHA-1 over the nodes of the hierarchy and their attributes, leaving out the subtrees of `ignored_packages` and
+    of `volatile_classes` such as spinners and clocks, which change without the user doing anything."""
+    if isinstance(xml, bytes):
+        xml = io.BytesIO(xml)
+    elif hasattr(xml, "seek"):
+        xml.seek(0)
+    digest = hashlib.sha1()
+    skip_depth = 0
+    for event, elem in ET.iterparse(xml, ['start', 'end']):
         if event == 'end':
-            path.pop()
+            skip_depth = max(skip_depth - 1, 0)
+            elem.clear()
+            continue
+        if skip_depth or elem.attrib.get("package") in ignored_packages or \
+                elem.attrib.get("class") in volatile_classes:
+            skip_depth += 1
+            continue
+        digest.update(repr(sorted(elem.attrib.items())).encode())
+    return digest.digest()
+
+
+class StateSnapshot:
+    def __init__(self, frame, xml, frame_span, xml_span):
+        self.frame = frame
+        self.xml = xml
+        self.frame_span = frame_span
+        self.xml_span = xml_span
+        # Each capture is assumed to sample the screen halfway through its own span
+        self.skew = abs(sum(frame_span) / 2 - sum(xml_span) / 2)
+
+    def is_stale(self, max_skew):
+        return self.skew > max_skew
+
+
+class PendingState:
+    """A screenshot whose UI hierarchy is still being dumped in the background, see AndroidController.capture_after."""
+
+    def __init__(self, frame, frame_span, xml_future=None):
+        self.frame = frame
+        self.frame_span = frame_span
+        self.xml_future = xml_future
 
 
 class AndroidController:
@@ -91,23 +671,75 @@ class AndroidController:
         self.device = device
         self.screenshot_dir = configs["ANDROID_SCREENSHOT_DIR"]
         self.xml_dir = configs["ANDROID_XML_DIR"]
+        self.shell_session = get_shell_session(device) if configs.get("ADB_SHELL_SESSION", False) else None
+        self.screenshot_stream = configs.get("SCREENSHOT_STREAM", False)
+        self.screenshot_raw = configs.get("SCREENSHOT_RAW", False)
+        self.xml_stream = configs.get("XML_STREAM", False)
+        self.xml_compressed = configs.get("XML_COMPRESSED", False)
+        self.perf = PerfStats()
+        self.events = None
+        if configs.get("UI_EVENTS", False):
+            self.subscribe_events()
+        self.capture_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix=f"capture-{device}")
         self.width, self.height = self.get_device_size()
         self.backslash = "\\"
 
+    def subscribe_events(self):
+        """Start reading the device's accessibility events into `self.events`, see UiEventStream."""
+        if self.events is None or not self.events.alive:
+            self.events = UiEventStream.open(self.device,
+                                             ignored_packages=configs.get("UI_EVENTS_IGNORE", ["com.android.systemui"]))
+            atexit.register(self.events.close)
+        return self.events
+
+    def execute_shell(self, command):
+        if self.shell_session is not None:
+            return self.shell_session.run(command)
+        return execute_adb(f"adb -s {self.device} shell {command}")
+
     def get_device_size(self):
-        adb_command = f"adb -s {self.device} shell wm size"
-        result = execute_adb(adb_command)
+        result = self.execute_shell("wm size")
         if result != "ERROR":
             return map(int, result.split(": ")[1].split("x"))
         return 0, 0
 
+    def capture_screenshot(self):
+        with self.perf.timer("screenshot"):
+            if self.screenshot_raw:
+                data = execute_adb_binary(["adb", "-s", self.device, "exec-out", "screencap"])
+            else:
+                data = execute_adb_binary(["adb", "-s", self.device, "exec-out", "screencap", "-p"])
+        if data == "ERROR":
+            return data
+        try:
+            return Frame.from_raw(data) if self.screenshot_raw else Frame.from_png(data)
+        except ValueError as e:
+            print_with_color(f"ERROR: Invalid screencap output\n{e}", "red")
+            return "ERROR"
+
+    def get_screenshot_frame(self, prefix, save_dir):
+        if not self.screenshot_stream:
+            screenshot_path = self.get_screenshot(prefix, save_dir)
+            if screenshot_path == "ERROR":
+                return screenshot_path
+            return Frame.from_file(screenshot_path)
+        frame = self.capture_screenshot()
+        if frame != "ERROR" and configs.get("PERSIST_SCREENSHOTS", True):
+            frame.save_async(os.path.join(save_dir, prefix + ".png"))
+        return frame
+
     def get_screenshot(self, prefix, save_dir):
-        cap_command = f"adb -s {self.device} shell screencap -p " \
+        if self.screenshot_stream:
+            frame = self.capture_screenshot()
+            if frame == "ERROR":
+                return frame
+            return frame.save(os.path.join(save_dir, prefix + ".png"))
+        cap_command = "screencap -p " \
                       f"{os.path.join(self.screenshot_dir, prefix + '.png').replace(self.backslash, '/')}"
         pull_command = f"adb -s {self.device} pull " \
                        f"{os.path.join(self.screenshot_dir, prefix + '.png').replace(self.backslash, '/')} " \
                        f"{os.path.join(save_dir, prefix + '.png')}"
-        result = execute_adb(cap_command)
+        result = self.execute_shell(cap_command)
         if result != "ERROR":
             result = execute_adb(pull_command)
             if result != "ERROR":
@@ -115,13 +747,203 @@ class AndroidController:
             return result
         return result
 
+    def dump_hierarchy(self, compressed=None):
+        if compressed is None:
+            compressed = self.xml_compressed
+        adb_args = ["adb", "-s", self.device, "exec-out", "uiautomator", "dump"]
+        if compressed:
+            adb_args.append("--compressed")
+        adb_args.append("/dev/tty")
+        start = time.perf_counter()
+        process = subprocess.Popen(adb_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # uiautomator only writes once the whole hierarchy has been dumped, so the first byte marks the end of the dump
+        first_chunk = process.stdout.read1(65536)
+        dumped = time.perf_counter()
+        rest, stderr = process.communicate()
+        self.perf.record("xml_dump", dumped - start)
+        self.perf.record("xml_transfer", time.perf_counter() - dumped)
+        data = first_chunk + rest
+        end = data.rfind(b"</hierarchy>")
+        if process.returncode != 0 or end < 0:
+            print_with_color(f"Command execution failed: {' '.join(adb_args)}", "red")
+            print_with_color((stderr or data).decode("utf-8", errors="replace"), "red")
+            return "ERROR"
+        return data[data.find(b"<"):end + len("</hierarchy>")]
+
+    def get_hierarchy(self, prefix, save_dir):
+        if not self.xml_stream:
+            xml_path = self.get_xml(prefix, save_dir)
+            if xml_path == "ERROR":
+                return xml_path
+            with open(xml_path, "rb") as f:
+                return f.read()
+        xml = self.dump_hierarchy()
+        if xml != "ERROR" and configs.get("PERSIST_XML", True):
+            writer.submit(write_bytes, os.path.join(save_dir, prefix + ".xml"), xml)
+        return xml
+
+    @staticmethod
+    def timed(capture, prefix, directory):
+        start = time.time()
+        result = capture(prefix, directory)
+        return result, (start, time.time())
+
+    def capture_state(self, screenshot_prefix, xml_prefix, save_dir, xml_dir=None):
+        start = time.perf_counter()
+        frame_future = self.capture_pool.submit(self.timed, self.get_screenshot_frame, screenshot_prefix, save_dir)
+        xml_future = self.capture_pool.submit(self.timed, self.get_hierarchy, xml_prefix, xml_dir or save_dir)
+        frame, frame_span = frame_future.result()
+        xml, xml_span = xml_future.result()
+        self.perf.record("capture_state", time.perf_counter() - start)
+        if frame == "ERROR" or xml == "ERROR":
+            return "ERROR"
+        snapshot = StateSnapshot(frame, xml, frame_span, xml_span)
+        self.perf.record("capture_skew", snapshot.skew)
+        max_skew = configs.get("MAX_CAPTURE_SKEW", 1.0)
+        if snapshot.is_stale(max_skew):
+            print_with_color(f"WARNING: The screenshot and the UI hierarchy were captured {snapshot.skew:.2f}s apart "
+                             f"and may not describe the same screen", "yellow")
+        return snapshot
+
+    def capture_after(self, prefix, save_dir, with_hierarchy=True):
+        """Capture the screen after an action: the screenshot right away and, with `with_hierarchy`, the UI hierarchy
+        in the background, so that the capture can serve as the next state without another one, see reuse_state."""
+        frame, frame_span = self.timed(self.get_screenshot_frame, prefix, save_dir)
+        if frame == "ERROR":
+            return frame
+        xml_future = self.capture_pool.submit(self.timed, self.get_hierarchy, prefix, save_dir) if with_hierarchy \
+            else None
+        return PendingState(frame, frame_span, xml_future)
+
+    def still_showing(self, frame):
+        """Whether the screen still shows `frame`, judged by the frame hash of a fresh raw screencap."""
+        signature = self.screen_signature("frame")
+        if signature == "ERROR":
+            return False
+        return self.same_screen((frame.dhash(16), None), signature, configs.get("UI_IDLE_TOLERANCE", 2))
+
+    def reuse_state(self, pending):
+        """Return the capture `pending` as a StateSnapshot if the screen has not changed since it was taken, or None
+        if it has and a new capture is needed."""
+        if pending is None or pending.xml_future is None:
+            return None
+        with self.perf.timer("reuse_probe"):
+            unchanged = self.still_showing(pending.frame)
+        xml, xml_span = pending.xml_future.result()
+        if not unchanged or xml == "ERROR":
+            return None
+        return StateSnapshot(pending.frame, xml, pending.frame_span, xml_span)
+
+    def unchanged_by_action(self, before, after, tolerance=None):
+        """Whether the action between the captures `before`, a StateSnapshot, and `after`, a PendingState, provably
+        did nothing: the frame hashes differ by at most `tolerance` bits and the hierarchies match apart from the
+        volatile nodes left out by hierarchy_digest. Without a hierarchy for `after` this cannot be told and the
+        answer is False."""
+        if after is None or after.xml_future is None:
+            return False
+        tolerance = configs.get("UI_IDLE_TOLERANCE", 2) if tolerance is None else tolerance
+        with self.perf.timer("change_check"):
+            if hamming(before.frame.dhash(16), after.frame.dhash(16)) > tolerance:
+                return False
+            xml, _ = after.xml_future.result()
+            if xml == "ERROR":
+                return False
+            ignored = configs.get("UI_EVENTS_IGNORE", ["com.android.systemui"])
+            return hierarchy_digest(before.xml, ignored) == hierarchy_digest(xml, ignored)
+
+    def screen_signature(self, signal="frame"):
+        """A cheap fingerprint of the screen: the difference hash of a raw screenshot, a digest of the UI hierarchy,
+        or both. Returns "ERROR" if a capture failed."""
+        frame_hash = xml_digest = None
+        with self.perf.timer("idle_probe"):
+            if signal in ("frame", "both"):
+                data = execute_adb_binary(["adb", "-s", self.device, "exec-out", "screencap"])
+                if data == "ERROR":
+                    return data
+                try:
+                    frame_hash = Frame.from_raw(data).dhash(16)
+                except ValueError:
+                    return "ERROR"
+            if signal in ("hierarchy", "both"):
+                xml = self.dump_hierarchy(compressed=True)
+                if xml == "ERROR":
+                    return xml
+                xml_digest = hashlib.sha1(xml).digest()
+        return frame_hash, xml_digest
+
+    @staticmethod
+    def same_screen(signature_a, signature_b, tolerance=0):
+        """Whether two signatures show the same screen, allowing `tolerance` differing frame hash bits for things like
+        the status bar clock or a blinking cursor."""
+        (frame_a, xml_a), (frame_b, xml_b) = signature_a, signature_b
+        if xml_a != xml_b:
+            return False
+        return frame_a is None or hamming(frame_a, frame_b) <= tolerance
+
+    def wait_for_idle(self, action="action", stable_ms=None, timeout=None):
+        """Block until the screen has not changed for `stable_ms` milliseconds after an action, or for at most
+        `timeout` seconds, and return the seconds waited. The wait is recorded per `action` type as settle_<action>.
+
+        With UI_EVENTS set, the wait ends once the device has reported an accessibility event and then none for
+        `stable_ms`, and not before UI_EVENTS_MIN_MS. If no event arrives within UI_SETTLE_TIME, or otherwise, the
+        screen is sampled as set by UI_IDLE_SIGNAL. With UI_IDLE_TIMEOUT set to 0 this sleeps
+        UI_SETTLE_TIME instead, as before."""
+        timeout = configs.get("UI_IDLE_TIMEOUT", 5) if timeout is None else timeout
+        if not timeout:
+            settle_time = configs.get("UI_SETTLE_TIME", 1)
+            time.sleep(settle_time)
+            self.perf.record(f"settle_{action}", settle_time)
+            return settle_time
+        stable = (configs.get("UI_IDLE_STABLE_MS", 300) if stable_ms is None else stable_ms) / 1000
+        start = time.perf_counter()
+        if self.events is not None and self.events.alive:
+            # The app reports its own updates, the screen is settled once they stop
+            quiet = self.events.wait_for_quiet(stable, timeout, configs.get("UI_SETTLE_TIME", 1),
+                                               configs.get("UI_EVENTS_MIN_MS", 500) / 1000)
+            if quiet is not None:
+                if not quiet:
+                    print_with_color(f"WARNING: The screen was still changing {timeout}s after the {action} action",
+                                     "yellow")
+                settle_time = time.perf_counter() - start
+                self.perf.record(f"settle_{action}", settle_time)
+                return settle_time
+            # No event arrived, because the action changed nothing or the stream ended, so look at the screen instead
+        signal = configs.get("UI_IDLE_SIGNAL", "frame")
+        tolerance = configs.get("UI_IDLE_TOLERANCE", 2)
+        last = None
+        stable_since = start
+        while True:
+            signature = self.screen_signature(signal)
+            now = time.perf_counter()
+            if signature == "ERROR":
+                # Without a way to look at the screen, fall back to the fixed wait
+                time.sleep(max(0.0, configs.get("UI_SETTLE_TIME", 1) - (now - start)))
+                break
+            if last is None or not self.same_screen(last, signature, tolerance):
+                last, stable_since = signature, now
+            elif now - stable_since >= stable:
+                break
+            if now - start >= timeout:
+                print_with_color(f"WARNING: The screen was still changing {timeout}s after the {action} action",
+                                 "yellow")
+                break
+            time.sleep(min(0.05, stable / 4))
+        settle_time = time.perf_counter() - start
+        self.perf.record(f"settle_{action}", settle_time)
+        return settle_time
+
     def get_xml(self, prefix, save_dir):
-        dump_command = f"adb -s {self.device} shell uiautomator dump " \
+        if self.xml_stream:
+            xml = self.dump_hierarchy()
+            if xml == "ERROR":
+                return xml
+            return write_bytes(os.path.join(save_dir, prefix + ".xml"), xml)
+        dump_command = "uiautomator dump " \
                        f"{os.path.join(self.xml_dir, prefix + '.xml').replace(self.backslash, '/')}"
         pull_command = f"adb -s {self.device} pull " \
                        f"{os.path.join(self.xml_dir, prefix + '.xml').replace(self.backslash, '/')} " \
                        f"{os.path.join(save_dir, prefix + '.xml')}"
-        result = execute_adb(dump_command)
+        result = self.execute_shell(dump_command)
         if result != "ERROR":
             result = execute_adb(pull_command)
             if result != "ERROR":
@@ -130,25 +952,25 @@ class AndroidController:
         return result
 
     def back(self):
-        adb_command = f"adb -s {self.device} shell input keyevent KEYCODE_BACK"
-        ret = execute_adb(adb_command)
+        shell_command = "input keyevent KEYCODE_BACK"
+        ret = self.execute_shell(shell_command)
         return ret
 
     def tap(self, x, y):
-        adb_command = f"adb -s {self.device} shell input tap {x} {y}"
-        ret = execute_adb(adb_command)
+        shell_command = f"input tap {x} {y}"
+        ret = self.execute_shell(shell_command)
         return ret
 
     def text(self, input_str):
         input_str = input_str.replace(" ", "%s")
         input_str = input_str.replace("'", "")
-        adb_command = f"adb -s {self.device} shell input text {input_str}"
-        ret = execute_adb(adb_command)
+        shell_command = f"input text {input_str}"
+        ret = self.execute_shell(shell_command)
         return ret
 
     def long_press(self, x, y, duration=1000):
-        adb_command = f"adb -s {self.device} shell input swipe {x} {y} {x} {y} {duration}"
-        ret = execute_adb(adb_command)
+        shell_command = f"input swipe {x} {y} {x} {y} {duration}"
+        ret = self.execute_shell(shell_command)
         return ret
 
     def swipe(self, x, y, direction, dist="medium", quick=False):
@@ -168,13 +990,13 @@ class AndroidController:
         else:
             return "ERROR"
         duration = 100 if quick else 400
-        adb_command = f"adb -s {self.device} shell input swipe {x} {y} {x+offset[0]} {y+offset[1]} {duration}"
-        ret = execute_adb(adb_command)
+        shell_command = f"input swipe {x} {y} {x+offset[0]} {y+offset[1]} {duration}"
+        ret = self.execute_shell(shell_command)
         return ret
 
     def swipe_precise(self, start, end, duration=400):
         start_x, start_y = start
         end_x, end_y = end
-        adb_command = f"adb -s {self.device} shell input swipe {start_x} {start_x} {end_x} {end_y} {duration}"
-        ret = execute_adb(adb_command)
+        shell_command = f"input swipe {start_x} {start_x} {end_x} {end_y} {duration}"
+        ret = self.execute_shell(shell_command)
         return ret
@@ -4,11 +4,10 @@ import json
 import os
 import re
 import sys
-import time
 
 import prompts
 from config import load_config
-from model import OpenAIModel, QwenModel
+from model import create_model, metrics
 from utils import print_with_color
 
 arg_desc = "AppAgent - Human Demonstration"
@@ -20,17 +19,8 @@ args = vars(parser.parse_args())
 
 configs = load_config()
 
-if configs["MODEL"] == "OpenAI":
-    mllm = OpenAIModel(base_url=configs["OPENAI_API_BASE"],
-                       api_key=configs["OPENAI_API_KEY"],
-                       model=configs["OPENAI_API_MODEL"],
-                       temperature=configs["TEMPERATURE"],
-                       max_tokens=configs["MAX_TOKENS"])
-elif configs["MODEL"] == "Qwen":
-    mllm = QwenModel(api_key=configs["DASHSCOPE_API_KEY"],
-                     model=configs["QWEN_MODEL"])
-else:
-    print_with_color(f"ERROR: Unsupported model type {configs['MODEL']}!", "red")
+mllm = create_model(configs)
+if mllm is None:
     sys.exit()
 
 root_dir = args["root_dir"]
@@ -116,7 +106,7 @@ with open(record_path, "r") as infile:
             }
 
         print_with_color(f"Waiting for GPT-4V to generate documentation for the element {resource_id}", "yellow")
-        status, rsp = mllm.get_model_response(prompt, [img_before, img_after])
+        status, rsp = mllm.route("doc").get_model_response(prompt, [img_before, img_after])
         if status:
             doc_content[action_type] = rsp
             with open(log_path, "a") as logfile:
@@ -129,6 +119,7 @@ with open(record_path, "r") as infile:
             print_with_color(f"Documentation generated and saved to {doc_path}", "yellow")
         else:
             print_with_color(rsp, "red")
-        time.sleep(configs["REQUEST_INTERVAL"])
 
 print_with_color(f"Documentation generation phase completed. {doc_count} docs generated.", "yellow")
+metrics.write_task(os.path.join(task_dir, "metrics.json"))
+metrics.append_summary(configs.get("METRICS_SUMMARY", ""), script="document_generation", app=app, task=demo_name)
@@ -0,0 +1,102 @@
+import hashlib
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+
+# screencap raw output starts with width, height and pixel format, followed by a colour space on Android 9+
+RAW_PIXEL_FORMATS = {1: cv2.COLOR_RGBA2BGR, 2: cv2.COLOR_RGBA2BGR}
+
+writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="frame-writer")
+
+
+def hamming(hash_a, hash_b):
+    return bin(hash_a ^ hash_b).count("1")
+
+
+def write_bytes(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+class Frame:
+    """A screenshot held in memory, either as a BGR array, as encoded PNG bytes, or both.
+
+    Whichever representation is missing is computed on first access and kept, so a frame captured as PNG is decoded
+    at most once and a rendered array is encoded at most once.
+    """
+
+    def __init__(self, image=None, png=None):
+        self._image = image
+        self._png = png
+        self._hashes = {}
+        self._digest = None
+
+    @classmethod
+    def from_png(cls, data):
+        return cls(png=bytes(data))
+
+    @classmethod
+    def from_raw(cls, data):
+        width, height, pixel_format = struct.unpack_from("<III", data)
+        if pixel_format not in RAW_PIXEL_FORMATS:
+            raise ValueError(f"Unsupported screencap pixel format {pixel_format}")
+        size = width * height * 4
+        if len(data) < size + 12:
+            raise ValueError(f"Truncated screencap output: {len(data)} bytes for {width}x{height}")
+        pixels = np.frombuffer(data, dtype=np.uint8, count=size, offset=len(data) - size).reshape(height, width, 4)
+        return cls(image=cv2.cvtColor(pixels, RAW_PIXEL_FORMATS[pixel_format]))
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, "rb") as f:
+            return cls(png=f.read())
+
+    @property
+    def image(self):
+        if self._image is None:
+            self._image = cv2.imdecode(np.frombuffer(self._png, dtype=np.uint8), cv2.IMREAD_COLOR)
+        return self._image
+
+    @property
+    def png(self):
+        if self._png is None:
+            _, buffer = cv2.imencode(".png", self._image)
+            self._png = buffer.tobytes()
+        return self._png
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    @property
+    def nbytes(self):
+        """Memory held by the representations computed so far."""
+        size = 0 if self._image is None else self._image.nbytes
+        return size + (0 if self._png is None else len(self._png))
+
+    def dhash(self, size=8):
+        """Difference hash of the frame: one bit per horizontally adjacent pair of cells in a (size+1)x size
+        grayscale thumbnail, set when the right cell is brighter."""
+        if size not in self._hashes:
+            gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+            small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+            bits = (small[:, 1:] > small[:, :-1]).flatten()
+            self._hashes[size] = int.from_bytes(np.packbits(bits).tobytes(), "big")
+        return self._hashes[size]
+
+    def digest(self):
+        """SHA-1 of the frame content, of the PNG bytes when the frame has them and of the pixels otherwise."""
+        if self._digest is None:
+            data = self._png if self._png is not None else np.ascontiguousarray(self._image).tobytes()
+            self._digest = hashlib.sha1(data).hexdigest()
+        return self._digest
+
+    def save(self, path):
+        return write_bytes(path, self.png)
+
+    def save_async(self, path):
+        return writer.submit(self.save, path)
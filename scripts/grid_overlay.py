@@ -0,0 +1,156 @@
+import os
+
+import cv2
+import numpy as np
+
+GRID_COLOR = (255, 116, 113)
+# Bump when the look of the overlay changes so layers cached by older versions are rebuilt
+GRID_CACHE_VERSION = 1
+SUBAREAS = ("top-left", "top", "top-right", "left", "center", "right", "bottom-left", "bottom", "bottom-right")
+# Offset of each subarea within a cell in quarters of the cell size, in the order of SUBAREAS
+SUBAREA_QUARTERS = np.array([(1, 1), (2, 1), (3, 1), (1, 2), (2, 2), (3, 2), (1, 3), (2, 3), (3, 3)])
+
+overlays = {}
+
+
+def get_unit_len(n):
+    for i in range(1, n + 1):
+        if n % i == 0 and 120 <= i <= 180:
+            return i
+    return -1
+
+
+class GridOverlay:
+    """The numbered grid drawn over a screenshot in grid mode, prepared once per screen size.
+
+    `layer` is a BGRA image holding the cell borders and labels premultiplied by their coverage, so laying the grid
+    over a screenshot is a single blend: a masked copy for the opaque pixels and a weighted sum for the anti-aliased
+    edges of the labels. `centers` maps every (area, subarea) pair to the screen
+    coordinates tapped for it, using the same cell math the agent has always used.
+    """
+
+    def __init__(self, width, height, layer=None, centers=None):
+        self.width = width
+        self.height = height
+        self.unit_width = get_unit_len(width)
+        if self.unit_width < 0:
+            self.unit_width = 120
+        self.unit_height = get_unit_len(height)
+        if self.unit_height < 0:
+            self.unit_height = 120
+        self.rows = height // self.unit_height
+        self.cols = width // self.unit_width
+        self.layer = self.render() if layer is None else layer
+        self.centers = self.build_centers() if centers is None else centers
+        self.lookup = {(area, subarea): tuple(xy) for area, cell in enumerate(self.centers.tolist(), start=1)
+                       for subarea, xy in zip(SUBAREAS, cell)}
+        alpha = cv2.extractChannel(self.layer, 3)
+        self.bgr = cv2.cvtColor(self.layer, cv2.COLOR_BGRA2BGR)
+        self.opaque = cv2.compare(alpha, 255, cv2.CMP_EQ)
+        # Anti-aliased pixels are blended through flat indices into the interleaved channels, one per channel
+        edges = np.flatnonzero(cv2.inRange(alpha, 1, 254))
+        self.edges = (edges[:, None] * 3 + np.arange(3)).ravel()
+        self.edge_colors = self.bgr.reshape(-1)[self.edges].astype(np.uint16)
+        self.edge_weights = np.repeat(255 - alpha.reshape(-1)[edges].astype(np.uint16), 3)
+
+    def draw(self, image):
+        thick = int(self.unit_width // 50)
+        font_scale = int(0.01 * self.unit_width)
+        for i in range(self.rows):
+            for j in range(self.cols):
+                label = str(i * self.cols + j + 1)
+                left, top = j * self.unit_width, i * self.unit_height
+                right, bottom = (j + 1) * self.unit_width, (i + 1) * self.unit_height
+                text_x, text_y = left + int(self.unit_width * 0.05), top + int(self.unit_height * 0.3)
+                cv2.rectangle(image, (left, top), (right, bottom), GRID_COLOR, thick // 2)
+                cv2.putText(image, label, (text_x + 3, text_y + 3), 0, font_scale, (0, 0, 0), thick)
+                cv2.putText(image, label, (text_x, text_y), 0, font_scale, GRID_COLOR, thick)
+        return image
+
+    def render(self):
+        # OpenCV does not composite the alpha channel when drawing, so the grid is drawn over black and over white
+        # instead: the black canvas is the premultiplied colour and the gap between the two is the transparency.
+        on_black = self.draw(np.zeros((self.height, self.width, 3), dtype=np.uint8))
+        on_white = self.draw(np.full((self.height, self.width, 3), 255, dtype=np.uint8))
+        transparency = (on_white.astype(np.int16) - on_black).max(axis=2)
+        alpha = (255 - np.clip(transparency, 0, 255)).astype(np.uint8)
+        return np.dstack([on_black, alpha])
+
+    def build_centers(self):
+        cell_width, cell_height = self.width // self.cols, self.height // self.rows
+        areas = np.arange(self.rows * self.cols)
+        origins = np.stack([areas % self.cols * cell_width, areas // self.cols * cell_height], axis=1)
+        offsets = np.stack([cell_width * SUBAREA_QUARTERS[:, 0] // 4, cell_height * SUBAREA_QUARTERS[:, 1] // 4],
+                           axis=1)
+        return (origins[:, None, :] + offsets[None, :, :]).astype(np.int32)
+
+    def apply(self, image):
+        """Draw the grid onto `image`, a contiguous BGR screenshot of the overlay's size, in place."""
+        if image.shape[:2] != (self.height, self.width):
+            raise ValueError(f"Grid for {self.width}x{self.height} cannot be drawn on a {image.shape[1]}x"
+                             f"{image.shape[0]} image")
+        cv2.copyTo(self.bgr, self.opaque, image)
+        values = image.reshape(-1)
+        values[self.edges] = self.edge_colors + (values[self.edges] * self.edge_weights + 127) // 255
+        return image
+
+    def area_to_xy(self, area, subarea):
+        xy = self.lookup.get((area, subarea))
+        if xy is not None:
+            return xy
+        if subarea not in SUBAREAS:
+            subarea = "center"
+        if 1 <= area <= len(self.centers):
+            return self.lookup[(area, subarea)]
+        # Labels outside the grid are resolved with the same arithmetic, as they always have been
+        cell_width, cell_height = self.width // self.cols, self.height // self.rows
+        area -= 1
+        quarter_x, quarter_y = SUBAREA_QUARTERS[SUBAREAS.index(subarea)]
+        return (area % self.cols * cell_width + cell_width * int(quarter_x) // 4,
+                area // self.cols * cell_height + cell_height * int(quarter_y) // 4)
+
+    @staticmethod
+    def cache_path(cache_dir, width, height):
+        return os.path.join(cache_dir, f"grid_v{GRID_CACHE_VERSION}_{width}x{height}.npz")
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(tmp_path, layer=self.layer, centers=self.centers)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, width, height):
+        with np.load(path) as data:
+            layer, centers = data["layer"], data["centers"]
+        if layer.shape != (height, width, 4):
+            raise ValueError(f"Cached grid {path} is {layer.shape[1]}x{layer.shape[0]}, expected {width}x{height}")
+        return cls(width, height, layer=layer, centers=centers)
+
+
+def get_grid_overlay(width, height, cache_dir=None):
+    """Return the grid overlay for a screen size, building it at most once per process.
+
+    With `cache_dir` set the overlay is also kept on disk, so later runs on a device with the same resolution load it
+    instead of drawing it again.
+    """
+    if (width, height) in overlays:
+        return overlays[(width, height)]
+    overlay = None
+    if cache_dir:
+        path = GridOverlay.cache_path(cache_dir, width, height)
+        if os.path.exists(path):
+            try:
+                overlay = GridOverlay.load(path, width, height)
+            except (OSError, ValueError, KeyError):
+                overlay = None
+        if overlay is None:
+            overlay = GridOverlay(width, height)
+            try:
+                overlay.save(path)
+            except OSError:
+                pass
+    else:
+        overlay = GridOverlay(width, height)
+    overlays[(width, height)] = overlay
+    return overlay
@@ -0,0 +1,153 @@
+import base64
+import hashlib
+import math
+import os
+import tempfile
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from frame import Frame
+
+# extension, MIME type and the OpenCV parameter that controls the quality of each output format
+IMAGE_FORMATS = {
+    "jpeg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY),
+    "png": (".png", "image/png", cv2.IMWRITE_PNG_COMPRESSION),
+}
+
+
+def vision_tokens(width, height):
+    """Estimate the prompt tokens of an image the way OpenAI bills high-detail input: the image is fitted into
+    2048x2048, its short side is scaled down to 768 and every 512px tile costs 170 tokens on top of a base of 85."""
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+class EncodedImage:
+    def __init__(self, data, mime_type, extension, width, height):
+        self.data = data
+        self.mime_type = mime_type
+        self.extension = extension
+        self.width = width
+        self.height = height
+
+    @property
+    def digest(self):
+        return hashlib.sha1(self.data).hexdigest()
+
+    def base64(self):
+        return base64.b64encode(self.data).decode("utf-8")
+
+    def data_url(self):
+        return f"data:{self.mime_type};base64,{self.base64()}"
+
+    def to_file(self, directory):
+        """Write the encoded image to a new file in `directory` and return its path, for clients that only take files.
+        The file belongs to the caller, which deletes it once the request is done."""
+        os.makedirs(directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(suffix=self.extension, prefix=f"{self.digest[:12]}_", dir=directory)
+        with os.fdopen(fd, "wb") as f:
+            f.write(self.data)
+        return path
+
+
+class ImageEncoder:
+    """Turns screenshots into model payloads: downscaled to fit `max_long_edge` pixels and `max_tokens` estimated
+    vision tokens (0 disables either limit), then encoded as JPEG, WebP or PNG at `quality`.
+
+    Results are cached by a hash of the source image and the settings, so a screenshot sent again, e.g. as the
+    "before" image of the next reflection, is encoded only once.
+    """
+
+    def __init__(self, image_format="jpeg", quality=85, max_long_edge=0, max_tokens=0, cache_size=16,
+                 file_dir=None):
+        image_format = image_format.lower().replace("jpg", "jpeg")
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unsupported image format {image_format}, must be one of {', '.join(IMAGE_FORMATS)}")
+        self.image_format = image_format
+        self.quality = quality
+        self.max_long_edge = max_long_edge
+        self.max_tokens = max_tokens
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.file_dir = file_dir or os.path.join(tempfile.gettempdir(), "appagent_images")
+
+    def target_size(self, width, height):
+        scale = 1.0
+        if self.max_long_edge:
+            scale = min(scale, self.max_long_edge / max(width, height))
+        if self.max_tokens:
+            # Tokens only grow with the size, so look for the largest long edge that stays within budget
+            low, high = 1, max(1, round(max(width, height) * scale))
+            while low < high:
+                mid = (low + high + 1) // 2
+                ratio = mid / max(width, height)
+                if vision_tokens(max(1, round(width * ratio)), max(1, round(height * ratio))) <= self.max_tokens:
+                    low = mid
+                else:
+                    high = mid - 1
+            scale = min(scale, low / max(width, height))
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def encode_params(self):
+        _, _, param = IMAGE_FORMATS[self.image_format]
+        if self.image_format == "png":
+            # PNG is lossless, so the quality setting maps onto the compression level instead
+            return [param, max(0, min(9, round((100 - self.quality) / 11)))]
+        return [param, self.quality]
+
+    def encode(self, image):
+        """Encode a Frame, a BGR array, encoded image bytes or an image path, returning an EncodedImage."""
+        frame = self.to_frame(image)
+        key = (frame.digest(), self.image_format, self.quality, self.max_long_edge, self.max_tokens)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        pixels = frame.image
+        height, width = pixels.shape[:2]
+        target_width, target_height = self.target_size(width, height)
+        if (target_width, target_height) != (width, height):
+            # Area averaging avoids aliasing on large reductions but is several times slower than bilinear on small ones
+            interpolation = cv2.INTER_AREA if target_width <= width // 2 else cv2.INTER_LINEAR
+            pixels = cv2.resize(pixels, (target_width, target_height), interpolation=interpolation)
+        extension, mime_type, _ = IMAGE_FORMATS[self.image_format]
+        if self.image_format == "png" and pixels is frame.image:
+            data = frame.png
+        else:
+            ok, buffer = cv2.imencode(extension, pixels, self.encode_params())
+            if not ok:
+                raise ValueError(f"Failed to encode image as {self.image_format}")
+            data = buffer.tobytes()
+        encoded = EncodedImage(data, mime_type, extension, target_width, target_height)
+        self.cache[key] = encoded
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return encoded
+
+    @staticmethod
+    def to_frame(image):
+        if isinstance(image, Frame):
+            return image
+        if isinstance(image, np.ndarray):
+            return Frame(image=image)
+        if isinstance(image, (bytes, bytearray)):
+            return Frame.from_png(image)
+        return Frame.from_file(image)
+
+    def data_url(self, image):
+        return self.encode(image).data_url()
+
+    def to_file(self, image):
+        return self.encode(image).to_file(self.file_dir)
+
+
+def create_image_encoder(configs):
+    return ImageEncoder(image_format=configs.get("IMAGE_FORMAT", "jpeg"),
+                        quality=configs.get("IMAGE_QUALITY", 85),
+                        max_long_edge=configs.get("IMAGE_MAX_LONG_EDGE", 0),
+                        max_tokens=configs.get("IMAGE_MAX_TOKENS", 0))
@@ -1,51 +1,552 @@
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import queue
+import random
 import re
+import threading
+import time
 from abc import abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from typing import List
 from http import HTTPStatus
 
 import requests
 import dashscope
+from requests.adapters import HTTPAdapter
 
-from utils import print_with_color, encode_image
+from image_encoder import ImageEncoder, create_image_encoder, vision_tokens
+from rate_limiter import RateLimiter, create_rate_limiter
+from response_cache import CACHE_MODES, Cassette, ResponseCache, request_key
+from utils import print_with_color, PerfStats
 
+RETRY_STATUS_CODES = {HTTPStatus.TOO_MANY_REQUESTS, HTTPStatus.INTERNAL_SERVER_ERROR, HTTPStatus.BAD_GATEWAY,
+                      HTTPStatus.SERVICE_UNAVAILABLE, HTTPStatus.GATEWAY_TIMEOUT}
 
-class BaseModel:
-    def __init__(self):
+
+def parse_retry_after(value):
+    """Seconds to wait according to a Retry-After header, which holds either a number of seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
         pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def describe_error(response, body):
+    if isinstance(body, dict) and isinstance(body.get("error"), dict):
+        message = body["error"].get("message", "")
+    else:
+        message = " ".join(response.text.split())[:200]
+    return f"HTTP {response.status_code}: {message}"
+
+
+def estimate_tokens(prompt, images, max_tokens=0):
+    """Rough prompt plus completion token count of a request, used to pace requests before the real usage is known."""
+    return len(prompt) // 4 + sum(vision_tokens(image.width, image.height) for image in images) + max_tokens
+
+
+class ModelStream:
+    """A model response that is still arriving. A background thread feeds it text as it comes in and finishes it
+    with the final status, while the caller waits for the lines it needs with `wait_for_line` and for the whole
+    response with `result`.
+    """
+
+    def __init__(self, perf: PerfStats = None):
+        self.perf = perf or PerfStats()
+        self.text = ""
+        self.status = None
+        self.error = ""
+        self.started = time.perf_counter()
+        self.condition = threading.Condition()
+        self.cancelled = threading.Event()
+        self.callbacks = []
+
+    @property
+    def done(self):
+        return self.status is not None
+
+    def feed(self, text):
+        with self.condition:
+            if not self.text:
+                self.perf.record("model_first_chunk", time.perf_counter() - self.started)
+            self.text += text
+            self.condition.notify_all()
+
+    def finish(self, status, error=""):
+        with self.condition:
+            self.status = status
+            self.error = error
+            self.condition.notify_all()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        """Call `callback` with the stream once the response has ended, right away if it already has."""
+        with self.condition:
+            if not self.done:
+                self.callbacks.append(callback)
+                return
+        callback(self)
+
+    def wait_for_line(self, prefix, timeout=None):
+        """Block until a complete line starting with `prefix` has arrived, or the response has ended, and return the
+        status and the text received so far in the same form as `get_model_response`."""
+        pattern = re.compile(rf"^{re.escape(prefix)}.*\n", re.MULTILINE)
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.done or pattern.search(self.text), timeout):
+                return False, f"No {prefix.strip(': ')} line arrived within {timeout}s"
+            if pattern.search(self.text):
+                name = prefix.strip(": ").lower()
+                self.perf.record(f"model_until_{name}", time.perf_counter() - self.started)
+                return True, self.text
+            # The response ended without the line, which is left to the parser to report
+            return self.status, self.text if self.status else self.error
+
+    def cancel(self):
+        """Stop the request behind the stream, which then ends as failed unless it has already finished."""
+        self.cancelled.set()
+
+    def result(self, timeout=None):
+        """Block until the response has ended and return it in the same form as `get_model_response`."""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.done, timeout):
+                return False, f"The model response did not complete within {timeout}s"
+            return self.status, self.text if self.status else self.error
+
+
+CANCELLED = "The model request was cancelled"
+ROUTES = ("reflect", "doc", "privacy")
+
+# USD per 1K prompt and completion tokens, as listed by the providers. A model is priced by the longest entry its name
+# starts with, so dated snapshots such as gpt-4o-2024-08-06 share the price of their family. MODEL_PRICES in the
+# config adds to and overrides this table.
+MODEL_PRICES = {
+    "gpt-4-vision-preview": (0.01, 0.03),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-4.1": (0.002, 0.008),
+    "gpt-4.1-mini": (0.0004, 0.0016),
+    "gpt-4.1-nano": (0.0001, 0.0004),
+    "qwen-vl-max": (0.0008, 0.0032),
+    "qwen-vl-plus": (0.00021, 0.00063),
+}
+
+# The Route that requests made in the current context belong to
+current_route = contextvars.ContextVar("current_route", default=None)
+
+
+def start_thread(target, *args):
+    """Run `target` in a daemon thread that sees the context of the caller, such as its route."""
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(target, *args), daemon=True)
+    thread.start()
+    return thread
+
+
+class UsageMeter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+
+    def add(self, prompt_tokens, completion_tokens, cost):
+        with self.lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cost += cost
+
+
+class CallRecord:
+    """What one model call took and cost. `parsed` stays None until the response is parsed."""
+
+    def __init__(self, model, route=None, cached=False):
+        self.model = model
+        self.route = route
+        self.cached = cached
+        self.timestamp = time.time()
+        self.started = time.perf_counter()
+        self.latency = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.image_bytes = 0
+        self.retries = 0
+        self.cost = 0.0
+        self.status = None
+        self.error = ""
+        self.response = None
+        self.parsed = None
+
+    def to_dict(self):
+        return {"timestamp": round(self.timestamp, 3), "model": self.model, "route": self.route,
+                "cached": self.cached, "status": self.status, "error": self.error, "parsed": self.parsed,
+                "latency_s": round(self.latency or 0.0, 3), "retries": self.retries,
+                "prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens,
+                "image_bytes": self.image_bytes, "cost": round(self.cost, 6)}
+
+
+class CallTotals:
+    def __init__(self, window=10000):
+        self.calls = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.cached = 0
+        self.retries = 0
+        self.parsed = 0
+        self.unparsable = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.image_bytes = 0
+        self.cost = 0.0
+        # Latency percentiles are taken over the most recent calls only, so that a long lived process stays bounded
+        self.latencies = deque(maxlen=window)
+
+    def add(self, call):
+        self.calls += 1
+        self.failed += call.status is False and call.error != CANCELLED
+        self.cancelled += call.error == CANCELLED
+        self.cached += call.cached
+        self.retries += call.retries
+        self.prompt_tokens += call.prompt_tokens
+        self.completion_tokens += call.completion_tokens
+        self.image_bytes += call.image_bytes
+        self.cost += call.cost
+        if call.status and not call.cached:
+            self.latencies.append(call.latency)
+
+    def add_parse(self, ok):
+        self.parsed += ok
+        self.unparsable += not ok
+
+    def to_dict(self):
+        ordered = sorted(self.latencies)
+
+        def percentile(p):
+            return round(ordered[min(len(ordered) - 1, len(ordered) * p // 100)], 3) if ordered else 0.0
+
+        return {"calls": self.calls, "failed": self.failed, "cancelled": self.cancelled, "cached": self.cached,
+                "retries": self.retries, "parsed": self.parsed, "unparsable": self.unparsable,
+                "prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens,
+                "image_bytes": self.image_bytes, "cost": round(self.cost, 6),
+                "mean_latency_s": round(sum(ordered) / len(ordered), 3) if ordered else 0.0,
+                "p50_latency_s": percentile(50), "p95_latency_s": percentile(95), "p99_latency_s": percentile(99)}
+
+
+class MetricsCollector:
+    """Records every model call: tokens, image bytes, latency, retries, cost and whether its response parsed.
+
+    The calls since `start_task` are kept for `write_task`, which writes them and their totals to the task directory.
+    Totals per model and per route are kept for the whole process, see `summary` and `append_summary`.
+    """
+
+    def __init__(self, prices=None):
+        self.prices = dict(MODEL_PRICES, **(prices or {}))
+        self.lock = threading.Lock()
+        self.task_calls = []
+        self.task_skipped = {}
+        self.totals = {}
+        self.unpriced = set()
+
+    def set_prices(self, prices):
+        with self.lock:
+            self.prices.update({model: tuple(price) for model, price in (prices or {}).items()})
+
+    def price(self, model):
+        """USD per 1K prompt and completion tokens of `model`, (0, 0) if it is not in the price table."""
+        matches = [name for name in self.prices if model and model.startswith(name)]
+        if not matches:
+            if model not in self.unpriced:
+                self.unpriced.add(model)
+                print_with_color(f"WARNING: No price known for the model {model}, add it to MODEL_PRICES to track its "
+                                 f"cost", "yellow")
+            return 0.0, 0.0
+        return self.prices[max(matches, key=len)]
+
+    def cost(self, model, prompt_tokens, completion_tokens):
+        prompt_price, completion_price = self.price(model)
+        return prompt_tokens / 1000 * prompt_price + completion_tokens / 1000 * completion_price
+
+    def begin(self, model, cached=False):
+        route = current_route.get()
+        return CallRecord(model, route.name if route is not None else None, cached)
+
+    def finish(self, call, status, response=""):
+        call.latency = time.perf_counter() - call.started
+        call.status = status
+        if status:
+            call.response = response
+        else:
+            call.error = response
+        with self.lock:
+            self.task_calls.append(call)
+            for key in ("total", f"model:{call.model}", f"route:{call.route or 'action'}"):
+                self.totals.setdefault(key, CallTotals()).add(call)
+
+    def mark_parsed(self, rsp, ok):
+        """Record whether the response `rsp` of a recent call could be parsed."""
+        with self.lock:
+            for call in reversed(self.task_calls[-50:]):
+                if call.status and call.parsed is None and call.response == rsp:
+                    call.parsed = ok
+                    for key in ("total", f"model:{call.model}", f"route:{call.route or 'action'}"):
+                        self.totals[key].add_parse(ok)
+                    return
+
+    def skip(self, route):
+        """Record a call to `route` that was not made because its answer was already known."""
+        with self.lock:
+            self.task_skipped[route] = self.task_skipped.get(route, 0) + 1
+
+    def start_task(self):
+        with self.lock:
+            self.task_calls = []
+            self.task_skipped = {}
+
+    def task_summary(self):
+        with self.lock:
+            calls = list(self.task_calls)
+            skipped = dict(self.task_skipped)
+        grouped = {}
+        for call in calls:
+            for key in ("total", f"model:{call.model}", f"route:{call.route or 'action'}"):
+                totals = grouped.setdefault(key, CallTotals())
+                totals.add(call)
+                if call.parsed is not None:
+                    totals.add_parse(call.parsed)
+        summary = self.group(grouped)
+        summary["skipped"] = skipped
+        return summary, calls
+
+    def summary(self):
+        with self.lock:
+            return self.group(self.totals)
+
+    @staticmethod
+    def group(totals):
+        summary = {"total": totals.get("total", CallTotals()).to_dict(), "models": {}, "routes": {}}
+        for key, value in totals.items():
+            kind, _, name = key.partition(":")
+            if kind in ("model", "route"):
+                summary[f"{kind}s"][name] = value.to_dict()
+        return summary
+
+    def write_task(self, path):
+        """Write the calls of the current task and their totals to `path` as JSON."""
+        summary, calls = self.task_summary()
+        summary["calls"] = [call.to_dict() for call in calls]
+        with open(path, "w") as f:
+            json.dump(summary, f, indent=2)
+        return path
+
+    def append_summary(self, path, **context):
+        """Append the totals of the current task, with `context` such as the app and task name, as one JSON line to
+        `path`, which collects them across runs."""
+        if not path:
+            return
+        summary, _ = self.task_summary()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "a") as f:
+            f.write(json.dumps(dict(context, timestamp=round(time.time(), 3), **summary)) + "\n")
+
+    def report(self, color="yellow"):
+        summary = self.task_summary()[0]
+        for name, totals in summary["routes"].items():
+            print_with_color(f"Model calls for {name}: n={totals['calls']} failed={totals['failed']} "
+                             f"retries={totals['retries']} unparsable={totals['unparsable']} "
+                             f"tokens={totals['prompt_tokens']}+{totals['completion_tokens']} "
+                             f"p50={totals['p50_latency_s']:.2f}s p95={totals['p95_latency_s']:.2f}s "
+                             f"cost=${totals['cost']:.4f}", color)
+        for name, count in summary["skipped"].items():
+            print_with_color(f"Model calls for {name} skipped: {count}", color)
+
+
+metrics = MetricsCollector()
+
+
+class BaseModel:
+    def __init__(self, rate_limiter: RateLimiter = None, max_concurrency: int = 4):
+        self.perf = PerfStats()
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.max_concurrency = max_concurrency
+        # Requests made through the async API run here, so its size is also the limit of requests in flight
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="model")
+
+    def route(self, name):
+        """The model to send calls of type `name` to, see RoutedModel. A plain backend answers every type itself."""
+        return self
+
+    def charge(self, tokens, prompt_tokens, completion_tokens, call: CallRecord = None):
+        """Account the real usage of a request that was estimated at `tokens` tokens, and return its cost."""
+        self.rate_limiter.settle(tokens, prompt_tokens + completion_tokens)
+        cost = metrics.cost(getattr(self, "model", ""), prompt_tokens, completion_tokens)
+        if call is not None:
+            call.prompt_tokens = prompt_tokens
+            call.completion_tokens = completion_tokens
+            call.cost = cost
+        route = current_route.get()
+        if route is not None:
+            route.usage.add(prompt_tokens, completion_tokens, cost)
+        return cost
+
+    def wait_for_quota(self, tokens, cancel: threading.Event = None):
+        """Block until the rate limiter admits a request of `tokens` tokens, and return False if cancelled first."""
+        waited = self.rate_limiter.acquire(tokens, cancel)
+        if waited:
+            self.perf.record("rate_limit_wait", waited)
+        return waited is not None
 
     @abstractmethod
-    def get_model_response(self, prompt: str, images: List[str]) -> (bool, str):
+    def request(self, prompt: str, images: List[str], cancel: threading.Event = None) -> (bool, str):
+        """Send a request and block until it is answered, giving up as soon as `cancel` is set."""
         pass
 
+    def get_model_response(self, prompt: str, images: List[str]) -> (bool, str):
+        return self.request(prompt, images)
+
+    async def get_model_response_async(self, prompt: str, images: List[str],
+                                       cancel: threading.Event = None) -> (bool, str):
+        """Awaitable get_model_response. At most `max_concurrency` requests of a model are in flight at once, later
+        ones wait for a free slot.
+
+        Cancelling the awaiting task cancels the request too: a waiting request is dropped, and one in flight gives up
+        at its next retry or rate limit wait, as it does when `cancel` is set.
+        """
+        cancel = cancel or threading.Event()
+        future = self.executor.submit(contextvars.copy_context().run, self.request, prompt, images, cancel)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            cancel.set()
+            raise
+
+    def stats(self):
+        """Counters of wrappers such as caching and hedging, empty for a plain backend."""
+        return {}
+
+    def stream_model_response(self, prompt: str, images: List[str]) -> ModelStream:
+        """Start a request in the background and return its response as a ModelStream. Models that cannot stream
+        deliver the whole response at once."""
+        stream = ModelStream(self.perf)
+
+        def run():
+            status, rsp = self.request(prompt, images, stream.cancelled)
+            if status:
+                stream.feed(rsp)
+            stream.finish(status, "" if status else rsp)
+
+        start_thread(run)
+        return stream
+
 
 class OpenAIModel(BaseModel):
-    def __init__(self, base_url: str, api_key: str, model: str, temperature: float, max_tokens: int):
-        super().__init__()
+    def __init__(self, base_url: str, api_key: str, model: str, temperature: float, max_tokens: int,
+                 image_encoder: ImageEncoder = None, connect_timeout: float = 10, read_timeout: float = 120,
+                 max_retries: int = 3, backoff: float = 1.0, max_backoff: float = 30, rate_limiter: RateLimiter = None,
+                 max_concurrency: int = 4):
+        super().__init__(rate_limiter, max_concurrency)
         self.base_url = base_url
         self.api_key = api_key
         self.model = model
         self.temperature = temperature
         self.max_tokens = max_tokens
+        self.image_encoder = image_encoder or ImageEncoder()
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # One pooled session keeps the connection to the API alive between requests instead of a new TLS handshake
+        # for every call
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency))
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency))
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        })
 
-    def get_model_response(self, prompt: str, images: List[str]) -> (bool, str):
+    def post(self, payload, tokens=0, stream=False, cancel: threading.Event = None, call: CallRecord = None):
+        """Send a chat completion request estimated at `tokens` tokens, retrying connection errors, timeouts, rate
+        limiting, server errors and responses that are not JSON.
+
+        Every attempt first waits for quota on the rate limiter. Waits between attempts follow Retry-After when the
+        server sends it and jittered exponential backoff otherwise. Returns the decoded JSON body, or None and the last
+        error. With `stream` set, a server-sent event stream is returned as the open response instead, so only the
+        request up to its first byte is retried. Once `cancel` is set no further attempt is made.
+        """
+        cancel = cancel or threading.Event()
+        error = ""
+        for attempt in range(self.max_retries + 1):
+            delay = None
+            if cancel.is_set() or not self.wait_for_quota(tokens, cancel):
+                return None, CANCELLED
+            start = time.perf_counter()
+            try:
+                response = self.session.post(self.base_url, json=payload, timeout=self.timeout, stream=stream)
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                error = f"{type(e).__name__}: {e}"
+            else:
+                self.rate_limiter.update(response.headers)
+                if stream and response.status_code == HTTPStatus.OK and \
+                        response.headers.get("Content-Type", "").startswith("text/event-stream"):
+                    return response, ""
+                try:
+                    body = response.json()
+                except ValueError:
+                    body = None
+                if body is not None and response.status_code not in RETRY_STATUS_CODES:
+                    return body, ""
+                error = describe_error(response, body)
+                # A successful status with a body that is not JSON is usually an error page from a proxy in between
+                if response.status_code not in RETRY_STATUS_CODES and response.status_code >= 400:
+                    return None, error
+                delay = parse_retry_after(response.headers.get("Retry-After"))
+            finally:
+                self.perf.record("model_attempt", time.perf_counter() - start)
+            # A failed attempt used up a request but no tokens
+            self.rate_limiter.settle(tokens, 0)
+            if attempt == self.max_retries:
+                break
+            if delay is None:
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            if call is not None:
+                call.retries += 1
+            self.perf.record("model_retry_wait", delay)
+            print_with_color(f"Model request failed ({error}), retrying in {delay:.1f}s "
+                             f"({attempt + 1}/{self.max_retries})", "yellow")
+            if cancel.wait(delay):
+                return None, CANCELLED
+        return None, error
+
+    def build_payload(self, prompt: str, images: List[str], call: CallRecord = None):
+        """Return the chat completion request for a prompt and its images, and its estimated token count."""
         content = [
             {
                 "type": "text",
                 "text": prompt
             }
         ]
-        for img in images:
-            base64_img = encode_image(img)
+        encoded_images = [self.image_encoder.encode(img) for img in images]
+        for encoded in encoded_images:
             content.append({
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:image/jpeg;base64,{base64_img}"
+                    "url": encoded.data_url()
                 }
             })
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
         payload = {
             "model": self.model,
             "messages": [
@@ -57,33 +558,116 @@ class OpenAIModel(BaseModel):
             "temperature": self.temperature,
             "max_tokens": self.max_tokens
         }
-        response = requests.post(self.base_url, headers=headers, json=payload).json()
+        if call is not None:
+            call.image_bytes = sum(len(encoded.data) for encoded in encoded_images)
+        return payload, estimate_tokens(prompt, encoded_images, self.max_tokens)
+
+    def record_usage(self, tokens, usage, call: CallRecord = None):
+        cost = self.charge(tokens, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), call)
+        print_with_color(f"Request cost is ${'{0:.2f}'.format(cost)}", "yellow")
+
+    def read_completion(self, response, tokens, call: CallRecord = None):
         if "error" not in response:
-            usage = response["usage"]
-            prompt_tokens = usage["prompt_tokens"]
-            completion_tokens = usage["completion_tokens"]
-            print_with_color(f"Request cost is "
-                             f"${'{0:.2f}'.format(prompt_tokens / 1000 * 0.01 + completion_tokens / 1000 * 0.03)}",
-                             "yellow")
+            self.record_usage(tokens, response.get("usage") or {}, call)
         else:
             return False, response["error"]["message"]
         return True, response["choices"][0]["message"]["content"]
 
+    def request(self, prompt: str, images: List[str], cancel: threading.Event = None) -> (bool, str):
+        call = metrics.begin(self.model)
+        payload, tokens = self.build_payload(prompt, images, call)
+        with self.perf.timer("model_request"):
+            response, error = self.post(payload, tokens, cancel=cancel, call=call)
+        if response is None:
+            metrics.finish(call, False, error)
+            return False, error
+        status, rsp = self.read_completion(response, tokens, call)
+        metrics.finish(call, status, rsp)
+        return status, rsp
+
+    def stream_model_response(self, prompt: str, images: List[str]) -> ModelStream:
+        call = metrics.begin(self.model)
+        payload, tokens = self.build_payload(prompt, images, call)
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
+        stream = ModelStream(self.perf)
+        start_thread(self.read_stream, payload, tokens, stream, call)
+        return stream
+
+    def read_stream(self, payload, tokens, stream, call: CallRecord):
+        """Feed the deltas of a server-sent event stream into `stream` as they arrive."""
+
+        def end(status, error=""):
+            metrics.finish(call, status, stream.text if status else error)
+            stream.finish(status, error)
+
+        with self.perf.timer("model_request"):
+            response, error = self.post(payload, tokens, stream=True, cancel=stream.cancelled, call=call)
+            if response is None:
+                end(False, error)
+                return
+            if isinstance(response, dict):
+                # The endpoint ignored the stream flag and answered with the whole completion
+                status, rsp = self.read_completion(response, tokens, call)
+                if status:
+                    stream.feed(rsp)
+                end(status, "" if status else rsp)
+                return
+            usage = {}
+            # Event streams are UTF-8, whatever charset the Content-Type leaves requests to guess
+            response.encoding = "utf-8"
+            try:
+                for line in response.iter_lines(decode_unicode=True):
+                    if stream.cancelled.is_set():
+                        end(False, CANCELLED)
+                        return
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    if "error" in chunk:
+                        end(False, chunk["error"].get("message", str(chunk["error"])))
+                        return
+                    usage = chunk.get("usage") or usage
+                    for choice in chunk.get("choices") or []:
+                        text = (choice.get("delta") or {}).get("content")
+                        if text:
+                            stream.feed(text)
+            except (requests.RequestException, ValueError) as e:
+                end(False, f"{type(e).__name__}: {e}")
+                return
+            finally:
+                response.close()
+        self.record_usage(tokens, usage, call)
+        end(True)
+
 
 class QwenModel(BaseModel):
-    def __init__(self, api_key: str, model: str):
-        super().__init__()
+    def __init__(self, api_key: str, model: str, image_encoder: ImageEncoder = None, rate_limiter: RateLimiter = None,
+                 max_concurrency: int = 4):
+        super().__init__(rate_limiter, max_concurrency)
         self.model = model
+        self.image_encoder = image_encoder or ImageEncoder()
         dashscope.api_key = api_key
 
-    def get_model_response(self, prompt: str, images: List[str]) -> (bool, str):
+    def request(self, prompt: str, images: List[str], cancel: threading.Event = None) -> (bool, str):
+        call = metrics.begin(self.model)
         content = [{
             "text": prompt
         }]
-        for img in images:
-            img_path = f"file://{img}"
+        encoded_images = [self.image_encoder.encode(img) for img in images]
+        call.image_bytes = sum(len(encoded.data) for encoded in encoded_images)
+        tokens = estimate_tokens(prompt, encoded_images)
+        if (cancel is not None and cancel.is_set()) or not self.wait_for_quota(tokens, cancel):
+            metrics.finish(call, False, CANCELLED)
+            return False, CANCELLED
+        # dashscope only takes local images as files, which are deleted again once it has answered
+        img_paths = [encoded.to_file(self.image_encoder.file_dir) for encoded in encoded_images]
+        for img_path in img_paths:
             content.append({
-                "image": img_path
+                "image": f"file://{img_path}"
             })
         messages = [
             {
@@ -91,27 +675,464 @@ class QwenModel(BaseModel):
                 "content": content
             }
         ]
-        response = dashscope.MultiModalConversation.call(model=self.model, messages=messages)
+        try:
+            # The dashscope call blocks until the whole response is in and cannot be interrupted
+            with self.perf.timer("model_request"):
+                response = dashscope.MultiModalConversation.call(model=self.model, messages=messages)
+        finally:
+            for img_path in img_paths:
+                try:
+                    os.remove(img_path)
+                except OSError:
+                    pass
         if response.status_code == HTTPStatus.OK:
-            return True, response.output.choices[0].message.content[0]["text"]
+            usage = response.usage or {}
+            self.charge(tokens, usage.get("input_tokens", 0), usage.get("output_tokens", 0), call)
+            status, rsp = True, response.output.choices[0].message.content[0]["text"]
         else:
-            return False, response.message
+            status, rsp = False, response.message
+        metrics.finish(call, status, rsp)
+        return status, rsp
+
+
+class CachedModel(BaseModel):
+    """Answers requests to `model` from recorded responses where it can.
+
+    live     requests whose key is in `cache` are answered from it, others are sent and their responses stored
+    record   every request is sent, and its response stored in `cache` and appended to `cassette`
+    replay   nothing is sent, requests are answered from `cassette` (or `cache`) and fail once it is used up
+
+    Requests are keyed by the model, the prompt, the image pixels and the temperature, see `request_key`.
+    """
+
+    def __init__(self, model: BaseModel, cache: ResponseCache = None, cassette: Cassette = None, mode="live"):
+        super().__init__(model.rate_limiter, model.max_concurrency)
+        self.model = model
+        self.perf = model.perf
+        self.cache = cache
+        self.cassette = cassette
+        self.mode = mode
+        self.sent = 0
+
+    def key(self, prompt, images):
+        frames = [ImageEncoder.to_frame(img) for img in images]
+        return request_key(getattr(self.model, "model", type(self.model).__name__), prompt,
+                           [frame.image for frame in frames], getattr(self.model, "temperature", None))
+
+    def lookup(self, key):
+        if self.mode == "replay":
+            rsp = self.cassette.next(key) if self.cassette else None
+            if rsp is None and self.cache:
+                rsp = self.cache.get(key)
+            return rsp
+        if self.mode == "live" and self.cache:
+            return self.cache.get(key)
+        return None
+
+    def store(self, key, status, rsp):
+        if not status:
+            return
+        if self.cache:
+            self.cache.put(key, rsp, model=getattr(self.model, "model", ""))
+        if self.mode == "record" and self.cassette:
+            self.cassette.append(key, rsp)
+
+    def answered(self, rsp):
+        call = metrics.begin(getattr(self.model, "model", type(self.model).__name__), cached=True)
+        metrics.finish(call, True, rsp)
+
+    def request(self, prompt: str, images: List[str], cancel: threading.Event = None) -> (bool, str):
+        with self.perf.timer("cache_lookup"):
+            key = self.key(prompt, images)
+            rsp = self.lookup(key)
+        if rsp is not None:
+            self.answered(rsp)
+            return True, rsp
+        if self.mode == "replay":
+            return False, "ERROR: no recorded response left to replay"
+        self.sent += 1
+        status, rsp = self.model.request(prompt, images, cancel)
+        self.store(key, status, rsp)
+        return status, rsp
+
+    def stream_model_response(self, prompt: str, images: List[str]) -> ModelStream:
+        with self.perf.timer("cache_lookup"):
+            key = self.key(prompt, images)
+            rsp = self.lookup(key)
+        if rsp is not None or self.mode == "replay":
+            stream = ModelStream(self.perf)
+            if rsp is not None:
+                self.answered(rsp)
+                stream.feed(rsp)
+                stream.finish(True)
+            else:
+                stream.finish(False, "ERROR: no recorded response left to replay")
+            return stream
+        self.sent += 1
+        stream = self.model.stream_model_response(prompt, images)
+        start_thread(lambda: self.store(key, *stream.result()))
+        return stream
+
+    def stats(self):
+        stats = {"mode": self.mode, "sent": self.sent}
+        if self.cache:
+            stats["cache"] = self.cache.stats()
+        if self.cassette:
+            stats["cassette"] = self.cassette.stats()
+        if self.model.stats():
+            stats["model"] = self.model.stats()
+        return stats
+
+
+def is_valid_response(rsp):
+    """Whether a response can be used: not empty, and with every line of the template it answers."""
+    if not rsp or not rsp.strip():
+        return False
+    if re.search(r"^Observation: ", rsp, re.MULTILINE):
+        return all(re.search(rf"^{field}: ", rsp, re.MULTILINE) for field in ("Thought", "Action", "Summary"))
+    decision = re.findall(r"^Decision: (.*?)$", rsp, re.MULTILINE)
+    if decision:
+        if decision[0] not in ("INEFFECTIVE", "BACK", "CONTINUE", "SUCCESS") or \
+                not re.search(r"^Thought: ", rsp, re.MULTILINE):
+            return False
+        return decision[0] == "INEFFECTIVE" or re.search(r"^Documentation: ", rsp, re.MULTILINE) is not None
+    return True
+
+
+class HedgedModel(BaseModel):
+    """Sends each request to `primary` and, when it has not answered by the `percentile` of its recent latencies,
+    the same request to `secondary` as well. The first valid response wins and the other request is cancelled.
+
+    Until `min_samples` latencies of the primary are known the deadline is `initial_deadline` seconds. A response is
+    valid when `validator` accepts it. A primary that fails before its deadline hands the request to the secondary
+    right away. Both requests are streamed where the backend supports it, so cancelling the loser also stops its
+    generation.
+    """
+
+    def __init__(self, primary: BaseModel, secondary: BaseModel, percentile=95, initial_deadline=10.0, min_samples=10,
+                 window=100, validator=is_valid_response):
+        super().__init__(primary.rate_limiter, primary.max_concurrency * 2)
+        self.primary = primary
+        self.secondary = secondary
+        self.perf = primary.perf
+        self.percentile = percentile
+        self.initial_deadline = initial_deadline
+        self.min_samples = min_samples
+        self.validator = validator
+        self.latencies = deque(maxlen=window)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0
+        self.failovers = 0
+        self.failed = 0
+        self.wins = {"primary": 0, "secondary": 0}
+
+    @property
+    def model(self):
+        return getattr(self.primary, "model", type(self.primary).__name__)
+
+    @property
+    def temperature(self):
+        return getattr(self.primary, "temperature", None)
+
+    def deadline(self):
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return self.initial_deadline
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, len(ordered) * self.percentile // 100)]
 
+    def request(self, prompt: str, images: List[str], cancel: threading.Event = None) -> (bool, str):
+        cancel = cancel or threading.Event()
+        start = time.perf_counter()
+        deadline = start + self.deadline()
+        # The legs report their end here rather than through waiter threads, which a busy executor would starve
+        finished = queue.Queue()
+        legs = {}
 
-def parse_explore_rsp(rsp):
+        def start_leg(name, backend):
+            legs[name] = backend.stream_model_response(prompt, images)
+            legs[name].add_done_callback(lambda _stream: finished.put(name))
+
+        start_leg("primary", self.primary)
+        waiting = {"primary"}
+        result = None
+        with self.lock:
+            self.requests += 1
+        while waiting or "secondary" not in legs:
+            hedge = "secondary" not in legs and ("primary" not in waiting or time.perf_counter() >= deadline)
+            if hedge:
+                with self.lock:
+                    if "primary" in waiting:
+                        self.hedged += 1
+                    else:
+                        self.failovers += 1
+                start_leg("secondary", self.secondary)
+                waiting.add("secondary")
+            # Wake up at the deadline, and regularly to notice a cancelled request
+            timeout = 0.05 if "secondary" in legs else min(0.05, max(0.0, deadline - time.perf_counter()))
+            try:
+                done = [finished.get(timeout=timeout)]
+            except queue.Empty:
+                done = []
+            if cancel.is_set():
+                for stream in legs.values():
+                    stream.cancel()
+                return False, CANCELLED
+            for name in done:
+                waiting.discard(name)
+                status, rsp = legs[name].result()
+                if name == "primary":
+                    with self.lock:
+                        self.latencies.append(time.perf_counter() - start)
+                if status and self.validator(rsp):
+                    for other, stream in legs.items():
+                        if other != name and not stream.done:
+                            stream.cancel()
+                            if other == "primary":
+                                # The primary took at least this long, leaving it out would pull the deadline down
+                                with self.lock:
+                                    self.latencies.append(time.perf_counter() - start)
+                    with self.lock:
+                        self.wins[name] += 1
+                    self.perf.record("hedged_request", time.perf_counter() - start)
+                    return True, rsp
+                if result is None or name == "primary":
+                    result = (False, rsp if not status else f"Invalid response from the {name} model: {rsp}")
+        with self.lock:
+            self.failed += 1
+        return result
+
+    def stats(self):
+        deadline = self.deadline()
+        with self.lock:
+            return {"requests": self.requests, "hedged": self.hedged,
+                    "hedge_rate": round(self.hedged / self.requests, 3) if self.requests else 0.0,
+                    "failovers": self.failovers, "wins": dict(self.wins), "failed": self.failed,
+                    "deadline_s": round(deadline, 3)}
+
+
+class Route(BaseModel):
+    """One type of call, such as reflections, sent to its own `backend`. A response `validator` rejects is requested
+    again from `fallback`, usually the stronger default model. Latency, fallbacks, tokens and cost are tracked per
+    route."""
+
+    def __init__(self, name, backend: BaseModel, fallback: BaseModel = None, validator=is_valid_response):
+        super().__init__(backend.rate_limiter, backend.max_concurrency)
+        self.name = name
+        self.backend = backend
+        self.fallback = fallback
+        self.validator = validator
+        self.usage = UsageMeter()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.fallbacks = 0
+        self.failed = 0
+
+    def account(self, status, start):
+        self.perf.record("latency", time.perf_counter() - start)
+        with self.lock:
+            self.requests += 1
+            self.failed += not status
+
+    def request(self, prompt: str, images: List[str], cancel: threading.Event = None) -> (bool, str):
+        start = time.perf_counter()
+        token = current_route.set(self)
+        try:
+            status, rsp = self.backend.request(prompt, images, cancel)
+            if self.fallback is not None and not (status and self.validator(rsp)) and rsp != CANCELLED:
+                print_with_color(f"The {self.name} model gave no usable response, asking the default model instead",
+                                 "yellow")
+                with self.lock:
+                    self.fallbacks += 1
+                status, rsp = self.fallback.request(prompt, images, cancel)
+        finally:
+            current_route.reset(token)
+        self.account(status, start)
+        return status, rsp
+
+    def stream_model_response(self, prompt: str, images: List[str]) -> ModelStream:
+        if self.fallback is not None:
+            # The response has to be complete before it can be checked and possibly requested again
+            return super().stream_model_response(prompt, images)
+        start = time.perf_counter()
+        token = current_route.set(self)
+        try:
+            stream = self.backend.stream_model_response(prompt, images)
+        finally:
+            current_route.reset(token)
+        start_thread(lambda: self.account(stream.result()[0], start))
+        return stream
+
+    def stats(self):
+        latency = self.perf.summary().get("latency", {})
+        with self.lock, self.usage.lock:
+            return {"model": getattr(self.backend, "model", type(self.backend).__name__), "requests": self.requests,
+                    "fallbacks": self.fallbacks, "failed": self.failed,
+                    "mean_ms": round(latency.get("mean_ms", 0.0), 1), "p50_ms": round(latency.get("p50_ms", 0.0), 1),
+                    "prompt_tokens": self.usage.prompt_tokens, "completion_tokens": self.usage.completion_tokens,
+                    "cost": round(self.usage.cost, 4)}
+
+
+class RoutedModel(BaseModel):
+    """Sends each type of call to the backend configured for it in `backends`, and everything else, including the
+    action decisions, to `default`. `route(name)` returns the Route to call."""
+
+    def __init__(self, default: BaseModel, backends=None, validator=is_valid_response):
+        super().__init__(default.rate_limiter, default.max_concurrency)
+        self.default = default
+        self.perf = default.perf
+        self.validator = validator
+        self.lock = threading.Lock()
+        self.routes = {name: Route(name, backend, default, validator) for name, backend in (backends or {}).items()}
+
+    @property
+    def model(self):
+        return getattr(self.default, "model", type(self.default).__name__)
+
+    def route(self, name):
+        with self.lock:
+            if name not in self.routes:
+                self.routes[name] = Route(name, self.default)
+            return self.routes[name]
+
+    def request(self, prompt: str, images: List[str], cancel: threading.Event = None) -> (bool, str):
+        return self.route("action").request(prompt, images, cancel)
+
+    def stream_model_response(self, prompt: str, images: List[str]) -> ModelStream:
+        return self.route("action").stream_model_response(prompt, images)
+
+    def stats(self):
+        with self.lock:
+            routes = dict(self.routes)
+        stats = {"routes": {name: route.stats() for name, route in routes.items()}}
+        if self.default.stats():
+            stats["default"] = self.default.stats()
+        return stats
+
+
+def build_model(configs):
+    """Build the backend selected by MODEL. Returns None for an unsupported model type."""
+    if configs["MODEL"] == "OpenAI":
+        mllm = OpenAIModel(base_url=configs["OPENAI_API_BASE"],
+                           api_key=configs["OPENAI_API_KEY"],
+                           model=configs["OPENAI_API_MODEL"],
+                           temperature=configs["TEMPERATURE"],
+                           max_tokens=configs["MAX_TOKENS"],
+                           image_encoder=create_image_encoder(configs),
+                           connect_timeout=configs.get("CONNECT_TIMEOUT", 10),
+                           read_timeout=configs.get("READ_TIMEOUT", 120),
+                           max_retries=configs.get("MAX_RETRIES", 3),
+                           rate_limiter=create_rate_limiter(configs, configs["OPENAI_API_KEY"]),
+                           max_concurrency=configs.get("MODEL_CONCURRENCY", 4))
+    elif configs["MODEL"] == "Qwen":
+        mllm = QwenModel(api_key=configs["DASHSCOPE_API_KEY"],
+                         model=configs["QWEN_MODEL"],
+                         image_encoder=create_image_encoder(configs),
+                         rate_limiter=create_rate_limiter(configs, configs["DASHSCOPE_API_KEY"]),
+                         max_concurrency=configs.get("MODEL_CONCURRENCY", 4))
+    else:
+        print_with_color(f"ERROR: Unsupported model type {configs['MODEL']}!", "red")
+        return None
+    return mllm
+
+
+def create_model(configs):
+    """Build the model selected by MODEL, hedged with HEDGE_MODEL when it is set, with the backends of the ROUTE_
+    settings for the other types of calls, each behind a CachedModel when MODEL_CACHE_MODE asks for one. Returns
+    None for an unsupported configuration."""
+    metrics.set_prices(configs.get("MODEL_PRICES"))
+    mllm = build_model(configs)
+    if mllm is None:
+        return None
+    if configs.get("HEDGE_MODEL"):
+        # The secondary backend takes the settings of the primary unless HEDGE_ prefixed ones override them
+        secondary_configs = dict(configs, MODEL=configs["HEDGE_MODEL"])
+        for key in ("OPENAI_API_BASE", "OPENAI_API_KEY", "OPENAI_API_MODEL", "DASHSCOPE_API_KEY", "QWEN_MODEL"):
+            if configs.get(f"HEDGE_{key}"):
+                secondary_configs[key] = configs[f"HEDGE_{key}"]
+        secondary = build_model(secondary_configs)
+        if secondary is None:
+            return None
+        mllm = HedgedModel(mllm, secondary, percentile=configs.get("HEDGE_PERCENTILE", 95),
+                           initial_deadline=configs.get("HEDGE_DEADLINE", 10))
+    backends = {}
+    for name in ROUTES:
+        # A route is set as the backend type, optionally followed by the model to use on it, e.g. OpenAI:gpt-4o-mini
+        backend_type, _, model_name = configs.get(f"ROUTE_{name.upper()}", "").partition(":")
+        if not backend_type:
+            continue
+        route_configs = dict(configs, MODEL=backend_type)
+        if model_name:
+            route_configs["QWEN_MODEL" if backend_type == "Qwen" else "OPENAI_API_MODEL"] = model_name
+        backends[name] = build_model(route_configs)
+        if backends[name] is None:
+            return None
+    cached = create_cached_model(configs)
+    if cached is False:
+        return None
+    return RoutedModel(cached(mllm), {name: cached(backend) for name, backend in backends.items()})
+
+
+def create_cached_model(configs):
+    """Return a function that puts a model behind the response cache configured by MODEL_CACHE_MODE, the same cache
+    for every model, or False if the configuration is invalid."""
+    mode = configs.get("MODEL_CACHE_MODE", "live")
+    if mode not in CACHE_MODES:
+        print_with_color(f"ERROR: Unsupported model cache mode {mode}, using live!", "red")
+        mode = "live"
+    cache_dir = configs.get("MODEL_CACHE_DIR", "")
+    cassette_path = configs.get("MODEL_CASSETTE", "")
+    if mode == "live" and not cache_dir:
+        return lambda mllm: mllm
+    if mode == "replay" and not cassette_path and not cache_dir:
+        print_with_color("ERROR: Replaying model responses needs MODEL_CASSETTE or MODEL_CACHE_DIR!", "red")
+        return False
+    cache = ResponseCache(cache_dir, configs.get("MODEL_CACHE_MB", 256) * 1024 * 1024) if cache_dir else None
+    cassette = Cassette(cassette_path) if cassette_path and mode != "live" else None
+    print_with_color(f"Model responses are served in {mode} mode", "yellow")
+    return lambda mllm: CachedModel(mllm, cache, cassette, mode)
+
+
+def parse_summary(rsp):
+    summary = re.findall(r"Summary: (.*?)$", rsp, re.MULTILINE)
+    return summary[0] if summary else None
+
+
+def records_parse(parse):
+    """Record in `metrics` whether the complete response passed to `parse` could be parsed."""
+
+    @functools.wraps(parse)
+    def wrapper(rsp, *args, **kwargs):
+        res = parse(rsp, *args, **kwargs)
+        if not kwargs.get("partial"):
+            metrics.mark_parsed(rsp, res[0] != "ERROR")
+        return res
+
+    return wrapper
+
+
+@records_parse
+def parse_explore_rsp(rsp, partial=False):
+    """Parse a response to the task or explore template. With `partial` set, `rsp` may end after the Action line,
+    as it does while the response is still streaming in, and the Action text stands in for the missing Summary."""
     try:
         observation = re.findall(r"Observation: (.*?)$", rsp, re.MULTILINE)[0]
         think = re.findall(r"Thought: (.*?)$", rsp, re.MULTILINE)[0]
         act = re.findall(r"Action: (.*?)$", rsp, re.MULTILINE)[0]
-        last_act = re.findall(r"Summary: (.*?)$", rsp, re.MULTILINE)[0]
+        last_act = parse_summary(rsp) if partial else re.findall(r"Summary: (.*?)$", rsp, re.MULTILINE)[0]
         print_with_color("Observation:", "yellow")
         print_with_color(observation, "magenta")
         print_with_color("Thought:", "yellow")
         print_with_color(think, "magenta")
         print_with_color("Action:", "yellow")
         print_with_color(act, "magenta")
-        print_with_color("Summary:", "yellow")
-        print_with_color(last_act, "magenta")
+        if last_act is None:
+            # The summary has not arrived yet, the action stands in for it until it does
+            last_act = act
+        else:
+            print_with_color("Summary:", "yellow")
+            print_with_color(last_act, "magenta")
         if "FINISH" in act:
             return ["FINISH"]
         act_name = act.split("(")[0]
@@ -143,20 +1164,25 @@ def parse_explore_rsp(rsp):
         return ["ERROR"]
 
 
-def parse_grid_rsp(rsp):
+@records_parse
+def parse_grid_rsp(rsp, partial=False):
     try:
         observation = re.findall(r"Observation: (.*?)$", rsp, re.MULTILINE)[0]
         think = re.findall(r"Thought: (.*?)$", rsp, re.MULTILINE)[0]
         act = re.findall(r"Action: (.*?)$", rsp, re.MULTILINE)[0]
-        last_act = re.findall(r"Summary: (.*?)$", rsp, re.MULTILINE)[0]
+        last_act = parse_summary(rsp) if partial else re.findall(r"Summary: (.*?)$", rsp, re.MULTILINE)[0]
         print_with_color("Observation:", "yellow")
         print_with_color(observation, "magenta")
         print_with_color("Thought:", "yellow")
         print_with_color(think, "magenta")
         print_with_color("Action:", "yellow")
         print_with_color(act, "magenta")
-        print_with_color("Summary:", "yellow")
-        print_with_color(last_act, "magenta")
+        if last_act is None:
+            # The summary has not arrived yet, the action stands in for it until it does
+            last_act = act
+        else:
+            print_with_color("Summary:", "yellow")
+            print_with_color(last_act, "magenta")
         if "FINISH" in act:
             return ["FINISH"]
         act_name = act.split("(")[0]
@@ -188,6 +1214,7 @@ def parse_grid_rsp(rsp):
         return ["ERROR"]
 
 
+@records_parse
 def parse_reflect_rsp(rsp):
     try:
         decision = re.findall(r"Decision: (.*?)$", rsp, re.MULTILINE)[0]
@@ -210,3 +1237,20 @@ def parse_reflect_rsp(rsp):
         print_with_color(f"ERROR: an exception occurs while parsing the model response: {e}", "red")
         print_with_color(rsp, "red")
         return ["ERROR"]
+
+
+@records_parse
+def parse_merged_rsp(rsp):
+    """Parse a response to the merged explore template: the reflection on the last action before the Observation line
+    and the next action from it on. Returns [reflection, action] as parse_reflect_rsp and parse_explore_rsp return
+    them, or ["ERROR"] if either part cannot be parsed."""
+    split = rsp.find("Observation:")
+    if split < 0:
+        print_with_color("ERROR: the model response has no Observation line", "red")
+        print_with_color(rsp, "red")
+        return ["ERROR"]
+    reflection = parse_reflect_rsp(rsp[:split])
+    action = parse_explore_rsp(rsp[split:])
+    if reflection[0] == "ERROR" or action[0] == "ERROR":
+        return ["ERROR"]
+    return [reflection, action]
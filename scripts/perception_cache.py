@@ -0,0 +1,64 @@
+import hashlib
+from collections import OrderedDict
+
+
+class PerceptionEntry:
+    def __init__(self, elem_list, labeled, ui_doc="", excluded=frozenset()):
+        self.elem_list = elem_list
+        self.labeled = labeled
+        self.ui_doc = ui_doc
+        self.excluded = excluded
+        self.size = labeled.nbytes + len(ui_doc) + sum(len(uid) for uid in elem_list.uids) + \
+            elem_list.bounds.nbytes + elem_list.flags.nbytes
+
+
+class PerceptionCache:
+    """LRU of perception results for screens seen before, bounded by the approximate size of what it holds.
+
+    An entry is keyed by a hash of the dumped hierarchy, the difference hash of the screenshot and whatever else
+    changes the result (labeling mode), and stores the extracted elements, the labeled screenshot as a Frame and the
+    documentation assembled for it. Elements the caller leaves out are not part of the key: the entry holds every
+    extracted element and records in `excluded` which of them the labeled screenshot leaves out.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(xml, frame, *context):
+        digest = hashlib.sha1(xml)
+        digest.update(repr(context).encode("utf-8"))
+        return f"{digest.hexdigest()}:{frame.dhash():016x}"
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, elem_list, labeled, ui_doc="", excluded=frozenset()):
+        if self.max_bytes <= 0:
+            return
+        entry = PerceptionEntry(elem_list, labeled, ui_doc, excluded)
+        if entry.size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.size -= self.entries.pop(key).size
+        self.entries[key] = entry
+        self.size += entry.size
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.size
+            self.evictions += 1
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self.entries),
+                "bytes": self.size}
@@ -9,8 +9,10 @@ import time
 
 import prompts
 from config import load_config
-from and_controller import list_all_devices, AndroidController, traverse_tree
-from model import parse_explore_rsp, parse_reflect_rsp, OpenAIModel, QwenModel
+from and_controller import list_all_devices, AndroidController, extract_elements
+from frame import Frame
+from model import parse_explore_rsp, parse_reflect_rsp, parse_merged_rsp, create_model, metrics
+from perception_cache import PerceptionCache
 from utils import print_with_color, draw_bbox_multi
 
 arg_desc = "AppAgent - Personalize the APP"
@@ -20,17 +22,8 @@ args = vars(parser.parse_args())
 
 configs = load_config()
 
-if configs["MODEL"] == "OpenAI":
-    mllm = OpenAIModel(base_url=configs["OPENAI_API_BASE"],
-                       api_key=configs["OPENAI_API_KEY"],
-                       model=configs["OPENAI_API_MODEL"],
-                       temperature=configs["TEMPERATURE"],
-                       max_tokens=configs["MAX_TOKENS"])
-elif configs["MODEL"] == "Qwen":
-    mllm = QwenModel(api_key=configs["DASHSCOPE_API_KEY"],
-                     model=configs["QWEN_MODEL"])
-else:
-    print_with_color(f"ERROR: Unsupported model type {configs['MODEL']}!", "red")
+mllm = create_model(configs)
+if mllm is None:
     sys.exit()
 
 root_dir = args["root_dir"]
@@ -84,53 +77,141 @@ doc_count = 0
 useless_list = set()
 last_act = "None"
 task_complete = False
+perception_cache = PerceptionCache(configs.get("PERCEPTION_CACHE_MB", 64) * 1024 * 1024)
+persist_labeled = configs.get("PERSIST_LABELED_SCREENSHOTS", True)
+reuse_after = configs.get("REUSE_AFTER_CAPTURE", False)
+skip_unchanged = configs.get("SKIP_UNCHANGED_REFLECTION", False)
+merged = configs.get("MERGED_REFLECTION", False)
+state_after = None
+# In merged mode, the action waiting to be reflected on in the same call that decides on the next one
+pending = None
+
+
+def log_reflection(step, prompt, rsp, **extra):
+    with open(reflect_log_path, "a") as logfile:
+        log_item = {"step": step, "prompt": prompt, "image_before": f"{step}_before_labeled.png",
+                    "image_after": f"{step}_after.png", "response": rsp, **extra}
+        logfile.write(json.dumps(log_item) + "\n")
+
+
+def record_reflection(res, resource_id, act_name):
+    """Act on the parsed reflection `res` on the action `act_name` on the element `resource_id`: mark the element as
+    useless unless the action moved the task forward, go back if asked to and document the element. Returns the
+    decision, or "ERROR" if the run cannot go on."""
+    global last_act, doc_count
+    decision = res[0]
+    if decision == "ERROR":
+        return decision
+    if decision == "INEFFECTIVE":
+        useless_list.add(resource_id)
+        last_act = "None"
+        return decision
+    if decision != "BACK" and decision != "CONTINUE" and decision != "SUCCESS":
+        print_with_color(f"ERROR: Undefined decision! {decision}", "red")
+        return "ERROR"
+    if decision == "BACK" or decision == "CONTINUE":
+        useless_list.add(resource_id)
+        last_act = "None"
+        if decision == "BACK":
+            ret = controller.back()
+            if ret == "ERROR":
+                print_with_color("ERROR: back execution failed", "red")
+                return ret
+            controller.wait_for_idle("back")
+    doc = res[-1]
+    doc_name = resource_id + ".txt"
+    doc_path = os.path.join(docs_dir, doc_name)
+    if os.path.exists(doc_path):
+        doc_content = ast.literal_eval(open(doc_path).read())
+        if doc_content[act_name]:
+            print_with_color(f"Documentation for the element {resource_id} already exists.", "yellow")
+            return decision
+    else:
+        doc_content = {
+            "tap": "",
+            "text": "",
+            "v_swipe": "",
+            "h_swipe": "",
+            "long_press": ""
+        }
+    doc_content[act_name] = doc
+    with open(doc_path, "w") as outfile:
+        outfile.write(str(doc_content))
+    doc_count += 1
+    print_with_color(f"Documentation generated and saved to {doc_path}", "yellow")
+    return decision
+
+
 while round_count < configs["MAX_ROUNDS"]:
     round_count += 1
     print_with_color(f"Round {round_count}", "yellow")
-    screenshot_before = controller.get_screenshot(f"{round_count}_before", task_dir)
-    xml_path = controller.get_xml(f"{round_count}", task_dir)
-    if screenshot_before == "ERROR" or xml_path == "ERROR":
+    # Unless the last round went back, the screen usually still shows what was captured after its action
+    state = controller.reuse_state(state_after) if reuse_after else None
+    state_after = None
+    if state is not None:
+        print_with_color("The screen is unchanged since the last action, reusing its capture", "yellow")
+    else:
+        state = controller.capture_state(f"{round_count}_before", f"{round_count}", task_dir)
+    if state == "ERROR":
         break
-    clickable_list = []
-    focusable_list = []
-    traverse_tree(xml_path, clickable_list, "clickable", True)
-    traverse_tree(xml_path, focusable_list, "focusable", True)
-    elem_list = []
-    for elem in clickable_list:
-        if elem.uid in useless_list:
-            continue
-        elem_list.append(elem)
-    for elem in focusable_list:
-        if elem.uid in useless_list:
-            continue
-        bbox = elem.bbox
-        center = (bbox[0][0] + bbox[1][0]) // 2, (bbox[0][1] + bbox[1][1]) // 2
-        close = False
-        for e in clickable_list:
-            bbox = e.bbox
-            center_ = (bbox[0][0] + bbox[1][0]) // 2, (bbox[0][1] + bbox[1][1]) // 2
-            dist = (abs(center[0] - center_[0]) ** 2 + abs(center[1] - center_[1]) ** 2) ** 0.5
-            if dist <= configs["MIN_DIST"]:
-                close = True
-                break
-        if not close:
-            elem_list.append(elem)
-    draw_bbox_multi(screenshot_before, os.path.join(task_dir, f"{round_count}_before_labeled.png"), elem_list,
-                    dark_mode=configs["DARK_MODE"])
+    screenshot_before, xml = state.frame, state.xml
+    labeled_path = os.path.join(task_dir, f"{round_count}_before_labeled.png")
+    cache_key = perception_cache.key(xml, screenshot_before, configs["DARK_MODE"])
+    cached = perception_cache.get(cache_key)
+    if cached:
+        all_elements = cached.elem_list
+    else:
+        with controller.perf.timer("xml_parse"):
+            all_elements = extract_elements(xml)
+    # Useless elements are left out after the lookup, so that finding one does not make the screen look new
+    excluded = frozenset(uid for uid in all_elements.uids if uid in useless_list)
+    elem_list = all_elements.exclude(excluded)
+    if cached and cached.excluded == excluded:
+        print_with_color("The screen is unchanged since it was last labeled, reusing the labeled screenshot", "yellow")
+        labeled = cached.labeled
+    else:
+        with controller.perf.timer("render"):
+            labeled = Frame(image=draw_bbox_multi(screenshot_before.image, None, elem_list,
+                                                  dark_mode=configs["DARK_MODE"]))
+        perception_cache.put(cache_key, all_elements, labeled, excluded=excluded)
+    if persist_labeled:
+        labeled.save_async(labeled_path)
 
     prompt = re.sub(r"<app>", app, prompts.personalize_app_task_template)
     prompt = re.sub(r"<interest>", interest, prompt)
     prompt = re.sub(r"<last_act>", last_act, prompt)
-    base64_img_before = os.path.join(task_dir, f"{round_count}_before_labeled.png")
-    print_with_color("Thinking about what to do in the next step...", "yellow")
-    status, rsp = mllm.get_model_response(prompt, [base64_img_before])
+    base64_img_before = labeled
+    if pending is not None:
+        task_prompt = prompt
+        prompt = re.sub(r"<reflect_prompt>", pending["prompt"], prompts.merged_explore_template)
+        prompt = re.sub(r"<task_prompt>", task_prompt, prompt)
+        print_with_color("Reflecting on my previous action and thinking about what to do in the next step...",
+                         "yellow")
+        status, rsp = mllm.get_model_response(prompt, [pending["before"], pending["after"], base64_img_before])
+    else:
+        print_with_color("Thinking about what to do in the next step...", "yellow")
+        status, rsp = mllm.get_model_response(prompt, [base64_img_before])
 
     if status:
         with open(explore_log_path, "a") as logfile:
             log_item = {"step": round_count, "prompt": prompt, "image": f"{round_count}_before_labeled.png",
                         "response": rsp}
             logfile.write(json.dumps(log_item) + "\n")
-        res = parse_explore_rsp(rsp)
+        if pending is not None:
+            log_reflection(pending["step"], prompt, rsp)
+            res = parse_merged_rsp(rsp)
+            if res[0] == "ERROR":
+                break
+            reflection, res = res
+            decision = record_reflection(reflection, pending["resource_id"], pending["act_name"])
+            pending = None
+            if decision == "ERROR":
+                break
+            if decision == "BACK":
+                # The next action was chosen on the screen that was just left
+                continue
+        else:
+            res = parse_explore_rsp(rsp)
         act_name = res[0]
         last_act = res[-1]
         res = res[:-1]
@@ -139,8 +220,7 @@ while round_count < configs["MAX_ROUNDS"]:
             break
         if act_name == "tap":
             _, area = res
-            tl, br = elem_list[area - 1].bbox
-            x, y = (tl[0] + br[0]) // 2, (tl[1] + br[1]) // 2
+            x, y = elem_list[area - 1].center
             ret = controller.tap(x, y)
             if ret == "ERROR":
                 print_with_color("ERROR: tap execution failed", "red")
@@ -153,33 +233,35 @@ while round_count < configs["MAX_ROUNDS"]:
                 break
         elif act_name == "long_press":
             _, area = res
-            tl, br = elem_list[area - 1].bbox
-            x, y = (tl[0] + br[0]) // 2, (tl[1] + br[1]) // 2
+            x, y = elem_list[area - 1].center
             ret = controller.long_press(x, y)
             if ret == "ERROR":
                 print_with_color("ERROR: long press execution failed", "red")
                 break
         elif act_name == "swipe":
             _, area, swipe_dir, dist = res
-            tl, br = elem_list[area - 1].bbox
-            x, y = (tl[0] + br[0]) // 2, (tl[1] + br[1]) // 2
+            x, y = elem_list[area - 1].center
             ret = controller.swipe(x, y, swipe_dir, dist)
             if ret == "ERROR":
                 print_with_color("ERROR: swipe execution failed", "red")
                 break
         else:
             break
-        time.sleep(configs["REQUEST_INTERVAL"])
+        controller.wait_for_idle(act_name)
     else:
         print_with_color(rsp, "red")
         break
 
-    screenshot_after = controller.get_screenshot(f"{round_count}_after", task_dir)
-    if screenshot_after == "ERROR":
+    state_after = controller.capture_after(f"{round_count}_after", task_dir,
+                                           with_hierarchy=reuse_after or skip_unchanged)
+    if state_after == "ERROR":
         break
-    draw_bbox_multi(screenshot_after, os.path.join(task_dir, f"{round_count}_after_labeled.png"), elem_list,
-                    dark_mode=configs["DARK_MODE"])
-    base64_img_after = os.path.join(task_dir, f"{round_count}_after_labeled.png")
+    screenshot_after = state_after.frame
+    with controller.perf.timer("render"):
+        base64_img_after = Frame(image=draw_bbox_multi(screenshot_after.image, None, elem_list,
+                                                       dark_mode=configs["DARK_MODE"]))
+    if persist_labeled:
+        base64_img_after.save_async(os.path.join(task_dir, f"{round_count}_after_labeled.png"))
 
     if act_name == "tap":
         prompt = re.sub(r"<action>", "tapping", prompts.personalize_app_reflect_template)
@@ -202,62 +284,56 @@ while round_count < configs["MAX_ROUNDS"]:
     prompt = re.sub(r"<interest>", interest, prompt)
     prompt = re.sub(r"<last_act>", last_act, prompt)
 
+    if skip_unchanged and controller.unchanged_by_action(state, state_after):
+        # The reflection of an action that changed nothing is always INEFFECTIVE
+        print_with_color("The screen did not change after the action, so it was ineffective", "yellow")
+        metrics.skip("reflect")
+        log_reflection(round_count, prompt, None, decision="INEFFECTIVE")
+        record_reflection(["INEFFECTIVE"], elem_list[int(area) - 1].uid, act_name)
+        continue
+    if merged:
+        pending = {"step": round_count, "prompt": prompt, "before": base64_img_before, "after": base64_img_after,
+                   "resource_id": elem_list[int(area) - 1].uid, "act_name": act_name}
+        continue
+
     print_with_color("Reflecting on my previous action...", "yellow")
-    status, rsp = mllm.get_model_response(prompt, [base64_img_before, base64_img_after])
+    status, rsp = mllm.route("reflect").get_model_response(prompt, [base64_img_before, base64_img_after])
     if status:
-        resource_id = elem_list[int(area) - 1].uid
-        with open(reflect_log_path, "a") as logfile:
-            log_item = {"step": round_count, "prompt": prompt, "image_before": f"{round_count}_before_labeled.png",
-                        "image_after": f"{round_count}_after.png", "response": rsp}
-            logfile.write(json.dumps(log_item) + "\n")
-        res = parse_reflect_rsp(rsp)
-        decision = res[0]
+        log_reflection(round_count, prompt, rsp)
+        decision = record_reflection(parse_reflect_rsp(rsp), elem_list[int(area) - 1].uid, act_name)
         if decision == "ERROR":
             break
-        if decision == "INEFFECTIVE":
-            useless_list.add(resource_id)
-            last_act = "None"
-        elif decision == "BACK" or decision == "CONTINUE" or decision == "SUCCESS":
-            if decision == "BACK" or decision == "CONTINUE":
-                useless_list.add(resource_id)
-                last_act = "None"
-                if decision == "BACK":
-                    ret = controller.back()
-                    if ret == "ERROR":
-                        print_with_color("ERROR: back execution failed", "red")
-                        break
-            doc = res[-1]
-            doc_name = resource_id + ".txt"
-            doc_path = os.path.join(docs_dir, doc_name)
-            if os.path.exists(doc_path):
-                doc_content = ast.literal_eval(open(doc_path).read())
-                if doc_content[act_name]:
-                    print_with_color(f"Documentation for the element {resource_id} already exists.", "yellow")
-                    continue
-            else:
-                doc_content = {
-                    "tap": "",
-                    "text": "",
-                    "v_swipe": "",
-                    "h_swipe": "",
-                    "long_press": ""
-                }
-            doc_content[act_name] = doc
-            with open(doc_path, "w") as outfile:
-                outfile.write(str(doc_content))
-            doc_count += 1
-            print_with_color(f"Documentation generated and saved to {doc_path}", "yellow")
-        else:
-            print_with_color(f"ERROR: Undefined decision! {decision}", "red")
-            break
+        if decision == "BACK":
+            state_after = None
     else:
         print_with_color(rsp["error"]["message"], "red")
         break
-    time.sleep(configs["REQUEST_INTERVAL"])
+
+if pending is not None:
+    # The last action of a merged run has not been reflected on yet
+    print_with_color("Reflecting on my previous action...", "yellow")
+    status, rsp = mllm.route("reflect").get_model_response(pending["prompt"], [pending["before"], pending["after"]])
+    if status:
+        log_reflection(pending["step"], pending["prompt"], rsp)
+        record_reflection(parse_reflect_rsp(rsp), pending["resource_id"], pending["act_name"])
+    else:
+        print_with_color(rsp, "red")
 
 if task_complete:
     print_with_color(f"Personalization completed successfully. {doc_count} docs generated.", "yellow")
 elif round_count == configs["MAX_ROUNDS"]:
     print_with_color(f"Personalization finished due to reaching max rounds. {doc_count} docs generated.", "yellow")
 else:
-    print_with_color(f"Personalization finished unexpectedly. {doc_count} docs generated.", "red")
\ No newline at end of file
+    print_with_color(f"Personalization finished unexpectedly. {doc_count} docs generated.", "red")
+
+metrics.write_task(os.path.join(task_dir, "metrics.json"))
+metrics.append_summary(configs.get("METRICS_SUMMARY", ""), script="personalize_app", app=app, task=task_name)
+
+if configs.get("PERF_LOG", False):
+    controller.perf.report()
+    mllm.perf.report()
+    metrics.report()
+    print_with_color(f"Rate limiter: {mllm.rate_limiter.stats()}", "yellow")
+    if mllm.stats():
+        print_with_color(f"Model: {mllm.stats()}", "yellow")
+    print_with_color(f"Perception cache: {perception_cache.stats()}", "yellow")
\ No newline at end of file
@@ -327,4 +327,16 @@ can use pronouns such as "the UI element" to refer to the element. Your output s
 Decision: SUCCESS
 Thought: <explain why you think the action successfully moved the task forward>
 Documentation: <describe the function of the UI element>
+"""
+
+merged_explore_template = """I will give you three screenshots of a mobile app. The first two were taken before and 
+after your last action and are only used in PART 1. The third one shows the screen as it is now and is only used in 
+PART 2. Answer PART 1 first and then PART 2.
+
+PART 1
+<reflect_prompt>
+PART 2
+<task_prompt>
+Write the lines of PART 2 right after the lines of PART 1 and do not repeat the part headings. If your decision in 
+PART 1 is BACK, still answer PART 2 for the third screenshot. The action will be discarded when going back.
 """
\ No newline at end of file
@@ -0,0 +1,143 @@
+import re
+import threading
+import time
+
+# OpenAI reports reset times as Go durations such as "1s", "6m0s" or "120ms"
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+
+rate_limiters = {}
+rate_limiters_lock = threading.Lock()
+
+
+def parse_duration(value):
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_PATTERN.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+
+class TokenBucket:
+    """Holds up to `capacity` units and refills at `capacity` per `period` seconds. A capacity of 0 means unlimited."""
+
+    def __init__(self, capacity, period=60.0):
+        self.capacity = capacity
+        self.period = period
+        self.level = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    @property
+    def rate(self):
+        return self.capacity / self.period
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` units are available, after refilling up to `now`."""
+        if not self.capacity:
+            return 0.0
+        self.refill(now)
+        # A request larger than the whole bucket can never fit, so it only waits for a full bucket
+        amount = min(amount, self.capacity)
+        wait = max(0.0, (amount - self.level) / self.rate)
+        return max(wait, self.blocked_until - now)
+
+    def take(self, amount):
+        if self.capacity:
+            # Underestimated usage is paid back, but never more than one full bucket
+            self.level = max(self.level - amount, -self.capacity)
+
+    def sync(self, limit, remaining, reset, now):
+        """Adopt the limit, the remaining quota and the time until it is replenished as reported by the server."""
+        if limit:
+            self.capacity = limit
+        if not self.capacity or remaining is None:
+            return
+        self.refill(now)
+        # The server's count is authoritative, it also covers other clients sharing the key
+        self.level = min(self.capacity, remaining)
+        if remaining <= 0 and reset:
+            self.blocked_until = max(self.blocked_until, now + reset)
+
+
+class RateLimiter:
+    """Client side view of a provider's request and token quota, shared by every model using the same API key.
+
+    `acquire` blocks only as long as needed for the next request to stay within `requests_per_minute` and
+    `tokens_per_minute` (0 disables either limit). When the provider reports its quota in x-ratelimit-* response
+    headers, `update` replaces the estimates with those numbers.
+    """
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0, period=60.0):
+        self.requests = TokenBucket(requests_per_minute, period)
+        self.tokens = TokenBucket(tokens_per_minute, period)
+        self.lock = threading.Lock()
+        self.waited = 0.0
+        self.waits = 0
+
+    def acquire(self, tokens=0, cancel=None):
+        """Block until a request using an estimated `tokens` tokens may be sent and return the seconds waited, or
+        None if the `cancel` event was set in the meantime."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+                if wait <= 0:
+                    self.requests.take(1)
+                    self.tokens.take(tokens)
+                    if waited:
+                        self.waited += waited
+                        self.waits += 1
+                    return waited
+            if cancel is None:
+                time.sleep(wait)
+            elif cancel.wait(wait):
+                return None
+            waited += wait
+
+    def settle(self, estimated, actual):
+        """Correct the token bucket once the real usage of a request is known."""
+        with self.lock:
+            self.tokens.take(actual - estimated)
+
+    def update(self, headers):
+        now = time.monotonic()
+        with self.lock:
+            for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                try:
+                    bucket.sync(int(limit) if limit else 0, int(remaining) if remaining else None, reset, now)
+                except ValueError:
+                    continue
+
+    def stats(self):
+        return {"waits": self.waits, "waited_s": round(self.waited, 3), "rpm": self.requests.capacity,
+                "tpm": self.tokens.capacity}
+
+
+def get_rate_limiter(key, requests_per_minute=0, tokens_per_minute=0):
+    """Return the rate limiter for an API key, creating it on first use so that every model sharing the key also
+    shares its quota."""
+    with rate_limiters_lock:
+        if key not in rate_limiters:
+            rate_limiters[key] = RateLimiter(requests_per_minute, tokens_per_minute)
+        return rate_limiters[key]
+
+
+def create_rate_limiter(configs, key):
+    requests_per_minute = configs.get("RATE_LIMIT_RPM", 0)
+    if not requests_per_minute and configs.get("REQUEST_INTERVAL"):
+        requests_per_minute = 60 / configs["REQUEST_INTERVAL"]
+    return get_rate_limiter(key, requests_per_minute, configs.get("RATE_LIMIT_TPM", 0))
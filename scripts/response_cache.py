@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_MODES = ("live", "record", "replay")
+
+
+def request_key(model, prompt, images, temperature):
+    """Content hash of a model request: the model, the prompt, the pixels of every image and the temperature."""
+    digest = hashlib.sha256(json.dumps([model, prompt, temperature]).encode("utf-8"))
+    for image in images:
+        digest.update(repr(image.shape).encode("ascii"))
+        digest.update(image.tobytes() if image.flags["C_CONTIGUOUS"] else image.copy().tobytes())
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """Model responses on disk, one JSON file per request key, bounded by their total size.
+
+    The least recently used responses are deleted once the files add up to more than `max_bytes` (0 for no bound).
+    Use is tracked by file modification time, so the order survives between runs.
+    """
+
+    def __init__(self, cache_dir, max_bytes=0):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        found = []
+        for root, _, files in os.walk(cache_dir):
+            for name in files:
+                if name.endswith(".json"):
+                    stat = os.stat(os.path.join(root, name))
+                    found.append((stat.st_mtime, name[:-len(".json")], stat.st_size))
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.size += size
+        with self.lock:
+            self.evict()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            try:
+                with open(self.path(key), "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+                os.utime(self.path(key))
+            except (OSError, ValueError):
+                self.size -= self.entries.pop(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry["response"]
+
+    def put(self, key, response, **meta):
+        data = json.dumps(dict(meta, key=key, response=response, created=time.time()), ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        if self.max_bytes and size > self.max_bytes:
+            return
+        path = self.path(key)
+        with self.lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self.size += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+            self.evict()
+
+    def evict(self):
+        while self.max_bytes and self.size > self.max_bytes:
+            evicted, evicted_size = self.entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+            try:
+                os.remove(self.path(evicted))
+            except OSError:
+                pass
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self.entries),
+                "bytes": self.size}
+
+
+class Cassette:
+    """The responses of a run in the order they were requested, one JSON line each, so that the run can be replayed.
+
+    A replayed request gets the recorded response with the same key. When the screens of the replay differ from the
+    recording, e.g. by the clock in the status bar, no key matches and the next unused response is taken instead.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.records = []
+        self.used = set()
+        self.position = 0
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.records = [json.loads(line) for line in f if line.strip()]
+
+    def append(self, key, response):
+        with self.lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "response": response}, ensure_ascii=False) + "\n")
+            self.records.append({"key": key, "response": response})
+
+    def next(self, key):
+        """Return the recorded response for `key`, or the next unused one, or None when the cassette is used up."""
+        with self.lock:
+            index = next((i for i in range(self.position, len(self.records))
+                          if i not in self.used and self.records[i]["key"] == key), None)
+            if index is None:
+                while self.position < len(self.records) and self.position in self.used:
+                    self.position += 1
+                if self.position == len(self.records):
+                    return None
+                index = self.position
+            self.used.add(index)
+            return self.records[index]["response"]
+
+    def stats(self):
+        return {"records": len(self.records), "replayed": len(self.used)}
@@ -7,7 +7,7 @@ import shutil
 import sys
 import time
 
-from and_controller import list_all_devices, AndroidController, traverse_tree
+from and_controller import list_all_devices, AndroidController, extract_elements
 from config import load_config
 from utils import print_with_color, draw_bbox_multi
 
@@ -85,29 +85,13 @@ print_with_color("All interactive elements on the screen are labeled with red an
 step = 0
 while True:
     step += 1
-    screenshot_path = controller.get_screenshot(f"{demo_name}_{step}", raw_ss_dir)
-    xml_path = controller.get_xml(f"{demo_name}_{step}", xml_dir)
-    if screenshot_path == "ERROR" or xml_path == "ERROR":
+    state = controller.capture_state(f"{demo_name}_{step}", f"{demo_name}_{step}", raw_ss_dir, xml_dir)
+    if state == "ERROR":
         break
-    clickable_list = []
-    focusable_list = []
-    traverse_tree(xml_path, clickable_list, "clickable", True)
-    traverse_tree(xml_path, focusable_list, "focusable", True)
-    elem_list = clickable_list.copy()
-    for elem in focusable_list:
-        bbox = elem.bbox
-        center = (bbox[0][0] + bbox[1][0]) // 2, (bbox[0][1] + bbox[1][1]) // 2
-        close = False
-        for e in clickable_list:
-            bbox = e.bbox
-            center_ = (bbox[0][0] + bbox[1][0]) // 2, (bbox[0][1] + bbox[1][1]) // 2
-            dist = (abs(center[0] - center_[0]) ** 2 + abs(center[1] - center_[1]) ** 2) ** 0.5
-            if dist <= configs["MIN_DIST"]:
-                close = True
-                break
-        if not close:
-            elem_list.append(elem)
-    labeled_img = draw_bbox_multi(screenshot_path, os.path.join(labeled_ss_dir, f"{demo_name}_{step}.png"), elem_list,
+    screenshot, xml = state.frame, state.xml
+    with controller.perf.timer("xml_parse"):
+        elem_list = extract_elements(xml)
+    labeled_img = draw_bbox_multi(screenshot.image, os.path.join(labeled_ss_dir, f"{demo_name}_{step}.png"), elem_list,
                                   True)
     cv2.imshow("image", labeled_img)
     cv2.waitKey(0)
@@ -118,13 +102,13 @@ while True:
     while user_input.lower() != "tap" and user_input.lower() != "text" and user_input.lower() != "long press" \
             and user_input.lower() != "swipe" and user_input.lower() != "stop":
         user_input = input()
+    action = user_input.lower().replace(" ", "_")
     if user_input.lower() == "tap":
         print_with_color(f"Which element do you want to tap? Choose a numeric tag from 1 to {len(elem_list)}:", "blue")
         user_input = "xxx"
         while not user_input.isnumeric() or int(user_input) > len(elem_list) or int(user_input) < 1:
             user_input = input()
-        tl, br = elem_list[int(user_input) - 1].bbox
-        x, y = (tl[0] + br[0]) // 2, (tl[1] + br[1]) // 2
+        x, y = elem_list[int(user_input) - 1].center
         ret = controller.tap(x, y)
         if ret == "ERROR":
             print_with_color("ERROR: tap execution failed", "red")
@@ -148,8 +132,7 @@ while True:
         user_input = "xxx"
         while not user_input.isnumeric() or int(user_input) > len(elem_list) or int(user_input) < 1:
             user_input = input()
-        tl, br = elem_list[int(user_input) - 1].bbox
-        x, y = (tl[0] + br[0]) // 2, (tl[1] + br[1]) // 2
+        x, y = elem_list[int(user_input) - 1].center
         ret = controller.long_press(x, y)
         if ret == "ERROR":
             print_with_color("ERROR: long press execution failed", "red")
@@ -165,8 +148,7 @@ while True:
         print_with_color(f"Which element do you want to swipe? Choose a numeric tag from 1 to {len(elem_list)}:")
         while not user_input.isnumeric() or int(user_input) > len(elem_list) or int(user_input) < 1:
             user_input = input()
-        tl, br = elem_list[int(user_input) - 1].bbox
-        x, y = (tl[0] + br[0]) // 2, (tl[1] + br[1]) // 2
+        x, y = elem_list[int(user_input) - 1].center
         ret = controller.swipe(x, y, swipe_dir)
         if ret == "ERROR":
             print_with_color("ERROR: swipe execution failed", "red")
@@ -178,6 +160,9 @@ while True:
         break
     else:
         break
-    time.sleep(3)
+    controller.wait_for_idle(action)
 
 print_with_color(f"Demonstration phase completed. {step} steps were recorded.", "yellow")
+
+if configs.get("PERF_LOG", False):
+    controller.perf.report()
@@ -9,9 +9,12 @@ import time
 
 import prompts
 from config import load_config
-from and_controller import list_all_devices, AndroidController, traverse_tree
-from model import parse_explore_rsp, parse_grid_rsp, OpenAIModel, QwenModel
-from utils import print_with_color, draw_bbox_multi, draw_grid
+from and_controller import list_all_devices, AndroidController, extract_elements
+from frame import Frame
+from grid_overlay import get_grid_overlay
+from model import parse_explore_rsp, parse_grid_rsp, parse_summary, create_model, metrics
+from perception_cache import PerceptionCache
+from utils import print_with_color, draw_bbox_multi
 
 arg_desc = "AppAgent Executor"
 parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=arg_desc)
@@ -21,17 +24,8 @@ args = vars(parser.parse_args())
 
 configs = load_config()
 
-if configs["MODEL"] == "OpenAI":
-    mllm = OpenAIModel(base_url=configs["OPENAI_API_BASE"],
-                       api_key=configs["OPENAI_API_KEY"],
-                       model=configs["OPENAI_API_MODEL"],
-                       temperature=configs["TEMPERATURE"],
-                       max_tokens=configs["MAX_TOKENS"])
-elif configs["MODEL"] == "Qwen":
-    mllm = QwenModel(api_key=configs["DASHSCOPE_API_KEY"],
-                     model=configs["QWEN_MODEL"])
-else:
-    print_with_color(f"ERROR: Unsupported model type {configs['MODEL']}!", "red")
+mllm = create_model(configs)
+if mllm is None:
     sys.exit()
 
 app = args["app"]
@@ -117,174 +111,176 @@ round_count = 0
 last_act = "None"
 task_complete = False
 grid_on = False
-rows, cols = 0, 0
+grid_cache_dir = configs.get("GRID_CACHE_DIR", "")
+perception_cache = PerceptionCache(configs.get("PERCEPTION_CACHE_MB", 64) * 1024 * 1024)
+persist_labeled = configs.get("PERSIST_LABELED_SCREENSHOTS", True)
+stream_responses = configs.get("STREAM_RESPONSES", False)
 
 
 def area_to_xy(area, subarea):
-    area -= 1
-    row, col = area // cols, area % cols
-    x_0, y_0 = col * (width // cols), row * (height // rows)
-    if subarea == "top-left":
-        x, y = x_0 + (width // cols) // 4, y_0 + (height // rows) // 4
-    elif subarea == "top":
-        x, y = x_0 + (width // cols) // 2, y_0 + (height // rows) // 4
-    elif subarea == "top-right":
-        x, y = x_0 + (width // cols) * 3 // 4, y_0 + (height // rows) // 4
-    elif subarea == "left":
-        x, y = x_0 + (width // cols) // 4, y_0 + (height // rows) // 2
-    elif subarea == "right":
-        x, y = x_0 + (width // cols) * 3 // 4, y_0 + (height // rows) // 2
-    elif subarea == "bottom-left":
-        x, y = x_0 + (width // cols) // 4, y_0 + (height // rows) * 3 // 4
-    elif subarea == "bottom":
-        x, y = x_0 + (width // cols) // 2, y_0 + (height // rows) * 3 // 4
-    elif subarea == "bottom-right":
-        x, y = x_0 + (width // cols) * 3 // 4, y_0 + (height // rows) * 3 // 4
-    else:
-        x, y = x_0 + (width // cols) // 2, y_0 + (height // rows) // 2
-    return x, y
+    return get_grid_overlay(width, height, grid_cache_dir).area_to_xy(area, subarea)
+
+
+def get_ui_doc(elem_list):
+    ui_doc = ""
+    for i, elem in enumerate(elem_list):
+        doc_path = os.path.join(docs_dir, f"{elem.uid}.txt")
+        if not os.path.exists(doc_path):
+            continue
+        ui_doc += f"Documentation of UI element labeled with the numeric tag '{i + 1}':\n"
+        doc_content = ast.literal_eval(open(doc_path, "r").read())
+        if doc_content["tap"]:
+            ui_doc += f"This UI element is clickable. {doc_content['tap']}\n\n"
+        if doc_content["text"]:
+            ui_doc += f"This UI element can receive text input. The text input is used for the following " \
+                      f"purposes: {doc_content['text']}\n\n"
+        if doc_content["long_press"]:
+            ui_doc += f"This UI element is long clickable. {doc_content['long_press']}\n\n"
+        if doc_content["v_swipe"]:
+            ui_doc += f"This element can be swiped directly without tapping. You can swipe vertically on " \
+                      f"this UI element. {doc_content['v_swipe']}\n\n"
+        if doc_content["h_swipe"]:
+            ui_doc += f"This element can be swiped directly without tapping. You can swipe horizontally on " \
+                      f"this UI element. {doc_content['h_swipe']}\n\n"
+    print_with_color(f"Documentations retrieved for the current interface:\n{ui_doc}", "magenta")
+    ui_doc = """
+            You also have access to the following documentations that describes the functionalities of UI 
+            elements you can interact on the screen. These docs are crucial for you to determine the target of your 
+            next action. You should always prioritize these documented elements for interaction:""" + ui_doc
+    return ui_doc
+
+
+def perform_action(act_name, res, elem_list):
+    """Carry out a parsed action, without its summary, on the device and return "ERROR" if it failed."""
+    ret = None
+    if act_name == "tap":
+        _, area = res
+        x, y = elem_list[area - 1].center
+        ret = controller.tap(x, y)
+        if ret == "ERROR":
+            print_with_color("ERROR: tap execution failed", "red")
+    elif act_name == "text":
+        _, input_str = res
+        ret = controller.text(input_str)
+        if ret == "ERROR":
+            print_with_color("ERROR: text execution failed", "red")
+    elif act_name == "long_press":
+        _, area = res
+        x, y = elem_list[area - 1].center
+        ret = controller.long_press(x, y)
+        if ret == "ERROR":
+            print_with_color("ERROR: long press execution failed", "red")
+    elif act_name == "swipe":
+        _, area, swipe_dir, dist = res
+        x, y = elem_list[area - 1].center
+        ret = controller.swipe(x, y, swipe_dir, dist)
+        if ret == "ERROR":
+            print_with_color("ERROR: swipe execution failed", "red")
+    elif act_name == "tap_grid" or act_name == "long_press_grid":
+        _, area, subarea = res
+        x, y = area_to_xy(area, subarea)
+        if act_name == "tap_grid":
+            ret = controller.tap(x, y)
+            if ret == "ERROR":
+                print_with_color("ERROR: tap execution failed", "red")
+        else:
+            ret = controller.long_press(x, y)
+            if ret == "ERROR":
+                print_with_color("ERROR: tap execution failed", "red")
+    elif act_name == "swipe_grid":
+        _, start_area, start_subarea, end_area, end_subarea = res
+        start_x, start_y = area_to_xy(start_area, start_subarea)
+        end_x, end_y = area_to_xy(end_area, end_subarea)
+        ret = controller.swipe_precise((start_x, start_y), (end_x, end_y))
+        if ret == "ERROR":
+            print_with_color("ERROR: tap execution failed", "red")
+    return ret
 
 
 while round_count < configs["MAX_ROUNDS"]:
     round_count += 1
     print_with_color(f"Round {round_count}", "yellow")
-    screenshot_path = controller.get_screenshot(f"{dir_name}_{round_count}", task_dir)
-    xml_path = controller.get_xml(f"{dir_name}_{round_count}", task_dir)
-    if screenshot_path == "ERROR" or xml_path == "ERROR":
+    state = controller.capture_state(f"{dir_name}_{round_count}", f"{dir_name}_{round_count}", task_dir)
+    if state == "ERROR":
         break
+    screenshot, xml = state.frame, state.xml
     if grid_on:
-        rows, cols = draw_grid(screenshot_path, os.path.join(task_dir, f"{dir_name}_{round_count}_grid.png"))
-        image = os.path.join(task_dir, f"{dir_name}_{round_count}_grid.png")
+        with controller.perf.timer("render"):
+            grid = get_grid_overlay(screenshot.shape[1], screenshot.shape[0], grid_cache_dir)
+            image = Frame(image=grid.apply(screenshot.image.copy()))
+        if persist_labeled:
+            image.save_async(os.path.join(task_dir, f"{dir_name}_{round_count}_grid.png"))
         prompt = prompts.task_template_grid
     else:
-        clickable_list = []
-        focusable_list = []
-        traverse_tree(xml_path, clickable_list, "clickable", True)
-        traverse_tree(xml_path, focusable_list, "focusable", True)
-        elem_list = clickable_list.copy()
-        for elem in focusable_list:
-            bbox = elem.bbox
-            center = (bbox[0][0] + bbox[1][0]) // 2, (bbox[0][1] + bbox[1][1]) // 2
-            close = False
-            for e in clickable_list:
-                bbox = e.bbox
-                center_ = (bbox[0][0] + bbox[1][0]) // 2, (bbox[0][1] + bbox[1][1]) // 2
-                dist = (abs(center[0] - center_[0]) ** 2 + abs(center[1] - center_[1]) ** 2) ** 0.5
-                if dist <= configs["MIN_DIST"]:
-                    close = True
-                    break
-            if not close:
-                elem_list.append(elem)
-        draw_bbox_multi(screenshot_path, os.path.join(task_dir, f"{dir_name}_{round_count}_labeled.png"), elem_list,
-                        dark_mode=configs["DARK_MODE"])
-        image = os.path.join(task_dir, f"{dir_name}_{round_count}_labeled.png")
-        if no_doc:
-            prompt = re.sub(r"<ui_document>", "", prompts.task_template)
+        cache_key = perception_cache.key(xml, screenshot, configs["DARK_MODE"])
+        cached = perception_cache.get(cache_key)
+        if cached:
+            print_with_color("The screen is unchanged since it was last labeled, reusing the labeled screenshot",
+                             "yellow")
+            elem_list, image, ui_doc = cached.elem_list, cached.labeled, cached.ui_doc
         else:
-            ui_doc = ""
-            for i, elem in enumerate(elem_list):
-                doc_path = os.path.join(docs_dir, f"{elem.uid}.txt")
-                if not os.path.exists(doc_path):
-                    continue
-                ui_doc += f"Documentation of UI element labeled with the numeric tag '{i + 1}':\n"
-                doc_content = ast.literal_eval(open(doc_path, "r").read())
-                if doc_content["tap"]:
-                    ui_doc += f"This UI element is clickable. {doc_content['tap']}\n\n"
-                if doc_content["text"]:
-                    ui_doc += f"This UI element can receive text input. The text input is used for the following " \
-                              f"purposes: {doc_content['text']}\n\n"
-                if doc_content["long_press"]:
-                    ui_doc += f"This UI element is long clickable. {doc_content['long_press']}\n\n"
-                if doc_content["v_swipe"]:
-                    ui_doc += f"This element can be swiped directly without tapping. You can swipe vertically on " \
-                              f"this UI element. {doc_content['v_swipe']}\n\n"
-                if doc_content["h_swipe"]:
-                    ui_doc += f"This element can be swiped directly without tapping. You can swipe horizontally on " \
-                              f"this UI element. {doc_content['h_swipe']}\n\n"
-            print_with_color(f"Documentations retrieved for the current interface:\n{ui_doc}", "magenta")
-            ui_doc = """
-            You also have access to the following documentations that describes the functionalities of UI 
-            elements you can interact on the screen. These docs are crucial for you to determine the target of your 
-            next action. You should always prioritize these documented elements for interaction:""" + ui_doc
-            prompt = re.sub(r"<ui_document>", ui_doc, prompts.task_template)
+            with controller.perf.timer("xml_parse"):
+                elem_list = extract_elements(xml)
+            with controller.perf.timer("render"):
+                image = Frame(image=draw_bbox_multi(screenshot.image, None, elem_list,
+                                                    dark_mode=configs["DARK_MODE"]))
+            ui_doc = "" if no_doc else get_ui_doc(elem_list)
+            perception_cache.put(cache_key, elem_list, image, ui_doc)
+        if persist_labeled:
+            image.save_async(os.path.join(task_dir, f"{dir_name}_{round_count}_labeled.png"))
+        prompt = re.sub(r"<ui_document>", ui_doc, prompts.task_template)
     prompt = re.sub(r"<task_description>", task_desc, prompt)
     prompt = re.sub(r"<last_act>", last_act, prompt)
     print_with_color("Thinking about what to do in the next step...", "yellow")
-    status, rsp = mllm.get_model_response(prompt, [image])
+    if stream_responses:
+        stream = mllm.stream_model_response(prompt, [image])
+        # Observation and Thought make up most of the response, the action can start as soon as its line is in
+        status, rsp = stream.wait_for_line("Action:")
+    else:
+        stream = None
+        status, rsp = mllm.get_model_response(prompt, [image])
 
     if status:
+        if grid_on:
+            res = parse_grid_rsp(rsp, partial=stream is not None)
+        else:
+            res = parse_explore_rsp(rsp, partial=stream is not None)
+        act_name = res[0]
+        ret = None
+        if act_name not in ("FINISH", "ERROR", "grid"):
+            ret = perform_action(act_name, res[:-1], elem_list)
+        if stream is not None:
+            # The rest of the response, mostly the Summary, arrives while the device carries out the action
+            stream_status, full_rsp = stream.result()
+            if stream_status:
+                rsp = full_rsp
+                summary = parse_summary(rsp)
+                metrics.mark_parsed(rsp, act_name != "ERROR" and summary is not None)
+                if summary is not None and len(res) > 1 and summary != res[-1]:
+                    print_with_color("Summary:", "yellow")
+                    print_with_color(summary, "magenta")
+                    res[-1] = summary
+            else:
+                print_with_color(f"The rest of the model response was lost ({full_rsp}), continuing without its "
+                                 f"summary", "yellow")
+            print_with_color(f"Action dispatched after {mllm.perf.last('model_until_action'):.2f}s, response "
+                             f"completed after {mllm.perf.last('model_request'):.2f}s", "yellow")
         with open(log_path, "a") as logfile:
             log_item = {"step": round_count, "prompt": prompt, "image": f"{dir_name}_{round_count}_labeled.png",
                         "response": rsp}
             logfile.write(json.dumps(log_item) + "\n")
-        if grid_on:
-            res = parse_grid_rsp(rsp)
-        else:
-            res = parse_explore_rsp(rsp)
-        act_name = res[0]
         if act_name == "FINISH":
             task_complete = True
             break
-        if act_name == "ERROR":
+        if act_name == "ERROR" or ret == "ERROR":
             break
         last_act = res[-1]
-        res = res[:-1]
-        if act_name == "tap":
-            _, area = res
-            tl, br = elem_list[area - 1].bbox
-            x, y = (tl[0] + br[0]) // 2, (tl[1] + br[1]) // 2
-            ret = controller.tap(x, y)
-            if ret == "ERROR":
-                print_with_color("ERROR: tap execution failed", "red")
-                break
-        elif act_name == "text":
-            _, input_str = res
-            ret = controller.text(input_str)
-            if ret == "ERROR":
-                print_with_color("ERROR: text execution failed", "red")
-                break
-        elif act_name == "long_press":
-            _, area = res
-            tl, br = elem_list[area - 1].bbox
-            x, y = (tl[0] + br[0]) // 2, (tl[1] + br[1]) // 2
-            ret = controller.long_press(x, y)
-            if ret == "ERROR":
-                print_with_color("ERROR: long press execution failed", "red")
-                break
-        elif act_name == "swipe":
-            _, area, swipe_dir, dist = res
-            tl, br = elem_list[area - 1].bbox
-            x, y = (tl[0] + br[0]) // 2, (tl[1] + br[1]) // 2
-            ret = controller.swipe(x, y, swipe_dir, dist)
-            if ret == "ERROR":
-                print_with_color("ERROR: swipe execution failed", "red")
-                break
-        elif act_name == "grid":
+        if act_name == "grid":
             grid_on = True
-        elif act_name == "tap_grid" or act_name == "long_press_grid":
-            _, area, subarea = res
-            x, y = area_to_xy(area, subarea)
-            if act_name == "tap_grid":
-                ret = controller.tap(x, y)
-                if ret == "ERROR":
-                    print_with_color("ERROR: tap execution failed", "red")
-                    break
-            else:
-                ret = controller.long_press(x, y)
-                if ret == "ERROR":
-                    print_with_color("ERROR: tap execution failed", "red")
-                    break
-        elif act_name == "swipe_grid":
-            _, start_area, start_subarea, end_area, end_subarea = res
-            start_x, start_y = area_to_xy(start_area, start_subarea)
-            end_x, end_y = area_to_xy(end_area, end_subarea)
-            ret = controller.swipe_precise((start_x, start_y), (end_x, end_y))
-            if ret == "ERROR":
-                print_with_color("ERROR: tap execution failed", "red")
-                break
-        if act_name != "grid":
+        else:
             grid_on = False
-        time.sleep(configs["REQUEST_INTERVAL"])
+        if act_name != "grid":
+            controller.wait_for_idle(act_name)
     else:
         print_with_color(rsp, "red")
         break
@@ -310,31 +306,32 @@ if task_complete:
             print_with_color(f"Privacy protection round {privacy_round} (clicked {privacy_clicks_count}/{privacy_clicks_target} items)", "cyan")
             
             # 获取当前截图
-            screenshot_path = controller.get_screenshot(f"{dir_name}_privacy_{privacy_round}", task_dir)
-            xml_path = controller.get_xml(f"{dir_name}_privacy_{privacy_round}", task_dir)
+            state = controller.capture_state(f"{dir_name}_privacy_{privacy_round}",
+                                             f"{dir_name}_privacy_{privacy_round}", task_dir)
             
-            if screenshot_path == "ERROR" or xml_path == "ERROR":
+            if state == "ERROR":
                 print_with_color("Failed to get screenshot for privacy protection", "red")
                 break
+            screenshot, xml = state.frame, state.xml
             
             # 处理UI元素
-            clickable_list = []
-            traverse_tree(xml_path, clickable_list, "clickable", True)
+            with controller.perf.timer("xml_parse"):
+                clickable_list = extract_elements(xml, ("clickable",))
             
             if not clickable_list:
                 print_with_color("No clickable elements found for privacy protection", "yellow")
                 break
                 
-            draw_bbox_multi(screenshot_path, os.path.join(task_dir, f"{dir_name}_privacy_{privacy_round}_labeled.png"), 
-                           clickable_list, dark_mode=configs["DARK_MODE"])
-            image = os.path.join(task_dir, f"{dir_name}_privacy_{privacy_round}_labeled.png")
+            image = Frame(image=draw_bbox_multi(screenshot.image, None, clickable_list, dark_mode=configs["DARK_MODE"]))
+            if persist_labeled:
+                image.save_async(os.path.join(task_dir, f"{dir_name}_privacy_{privacy_round}_labeled.png"))
             
             # 使用隐私保护提示词
             privacy_prompt = prompts.privacy_protection_template
             privacy_prompt = re.sub(r"<task_description>", task_desc, privacy_prompt)
             
             print_with_color("Analyzing screen for unrelated content to click...", "cyan")
-            status, rsp = mllm.get_model_response(privacy_prompt, [image])
+            status, rsp = mllm.route("privacy").get_model_response(privacy_prompt, [image])
             
             if status:
                 res = parse_explore_rsp(rsp)
@@ -346,13 +343,12 @@ if task_complete:
                 elif act_name == "tap":
                     _, area = res
                     if area <= len(clickable_list):
-                        tl, br = clickable_list[area - 1].bbox
-                        x, y = (tl[0] + br[0]) // 2, (tl[1] + br[1]) // 2
+                        x, y = clickable_list[area - 1].center
                         ret = controller.tap(x, y)
                         if ret != "ERROR":
                             privacy_clicks_count += 1
                             print_with_color(f"Privacy click {privacy_clicks_count}: tapped unrelated content", "cyan")
-                            time.sleep(2)  # 短暂等待
+                            controller.wait_for_idle("privacy_tap")  # 等待界面稳定
                         else:
                             print_with_color("Privacy tap failed", "red")
                     else:
@@ -362,8 +358,6 @@ if task_complete:
             else:
                 print_with_color(f"Privacy protection AI response failed: {rsp}", "red")
                 break
-            
-            time.sleep(configs["REQUEST_INTERVAL"])
         
         if privacy_clicks_count > 0:
             print_with_color(f"Privacy protection completed: clicked {privacy_clicks_count} unrelated items", "green")
@@ -374,3 +368,15 @@ elif round_count == configs["MAX_ROUNDS"]:
     print_with_color("Task finished due to reaching max rounds", "yellow")
 else:
     print_with_color("Task finished unexpectedly", "red")
+
+metrics.write_task(os.path.join(task_dir, "metrics.json"))
+metrics.append_summary(configs.get("METRICS_SUMMARY", ""), script="task_executor", app=app, task=dir_name)
+
+if configs.get("PERF_LOG", False):
+    controller.perf.report()
+    mllm.perf.report()
+    metrics.report()
+    print_with_color(f"Rate limiter: {mllm.rate_limiter.stats()}", "yellow")
+    if mllm.stats():
+        print_with_color(f"Model: {mllm.stats()}", "yellow")
+    print_with_color(f"Perception cache: {perception_cache.stats()}", "yellow")
@@ -1,9 +1,15 @@
 import base64
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
 import cv2
-import pyshine as ps
+import numpy as np
 
 from colorama import Fore, Style
 
+from grid_overlay import get_grid_overlay
+
 
 def print_with_color(text: str, color=""):
     if color == "red":
@@ -27,72 +33,115 @@ def print_with_color(text: str, color=""):
     print(Style.RESET_ALL)
 
 
-def draw_bbox_multi(img_path, output_path, elem_list, record_mode=False, dark_mode=False):
-    imgcv = cv2.imread(img_path)
-    count = 1
-    for elem in elem_list:
+class PerfStats:
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def record(self, name, seconds):
+        self.samples[name].append(seconds)
+
+    def last(self, name):
+        return self.samples[name][-1] if self.samples[name] else 0.0
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
         try:
-            top_left = elem.bbox[0]
-            bottom_right = elem.bbox[1]
-            left, top = top_left[0], top_left[1]
-            right, bottom = bottom_right[0], bottom_right[1]
-            label = str(count)
-            if record_mode:
-                if elem.attrib == "clickable":
-                    color = (250, 0, 0)
-                elif elem.attrib == "focusable":
-                    color = (0, 0, 250)
-                else:
-                    color = (0, 250, 0)
-                imgcv = ps.putBText(imgcv, label, text_offset_x=(left + right) // 2 + 10, text_offset_y=(top + bottom) // 2 + 10,
-                                    vspace=10, hspace=10, font_scale=1, thickness=2, background_RGB=color,
-                                    text_RGB=(255, 250, 250), alpha=0.5)
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def summary(self):
+        summary = {}
+        for name, samples in self.samples.items():
+            if not samples:
+                continue
+            ordered = sorted(samples)
+            summary[name] = {
+                "count": len(samples),
+                "mean_ms": sum(samples) / len(samples) * 1000,
+                "p50_ms": ordered[len(ordered) // 2] * 1000,
+                "max_ms": ordered[-1] * 1000
+            }
+        return summary
+
+    def report(self, color="yellow"):
+        for name, stats in self.summary().items():
+            print_with_color(f"{name}: n={stats['count']} mean={stats['mean_ms']:.1f}ms "
+                             f"p50={stats['p50_ms']:.1f}ms max={stats['max_ms']:.1f}ms", color)
+
+
+def load_image(image):
+    if isinstance(image, np.ndarray):
+        return image.copy()
+    return cv2.imread(image)
+
+
+def draw_labels(image, labels, vspace=10, hspace=10, font=cv2.FONT_HERSHEY_DUPLEX, font_scale=1, thickness=2,
+                alpha=0.5):
+    """Draw text labels on translucent boxes onto `image` in place.
+
+    `labels` holds (text, x, y, background_RGB, text_RGB) tuples laid out like pyshine.putBText: (x, y) is the top-left
+    corner of the text and the box extends `hspace`/`vspace` pixels around it. All boxes are laid out first and blended
+    straight into the image against one solid tile per background colour, then every text is drawn on top, so no
+    per-label buffers are allocated. Boxes are blended one by one rather than through a single overlay, because a
+    single blend has to cover the rectangle spanning all boxes, which is most of the screen.
+    """
+    height, width = image.shape[:2]
+    boxes = []
+    texts = []
+    for text, x, y, background_rgb, text_rgb in labels:
+        text_width, text_height = cv2.getTextSize(text, font, fontScale=font_scale, thickness=thickness)[0]
+        top, bottom = max(y - vspace, 0), min(y + text_height + vspace, height)
+        left, right = max(x - hspace, 0), min(x + text_width + hspace, width)
+        if top < bottom and left < right:
+            boxes.append((top, bottom, left, right, tuple(background_rgb[::-1])))
+        texts.append((text, (x, y + text_height), text_rgb[::-1]))
+    if boxes:
+        tile_height = max(bottom - top for top, bottom, _, _, _ in boxes)
+        tile_width = max(right - left for _, _, left, right, _ in boxes)
+        tiles = {}
+        for top, bottom, left, right, color in boxes:
+            if color not in tiles:
+                tiles[color] = np.full((tile_height, tile_width, image.shape[2]), color, dtype=image.dtype)
+            roi = image[top:bottom, left:right]
+            roi[:] = cv2.addWeighted(roi, alpha, tiles[color][:bottom - top, :right - left], 1 - alpha, 0)
+    for text, origin, color in texts:
+        cv2.putText(image, text, origin, font, fontScale=font_scale, color=color, thickness=thickness)
+    return image
+
+
+def draw_bbox_multi(img_path, output_path, elem_list, record_mode=False, dark_mode=False):
+    imgcv = load_image(img_path)
+    labels = []
+    for count, elem in enumerate(elem_list, start=1):
+        (left, top), (right, bottom) = elem.bbox
+        if record_mode:
+            if elem.attrib == "clickable":
+                color = (250, 0, 0)
+            elif elem.attrib == "focusable":
+                color = (0, 0, 250)
             else:
-                text_color = (10, 10, 10) if dark_mode else (255, 250, 250)
-                bg_color = (255, 250, 250) if dark_mode else (10, 10, 10)
-                imgcv = ps.putBText(imgcv, label, text_offset_x=(left + right) // 2 + 10, text_offset_y=(top + bottom) // 2 + 10,
-                                    vspace=10, hspace=10, font_scale=1, thickness=2, background_RGB=bg_color,
-                                    text_RGB=text_color, alpha=0.5)
-        except Exception as e:
-            print_with_color(f"ERROR: An exception occurs while labeling the image\n{e}", "red")
-        count += 1
-    cv2.imwrite(output_path, imgcv)
+                color = (0, 250, 0)
+            labels.append((str(count), (left + right) // 2 + 10, (top + bottom) // 2 + 10, color, (255, 250, 250)))
+        else:
+            text_color = (10, 10, 10) if dark_mode else (255, 250, 250)
+            bg_color = (255, 250, 250) if dark_mode else (10, 10, 10)
+            labels.append((str(count), (left + right) // 2 + 10, (top + bottom) // 2 + 10, bg_color, text_color))
+    draw_labels(imgcv, labels)
+    if output_path:
+        cv2.imwrite(output_path, imgcv)
     return imgcv
 
 
-def draw_grid(img_path, output_path):
-    def get_unit_len(n):
-        for i in range(1, n + 1):
-            if n % i == 0 and 120 <= i <= 180:
-                return i
-        return -1
-
-    image = cv2.imread(img_path)
+def draw_grid(img_path, output_path, cache_dir=None):
+    image = load_image(img_path)
     height, width, _ = image.shape
-    color = (255, 116, 113)
-    unit_height = get_unit_len(height)
-    if unit_height < 0:
-        unit_height = 120
-    unit_width = get_unit_len(width)
-    if unit_width < 0:
-        unit_width = 120
-    thick = int(unit_width // 50)
-    rows = height // unit_height
-    cols = width // unit_width
-    for i in range(rows):
-        for j in range(cols):
-            label = i * cols + j + 1
-            left = int(j * unit_width)
-            top = int(i * unit_height)
-            right = int((j + 1) * unit_width)
-            bottom = int((i + 1) * unit_height)
-            cv2.rectangle(image, (left, top), (right, bottom), color, thick // 2)
-            cv2.putText(image, str(label), (left + int(unit_width * 0.05) + 3, top + int(unit_height * 0.3) + 3), 0,
-                        int(0.01 * unit_width), (0, 0, 0), thick)
-            cv2.putText(image, str(label), (left + int(unit_width * 0.05), top + int(unit_height * 0.3)), 0,
-                        int(0.01 * unit_width), color, thick)
-    cv2.imwrite(output_path, image)
-    return rows, cols
+    grid = get_grid_overlay(width, height, cache_dir)
+    grid.apply(image)
+    if output_path:
+        cv2.imwrite(output_path, image)
+    return grid.rows, grid.cols
 
 
 def encode_image(image_path):
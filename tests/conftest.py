@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(ROOT, "scripts"))
+sys.path.append(os.path.join(ROOT, "benchmarks"))
+# The scripts read ./config.yaml when they are imported
+os.chdir(ROOT)
+
+
+@pytest.fixture(autouse=True)
+def quiet(monkeypatch):
+    """Silence the progress and retry messages the model clients print, for the duration of each test."""
+    import model
+    monkeypatch.setattr(model, "print_with_color", lambda *_args, **_kwargs: None)
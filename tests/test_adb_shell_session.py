@@ -0,0 +1,85 @@
+import subprocess
+
+import pytest
+
+from and_controller import AdbShellSession
+
+
+@pytest.fixture
+def session(monkeypatch):
+    """An AdbShellSession whose `adb shell` is a local sh, with `adb wait-for-device` a no-op."""
+    popen = subprocess.Popen
+    started = []
+
+    def local_shell(args, **kwargs):
+        assert args[0] == "adb" and args[-1] == "shell"
+        process = popen(["sh"], **kwargs)
+        started.append(process)
+        return process
+
+    monkeypatch.setattr(subprocess, "Popen", local_shell)
+    monkeypatch.setattr(subprocess, "run", lambda *_args, **_kwargs: None)
+    shell = AdbShellSession("emulator-5554", timeout=2)
+    shell.started = started
+    yield shell
+    shell.close()
+
+
+def test_runs_commands_on_one_shell(session):
+    assert session.run("echo hello") == "hello"
+    assert session.run("echo one; echo two") == "one\ntwo"
+    assert len(session.started) == 1
+
+
+def test_output_without_a_trailing_newline(session):
+    assert session.run("printf abc") == "abc"
+    assert session.run("printf ''") == ""
+
+
+def test_non_zero_exit_is_an_error(session):
+    assert session.run("echo oops; false") == "ERROR"
+    assert session.run("sh -c 'exit 3'") == "ERROR"
+    # The shell survives a failing command
+    assert session.run("echo still here") == "still here"
+    assert len(session.started) == 1
+
+
+def test_timed_out_command_is_not_replayed(session, tmp_path):
+    log = tmp_path / "ran"
+    session.timeout = 0.3
+    assert session.run(f"echo ran >> {log}; sleep 5") == "ERROR"
+    assert session.process is None
+    session.timeout = 2
+    assert session.run("echo again") == "again"
+    assert log.read_text() == "ran\n"
+    assert len(session.started) == 2
+
+
+def test_lost_shell_is_not_replayed(session, tmp_path):
+    log = tmp_path / "ran"
+    assert session.run(f"echo ran >> {log}; kill -9 $$") == "ERROR"
+    assert log.read_text() == "ran\n"
+
+
+def test_dead_shell_is_restarted_on_the_next_run(session):
+    assert session.run("echo first") == "first"
+    session.process.kill()
+    session.process.wait()
+    assert session.run("echo second") == "second"
+    assert len(session.started) == 2
+
+
+def test_command_is_resent_when_it_could_not_be_written(session, monkeypatch, tmp_path):
+    log = tmp_path / "ran"
+    send = session._send
+    failures = [BrokenPipeError("adb shell went away")]
+
+    def flaky_send(command, marker):
+        if failures:
+            raise failures.pop()
+        send(command, marker)
+
+    monkeypatch.setattr(session, "_send", flaky_send)
+    assert session.run(f"echo ran >> {log}; echo done") == "done"
+    assert log.read_text() == "ran\n"
+    assert len(session.started) == 2
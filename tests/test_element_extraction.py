@@ -0,0 +1,21 @@
+from and_controller import extract_elements, traverse_tree
+from synthetic_ui import make_hierarchy
+
+
+def test_traverse_tree_matches_extract_elements():
+    xml = make_hierarchy(2000)
+    for attrib in ("clickable", "focusable"):
+        elem_list = []
+        traverse_tree(xml, elem_list, attrib, True)
+        table = extract_elements(xml, attribs=(attrib,))
+        assert elem_list
+        assert [(e.uid, e.bbox) for e in elem_list] == [(e.uid, e.bbox) for e in table]
+
+
+def test_traverse_tree_skips_elements_close_to_listed_ones():
+    xml = make_hierarchy(2000)
+    elem_list = []
+    traverse_tree(xml, elem_list, "clickable", True)
+    count = len(elem_list)
+    traverse_tree(xml, elem_list, "clickable", True)
+    assert len(elem_list) == count
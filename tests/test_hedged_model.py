@@ -0,0 +1,20 @@
+import asyncio
+
+from fake_llm_server import FakeLLMServer
+from model import HedgedModel, OpenAIModel
+
+
+def test_concurrent_async_calls_do_not_starve_the_executor():
+    # The primary always misses the deadline, so every call waits on both legs while the executor is full
+    with FakeLLMServer(delay=0.3) as primary_server, FakeLLMServer(delay=0.05) as secondary_server:
+        primary = OpenAIModel(primary_server.url, "sk-", "fake", 0.0, 300, max_concurrency=2)
+        secondary = OpenAIModel(secondary_server.url, "sk-", "fake", 0.0, 300, max_concurrency=2)
+        hedged = HedgedModel(primary, secondary, initial_deadline=0.05)
+
+        async def run():
+            calls = [hedged.get_model_response_async(f"prompt {i}", []) for i in range(hedged.max_concurrency * 2)]
+            return await asyncio.wait_for(asyncio.gather(*calls), timeout=10)
+
+        results = asyncio.run(run())
+    assert all(status for status, _ in results)
+    assert hedged.stats()["hedged"] == len(results)
@@ -0,0 +1,34 @@
+import json
+import os
+
+from model import parse_explore_rsp, parse_merged_rsp, parse_reflect_rsp
+
+FIXTURE = os.path.join("benchmarks", "fixtures", "explore_responses.jsonl")
+
+
+def recorded_pairs():
+    """Each recorded reflection with the decision that followed it, as one merged response."""
+    with open(FIXTURE, encoding="utf-8") as f:
+        steps = [json.loads(line) for line in f if line.strip()]
+    return [(prev, step) for prev, step in zip(steps, steps[1:]) if prev["reflect"] is not None]
+
+
+def test_parses_recorded_pairs_like_separate_responses():
+    pairs = recorded_pairs()
+    assert pairs
+    for prev, step in pairs:
+        reflection, action = parse_merged_rsp(prev["reflect"] + "\n" + step["explore"])
+        assert reflection == parse_reflect_rsp(prev["reflect"])
+        assert action == parse_explore_rsp(step["explore"])
+
+
+def test_needs_an_observation_line():
+    prev, step = recorded_pairs()[0]
+    assert parse_merged_rsp(prev["reflect"]) == ["ERROR"]
+    assert parse_merged_rsp(prev["reflect"] + "\n" + step["explore"].replace("Observation:", "Screen:")) == ["ERROR"]
+
+
+def test_needs_both_parts():
+    prev, step = recorded_pairs()[0]
+    assert parse_merged_rsp(step["explore"]) == ["ERROR"]
+    assert parse_merged_rsp(prev["reflect"] + "\nObservation: a screen\nThought: nothing") == ["ERROR"]
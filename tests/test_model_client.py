@@ -0,0 +1,61 @@
+import time
+
+from fake_llm_server import DEFAULT_RESPONSE, FakeLLMServer
+from model import OpenAIModel, parse_retry_after
+
+
+def scripted(server, faults):
+    """Make `server` inject `faults` in order, then answer normally."""
+    faults = iter(faults)
+
+    def pick_fault():
+        with server.lock:
+            server.requests += 1
+        return next(faults, None)
+
+    server.pick_fault = pick_fault
+    return server
+
+
+def test_retries_server_errors_until_success():
+    with scripted(FakeLLMServer(), ["500", "503", "reset"]) as server:
+        mllm = OpenAIModel(server.url, "sk-", "fake", 0.0, 300, max_retries=3, backoff=0.01)
+        status, rsp = mllm.get_model_response("prompt", [])
+    assert status, rsp
+    assert rsp == DEFAULT_RESPONSE
+    assert server.requests == 4
+
+
+def test_follows_retry_after_on_429():
+    with scripted(FakeLLMServer(retry_after=0.3), ["429"]) as server:
+        mllm = OpenAIModel(server.url, "sk-", "fake", 0.0, 300, max_retries=2, backoff=0.0)
+        start = time.perf_counter()
+        status, rsp = mllm.get_model_response("prompt", [])
+        elapsed = time.perf_counter() - start
+    assert status, rsp
+    assert server.requests == 2
+    # Without Retry-After the backoff of 0 would retry at once
+    assert elapsed >= 0.3
+
+
+def test_gives_up_after_max_retries():
+    with scripted(FakeLLMServer(), ["500"] * 5) as server:
+        mllm = OpenAIModel(server.url, "sk-", "fake", 0.0, 300, max_retries=2, backoff=0.01)
+        status, rsp = mllm.get_model_response("prompt", [])
+    assert not status
+    assert "500" in rsp
+    assert server.requests == 3
+
+
+def test_retries_error_pages():
+    with scripted(FakeLLMServer(), ["html"]) as server:
+        mllm = OpenAIModel(server.url, "sk-", "fake", 0.0, 300, max_retries=3, backoff=0.01)
+        status, rsp = mllm.get_model_response("prompt", [])
+    assert status, rsp
+    assert server.requests == 2
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("2") == 2.0
+    assert parse_retry_after("0.5") == 0.5
+    assert parse_retry_after(None) is None
@@ -0,0 +1,85 @@
+import json
+
+import numpy as np
+import pytest
+
+import model
+from fake_llm_server import DEFAULT_RESPONSE, FakeLLMServer
+from model import MetricsCollector, OpenAIModel, parse_explore_rsp
+
+PROMPT_TOKENS = 1000
+COMPLETION_TOKENS = len(DEFAULT_RESPONSE.split())
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    """A collector of its own, so that calls other tests left running do not count."""
+    collector = MetricsCollector()
+    monkeypatch.setattr(model, "metrics", collector)
+    return collector
+
+
+def test_price_table():
+    collector = MetricsCollector({"gpt-4o": (1.0, 2.0), "custom-vl": (0.5, 0.5)})
+    assert collector.price("gpt-4o-2024-08-06") == (1.0, 2.0)
+    # The longest matching name wins, so a family member is not priced as its family
+    assert collector.price("gpt-4o-mini-2024-07-18") == model.MODEL_PRICES["gpt-4o-mini"]
+    assert collector.price("custom-vl") == (0.5, 0.5)
+    assert collector.price("unknown") == (0.0, 0.0)
+    assert collector.cost("gpt-4o", 1500, 500) == pytest.approx(1.5 * 1.0 + 0.5 * 2.0)
+    collector.set_prices({"custom-vl": [1.0, 1.0]})
+    assert collector.cost("custom-vl", 1000, 1000) == pytest.approx(2.0)
+
+
+def test_totals_cost_and_summary(metrics, tmp_path):
+    image = np.zeros((64, 48, 3), dtype=np.uint8)
+    metrics.start_task()
+    with FakeLLMServer(retry_after=0.01) as server:
+        faults = iter(["429", None, "truncated"])
+        server.pick_fault = lambda: next(faults)
+        mllm = OpenAIModel(server.url, "sk-", "gpt-4o", 0.0, 300, max_retries=1)
+        status, rsp = mllm.get_model_response("prompt", [image])
+        assert status
+        assert parse_explore_rsp(rsp)[0] == "FINISH"
+        status, rsp = mllm.get_model_response("prompt", [])
+        assert status
+        assert parse_explore_rsp(rsp)[0] == "ERROR"
+    prompt_price, completion_price = model.MODEL_PRICES["gpt-4o"]
+    cost = 2 * (PROMPT_TOKENS / 1000 * prompt_price + COMPLETION_TOKENS / 1000 * completion_price)
+
+    path = metrics.write_task(str(tmp_path / "metrics.json"))
+    with open(path) as f:
+        summary = json.load(f)
+    total = summary["total"]
+    assert (total["calls"], total["failed"], total["retries"]) == (2, 0, 1)
+    assert (total["parsed"], total["unparsable"]) == (1, 1)
+    assert (total["prompt_tokens"], total["completion_tokens"]) == (2 * PROMPT_TOKENS, 2 * COMPLETION_TOKENS)
+    assert total["cost"] == pytest.approx(cost)
+    assert total["image_bytes"] > 0
+    assert summary["models"]["gpt-4o"]["calls"] == 2
+    assert summary["routes"]["action"]["calls"] == 2
+    assert [call["retries"] for call in summary["calls"]] == [1, 0]
+    assert [call["parsed"] for call in summary["calls"]] == [True, False]
+    assert summary["calls"][0]["image_bytes"] > 0
+    assert summary["calls"][1]["image_bytes"] == 0
+
+    summary_path = tmp_path / "runs" / "summary.jsonl"
+    metrics.append_summary(str(summary_path), app="notes", task="shopping")
+    metrics.append_summary(str(summary_path), app="notes", task="shopping")
+    lines = [json.loads(line) for line in summary_path.read_text().splitlines()]
+    assert len(lines) == 2
+    assert lines[0]["app"] == "notes"
+    assert lines[0]["total"]["cost"] == pytest.approx(cost)
+    # The process wide totals keep counting across tasks
+    metrics.start_task()
+    assert metrics.task_summary()[0]["total"]["calls"] == 0
+    assert metrics.summary()["total"]["calls"] == 2
+
+
+def test_failed_calls_are_counted(metrics):
+    metrics.start_task()
+    with FakeLLMServer(error_rate=1.0, faults=("500",)) as server:
+        mllm = OpenAIModel(server.url, "sk-", "gpt-4o", 0.0, 300, max_retries=2, backoff=0.01)
+        assert not mllm.get_model_response("prompt", [])[0]
+    total = metrics.task_summary()[0]["total"]
+    assert (total["calls"], total["failed"], total["retries"], total["cost"]) == (1, 1, 2, 0.0)
@@ -0,0 +1,55 @@
+from fake_llm_server import DEFAULT_RESPONSE, FakeLLMServer
+from model import OpenAIModel, RoutedModel, current_route, metrics
+
+REFLECTION = "Decision: SUCCESS\nThought: The note opened.\nDocumentation: Tapping it opens the note."
+
+
+def routed(primary_server, default_server):
+    cheap = OpenAIModel(primary_server.url, "sk-", "gpt-4o-mini", 0.0, 300, max_retries=1, backoff=0.01)
+    default = OpenAIModel(default_server.url, "sk-", "gpt-4o", 0.0, 300, max_retries=0)
+    return RoutedModel(default, {"reflect": cheap})
+
+
+def test_failed_route_falls_back_to_the_default_model():
+    metrics.start_task()
+    with FakeLLMServer(error_rate=1.0, faults=("500",)) as primary_server, \
+            FakeLLMServer(response=REFLECTION) as default_server:
+        mllm = routed(primary_server, default_server)
+        assert mllm.route("reflect").get_model_response("prompt", []) == (True, REFLECTION)
+        assert primary_server.requests == 2
+        assert default_server.requests == 1
+    assert current_route.get() is None
+    stats = mllm.stats()["routes"]["reflect"]
+    assert (stats["requests"], stats["fallbacks"], stats["failed"]) == (1, 1, 0)
+    # Both attempts are charged to the route, only the default model reported usage
+    calls = [call for call in metrics.task_summary()[1] if call.model in ("gpt-4o-mini", "gpt-4o")]
+    assert [(call.model, call.route, call.status) for call in calls] == \
+           [("gpt-4o-mini", "reflect", False), ("gpt-4o", "reflect", True)]
+    assert calls[0].retries == 1
+    assert stats["completion_tokens"] == calls[1].completion_tokens > 0
+    assert stats["cost"] == round(calls[1].cost, 4)
+    summary = metrics.task_summary()[0]
+    assert summary["routes"]["reflect"]["calls"] == 2
+    assert summary["routes"]["reflect"]["failed"] == 1
+
+
+def test_unusable_response_falls_back_to_the_default_model():
+    with FakeLLMServer(response="Decision: SUCCESS") as primary_server, \
+            FakeLLMServer(response=REFLECTION) as default_server:
+        mllm = routed(primary_server, default_server)
+        assert mllm.route("reflect").get_model_response("prompt", []) == (True, REFLECTION)
+    assert mllm.stats()["routes"]["reflect"]["fallbacks"] == 1
+
+
+def test_usable_response_is_kept_and_other_calls_use_the_default():
+    metrics.start_task()
+    with FakeLLMServer(response=REFLECTION) as primary_server, FakeLLMServer() as default_server:
+        mllm = routed(primary_server, default_server)
+        assert mllm.route("reflect").get_model_response("prompt", []) == (True, REFLECTION)
+        assert mllm.get_model_response("prompt", []) == (True, DEFAULT_RESPONSE)
+        assert (primary_server.requests, default_server.requests) == (1, 1)
+    routes = mllm.stats()["routes"]
+    assert routes["reflect"]["fallbacks"] == 0
+    assert routes["action"]["requests"] == 1
+    calls = [call for call in metrics.task_summary()[1] if call.model in ("gpt-4o-mini", "gpt-4o")]
+    assert [(call.model, call.route) for call in calls] == [("gpt-4o-mini", "reflect"), ("gpt-4o", "action")]
@@ -0,0 +1,61 @@
+import threading
+import time
+
+from model import ModelStream
+
+
+def feed_later(stream, *chunks, delay=0.05):
+    def run():
+        for chunk in chunks:
+            time.sleep(delay)
+            if chunk is None:
+                stream.finish(True)
+            else:
+                stream.feed(chunk)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_waits_for_the_whole_split_line():
+    stream = ModelStream()
+    feed_later(stream, "Observation: a list\nThought: open it\n", "Action: ta", "p(3)", "\nSummary: opened")
+    status, text = stream.wait_for_line("Action: ", timeout=5)
+    assert status
+    assert "Action: tap(3)\n" in text
+    assert not stream.done
+
+
+def test_ignores_the_prefix_inside_a_line():
+    stream = ModelStream()
+    stream.feed("Thought: the next Action: tap(1)\n")
+    status, rsp = stream.wait_for_line("Action: ", timeout=0.1)
+    assert not status
+    assert "No Action line" in rsp
+
+
+def test_returns_the_text_when_ending_without_the_line():
+    stream = ModelStream()
+    feed_later(stream, "Observation: nothing to do\nAction: FIN", None)
+    status, text = stream.wait_for_line("Action: ", timeout=5)
+    assert status
+    assert text == "Observation: nothing to do\nAction: FIN"
+
+
+def test_returns_the_error_when_failing_without_the_line():
+    stream = ModelStream()
+    stream.feed("Observation: ")
+    stream.finish(False, "connection reset")
+    assert stream.wait_for_line("Action: ", timeout=1) == (False, "connection reset")
+
+
+def test_done_callback_runs_once_finished():
+    stream = ModelStream()
+    seen = []
+    stream.add_done_callback(seen.append)
+    assert seen == []
+    stream.finish(True)
+    assert seen == [stream]
+    stream.add_done_callback(seen.append)
+    assert seen == [stream, stream]
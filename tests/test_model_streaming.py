@@ -0,0 +1,55 @@
+from fake_llm_server import DEFAULT_RESPONSE, FakeLLMServer
+from model import OpenAIModel, metrics
+
+
+def calls():
+    # Calls other tests left running may still finish into the collector, they use another model name
+    return [call for call in metrics.task_summary()[1] if call.model == "gpt-4o"]
+
+
+def openai(server):
+    return OpenAIModel(server.url, "sk-", "gpt-4o", 0.0, 300, max_retries=0)
+
+
+def test_action_line_arrives_before_the_completion_ends():
+    # One word per event, so "Action: " and "FINISH\n" arrive as separate chunks
+    with FakeLLMServer(token_delay=0.05) as server:
+        stream = openai(server).stream_model_response("prompt", [])
+        status, text = stream.wait_for_line("Action:", timeout=10)
+        assert status
+        assert not stream.done
+        assert text.endswith("Action: FINISH\n")
+        assert "Summary:" not in text
+        assert stream.result(timeout=10) == (True, DEFAULT_RESPONSE)
+
+
+def test_streamed_text_and_usage_match_the_whole_completion():
+    metrics.start_task()
+    with FakeLLMServer() as server:
+        mllm = openai(server)
+        assert mllm.get_model_response("prompt", []) == (True, DEFAULT_RESPONSE)
+        # The usage only comes in the trailing event that stream_options asks for
+        assert mllm.stream_model_response("prompt", []).result(timeout=10) == (True, DEFAULT_RESPONSE)
+    whole, streamed = calls()
+    assert whole.completion_tokens == len(DEFAULT_RESPONSE.split())
+    assert (streamed.prompt_tokens, streamed.completion_tokens) == (whole.prompt_tokens, whole.completion_tokens)
+    assert streamed.cost == whole.cost > 0
+    assert streamed.response == whole.response
+
+
+def test_falls_back_to_a_json_answer():
+    metrics.start_task()
+    with FakeLLMServer(streaming=False) as server:
+        stream = openai(server).stream_model_response("prompt", [])
+        assert stream.wait_for_line("Action:", timeout=10) == (True, DEFAULT_RESPONSE)
+        assert stream.result(timeout=10) == (True, DEFAULT_RESPONSE)
+    [call] = calls()
+    assert call.status
+    assert call.completion_tokens == len(DEFAULT_RESPONSE.split())
+
+
+def test_reports_a_failed_stream():
+    with FakeLLMServer(error_rate=1.0, faults=("500",)) as server:
+        status, error = openai(server).stream_model_response("prompt", []).result(timeout=10)
+    assert not status
+    assert "500" in error
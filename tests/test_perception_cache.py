@@ -0,0 +1,77 @@
+import numpy as np
+
+from and_controller import ElementTable, extract_elements
+from frame import Frame
+from perception_cache import PerceptionCache, PerceptionEntry
+from synthetic_ui import make_hierarchy
+
+ELEMENTS = ElementTable(["a", "b", "c"], [(0, 0, 10, 10), (100, 0, 110, 10), (200, 0, 210, 10)],
+                        ["clickable"] * 3, [1] * 3)
+
+
+def labeled(side=10):
+    return Frame(image=np.zeros((side, side, 3), dtype=np.uint8))
+
+
+def entry_size(side=10):
+    return PerceptionEntry(ELEMENTS, labeled(side)).size
+
+
+def test_counts_hits_and_misses():
+    cache = PerceptionCache(1024 * 1024)
+    assert cache.get("screen") is None
+    cache.put("screen", ELEMENTS, labeled())
+    assert cache.get("screen").elem_list is ELEMENTS
+    assert cache.get("other") is None
+    assert cache.stats() == {"hits": 1, "misses": 2, "evictions": 0, "entries": 1, "bytes": entry_size()}
+
+
+def test_evicts_least_recently_used_first():
+    cache = PerceptionCache(entry_size() * 2)
+    cache.put("first", ELEMENTS, labeled())
+    cache.put("second", ELEMENTS, labeled())
+    cache.get("first")
+    cache.put("third", ELEMENTS, labeled())
+    assert list(cache.entries) == ["first", "third"]
+    assert cache.evictions == 1
+    assert cache.size == entry_size() * 2
+
+
+def test_evicts_by_size():
+    cache = PerceptionCache(entry_size(10) + entry_size(20))
+    cache.put("small", ELEMENTS, labeled(10))
+    cache.put("large", ELEMENTS, labeled(20))
+    cache.put("larger", ELEMENTS, labeled(22))
+    assert list(cache.entries) == ["larger"]
+    assert cache.evictions == 2
+    assert cache.size == entry_size(22)
+
+
+def test_skips_entries_larger_than_the_cache():
+    cache = PerceptionCache(entry_size(10))
+    cache.put("small", ELEMENTS, labeled(10))
+    cache.put("oversize", ELEMENTS, labeled(100))
+    assert list(cache.entries) == ["small"]
+    assert cache.evictions == 0
+
+
+def test_replacing_an_entry_keeps_the_size_right():
+    cache = PerceptionCache(1024 * 1024)
+    cache.put("screen", ELEMENTS, labeled(10))
+    cache.put("screen", ELEMENTS, labeled(20), excluded=frozenset({"b"}))
+    assert len(cache.entries) == 1
+    assert cache.size == entry_size(20)
+    assert cache.get("screen").excluded == {"b"}
+
+
+def test_excluding_elements_keeps_the_key():
+    xml = make_hierarchy(500)
+    frame = labeled(64)
+    assert PerceptionCache.key(xml, frame, False) == PerceptionCache.key(xml, frame, False)
+    assert PerceptionCache.key(xml, frame, False) != PerceptionCache.key(xml, frame, True)
+    assert PerceptionCache.key(xml, frame, False) != PerceptionCache.key(xml + b" ", frame, False)
+    # Filtering the cached elements gives what extracting with the exclusion gives
+    elements = extract_elements(xml)
+    useless = {elements.uids[0], elements.uids[3]}
+    assert extract_elements(xml, exclude=useless).uids == elements.exclude(useless).uids
+    assert elements.exclude(set()) is elements
@@ -0,0 +1,94 @@
+import threading
+
+import pytest
+
+import rate_limiter
+from rate_limiter import RateLimiter, parse_duration
+
+
+class Clock:
+    """Stands in for the time module of rate_limiter: sleeping moves the clock instead of waiting."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    return clock
+
+
+def test_bursts_then_paces_at_the_request_limit(clock):
+    limiter = RateLimiter(requests_per_minute=60)
+    assert [limiter.acquire() for _ in range(60)] == [0.0] * 60
+    assert limiter.acquire() == pytest.approx(1.0)
+    assert limiter.acquire() == pytest.approx(1.0)
+    assert limiter.stats()["waits"] == 2
+    assert limiter.stats()["waited_s"] == pytest.approx(2.0)
+
+
+def test_paces_by_estimated_tokens(clock):
+    limiter = RateLimiter(tokens_per_minute=6000)
+    assert limiter.acquire(6000) == 0.0
+    # 100 tokens refill per second
+    assert limiter.acquire(1500) == pytest.approx(15.0)
+
+
+def test_settle_corrects_underestimates(clock):
+    limiter = RateLimiter(tokens_per_minute=6000)
+    assert limiter.acquire(1000) == 0.0
+    limiter.settle(1000, 4000)
+    # 2000 of the 6000 tokens are left, so 3000 more take 10 seconds to refill
+    assert limiter.acquire(3000) == pytest.approx(10.0)
+
+
+def test_settle_returns_overestimates(clock):
+    limiter = RateLimiter(tokens_per_minute=6000)
+    assert limiter.acquire(6000) == 0.0
+    limiter.settle(6000, 1000)
+    assert limiter.acquire(5000) == 0.0
+
+
+def test_update_adopts_ratelimit_headers(clock):
+    limiter = RateLimiter()
+    assert limiter.acquire(10 ** 6) == 0.0
+    limiter.update({"x-ratelimit-limit-requests": "500", "x-ratelimit-remaining-requests": "0",
+                    "x-ratelimit-reset-requests": "6m0s", "x-ratelimit-limit-tokens": "30000",
+                    "x-ratelimit-remaining-tokens": "29000", "x-ratelimit-reset-tokens": "120ms"})
+    assert limiter.stats()["rpm"] == 500
+    assert limiter.stats()["tpm"] == 30000
+    # Out of requests until the reported reset, however fast the bucket would refill
+    assert limiter.acquire(100) == pytest.approx(360.0)
+
+
+def test_update_ignores_malformed_headers(clock):
+    limiter = RateLimiter(requests_per_minute=60)
+    limiter.update({"x-ratelimit-limit-requests": "lots", "x-ratelimit-remaining-requests": "0"})
+    assert limiter.stats()["rpm"] == 60
+    assert limiter.acquire() == 0.0
+
+
+def test_parse_duration():
+    assert parse_duration("6m0s") == 360
+    assert parse_duration("120ms") == pytest.approx(0.12)
+    assert parse_duration("1h2m3.5s") == pytest.approx(3723.5)
+    assert parse_duration("2") == 2.0
+    assert parse_duration("") is None
+    assert parse_duration("soon") is None
+
+
+def test_acquire_returns_none_when_cancelled(clock):
+    limiter = RateLimiter(requests_per_minute=1)
+    cancel = threading.Event()
+    assert limiter.acquire(cancel=cancel) == 0.0
+    cancel.set()
+    assert limiter.acquire(cancel=cancel) is None
+    assert limiter.stats()["waits"] == 0
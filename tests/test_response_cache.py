@@ -0,0 +1,119 @@
+import os
+
+import cv2
+import numpy as np
+
+from fake_llm_server import FakeLLMServer
+from frame import Frame
+from model import CachedModel, OpenAIModel
+from response_cache import Cassette, ResponseCache, request_key
+
+IMAGE = np.random.default_rng(0).integers(0, 256, (64, 48, 3), dtype=np.uint8)
+
+
+def entry_size(cache_dir, key, response):
+    cache = ResponseCache(str(cache_dir))
+    cache.put(key, response)
+    return os.path.getsize(cache.path(key))
+
+
+def test_counts_hits_and_misses_and_persists(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    assert cache.get("a" * 64) is None
+    cache.put("a" * 64, "Action: tap(1)", model="gpt-4o")
+    assert cache.get("a" * 64) == "Action: tap(1)"
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert ResponseCache(str(tmp_path)).get("a" * 64) == "Action: tap(1)"
+
+
+def test_evicts_least_recently_used_by_size(tmp_path):
+    size = entry_size(tmp_path / "probe", "a" * 64, "x")
+    # Room for two entries, whose sizes vary by a few bytes with their creation time
+    cache = ResponseCache(str(tmp_path / "cache"), max_bytes=size * 2 + 10)
+    cache.put("a" * 64, "x")
+    cache.put("b" * 64, "x")
+    assert cache.get("a" * 64) == "x"
+    cache.put("c" * 64, "x")
+    assert list(cache.entries) == ["a" * 64, "c" * 64]
+    assert cache.evictions == 1
+    assert not os.path.exists(cache.path("b" * 64))
+    # Larger than the whole cache, so it is not stored at all
+    cache.put("d" * 64, "x" * size * 3)
+    assert cache.get("d" * 64) is None
+    assert cache.size == sum(cache.entries.values()) <= size * 2 + 10
+
+
+def test_reopening_evicts_the_oldest_files_first(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    for i, key in enumerate(("a" * 64, "b" * 64, "c" * 64)):
+        cache.put(key, "x")
+        os.utime(cache.path(key), (1000 + i, 1000 + i))
+    os.utime(cache.path("a" * 64), (2000, 2000))
+    smaller = ResponseCache(str(tmp_path), max_bytes=cache.entries["a" * 64] + cache.entries["c" * 64])
+    assert list(smaller.entries) == ["c" * 64, "a" * 64]
+    assert not os.path.exists(cache.path("b" * 64))
+
+
+def test_unreadable_entry_is_a_miss(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    cache.put("a" * 64, "x")
+    with open(cache.path("a" * 64), "w") as f:
+        f.write("{")
+    assert cache.get("a" * 64) is None
+    assert "a" * 64 not in cache.entries
+
+
+def test_key_depends_on_pixels_not_memory_layout(tmp_path):
+    key = request_key("gpt-4o", "prompt", [IMAGE], 0.0)
+    assert request_key("gpt-4o", "prompt", [np.asfortranarray(IMAGE)], 0.0) == key
+    assert request_key("gpt-4o", "prompt", [IMAGE[:, ::-1][:, ::-1]], 0.0) == key
+    padded = np.zeros((64, 60, 3), dtype=np.uint8)
+    padded[:, 6:54] = IMAGE
+    assert request_key("gpt-4o", "prompt", [padded[:, 6:54]], 0.0) == key
+    # The same bytes laid out as another shape are another image
+    assert request_key("gpt-4o", "prompt", [IMAGE.reshape(48, 64, 3)], 0.0) != key
+    changed = IMAGE.copy()
+    changed[0, 0, 0] ^= 1
+    assert request_key("gpt-4o", "prompt", [changed], 0.0) != key
+    assert request_key("gpt-4o", "prompt", [IMAGE], 0.5) != key
+    assert request_key("gpt-4o", "other", [IMAGE], 0.0) != key
+    # A screenshot gets the same key whether it is passed as pixels, a Frame, PNG bytes or a file
+    mllm = CachedModel(OpenAIModel("http://127.0.0.1:9", "sk-", "gpt-4o", 0.0, 300))
+    path = str(tmp_path / "screen.png")
+    cv2.imwrite(path, IMAGE)
+    png = open(path, "rb").read()
+    assert {mllm.key("prompt", [image]) for image in (IMAGE, Frame(image=IMAGE), png, path)} == {key}
+
+
+def test_record_then_replay_gives_identical_responses(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    prompts = ["first", "second", "third"]
+    with FakeLLMServer() as server:
+        recorder = CachedModel(OpenAIModel(server.url, "sk-", "gpt-4o", 0.0, 300), cassette=Cassette(path),
+                               mode="record")
+        recorded = []
+        for i, prompt in enumerate(prompts):
+            server.response = f"Observation: screen {i}\nAction: tap({i + 1})"
+            recorded.append(recorder.get_model_response(prompt, [IMAGE]))
+        assert server.requests == 3
+    # Nothing listens on the replaying model's address, so any request it sent would fail
+    offline = OpenAIModel("http://127.0.0.1:9", "sk-", "gpt-4o", 0.0, 300, max_retries=0)
+    player = CachedModel(offline, cassette=Cassette(path), mode="replay")
+    assert [player.get_model_response(prompt, [IMAGE]) for prompt in prompts] == recorded
+    assert player.sent == 0
+    status, rsp = player.get_model_response("fourth", [IMAGE])
+    assert not status
+    assert "no recorded response" in rsp
+
+
+def test_replay_matches_by_key_before_order(tmp_path):
+    cassette = Cassette(str(tmp_path / "run.jsonl"))
+    for key in ("a", "b", "c"):
+        cassette.append(key, f"response {key}")
+    replay = Cassette(cassette.path)
+    assert replay.next("c") == "response c"
+    # A key that was not recorded, e.g. because the clock changed, takes the next unused response
+    assert replay.next("changed") == "response a"
+    assert replay.next("b") == "response b"
+    assert replay.next("b") is None
+    assert replay.stats() == {"records": 3, "replayed": 3}
@@ -0,0 +1,103 @@
+import os
+import queue
+import threading
+import time
+
+from and_controller import UiEvent, UiEventStream
+
+FIXTURE = os.path.join("benchmarks", "fixtures", "uiautomator_events.txt")
+
+
+def event_line(event_type="TYPE_WINDOW_CONTENT_CHANGED", package="com.example.shop", event_time=1000):
+    return f"EventType: {event_type}; EventTime: {event_time}; PackageName: {package}; MovementGranularity: 0; " \
+           f"Action: 0; ContentChangeTypes: []; WindowChangeTypes: [] [ ClassName: android.widget.TextView; " \
+           f"Text: [Cart: 2]; ContentDescription: null; Enabled: true ]; recordCount: 0"
+
+
+class Feed:
+    """Lines for a UiEventStream that the test hands over one at a time."""
+
+    def __init__(self):
+        self.lines = queue.Queue()
+
+    def __iter__(self):
+        while True:
+            line = self.lines.get()
+            if line is None:
+                return
+            yield line
+
+    def send(self, **kwargs):
+        self.lines.put(event_line(**kwargs))
+
+
+def test_parse_event_line():
+    event = UiEvent.parse(event_line("TYPE_VIEW_CLICKED", event_time=5940012))
+    assert event.event_type == "TYPE_VIEW_CLICKED"
+    assert event.event_time == 5940012
+    assert event.package == "com.example.shop"
+    assert event.class_name == "android.widget.TextView"
+    assert event.text == "Cart: 2"
+    assert event.changes_screen
+
+
+def test_parse_skips_other_lines():
+    assert UiEvent.parse("Events to be delivered:") is None
+    assert UiEvent.parse("EventType: TYPE_VIEW_CLICKED; EventTime: soon; PackageName: com.example.shop") is None
+
+
+def test_parse_recorded_stream():
+    with open(FIXTURE, encoding="utf-8") as f:
+        event_lines = [line for line in f.read().splitlines() if line.startswith("EventType: ")]
+    events = [UiEvent.parse(line) for line in event_lines]
+    assert event_lines and all(event is not None for event in events)
+    assert [event.event_time for event in events] == sorted(event.event_time for event in events)
+
+
+def test_stream_drops_ignored_packages():
+    feed = Feed()
+    stream = UiEventStream(feed)
+    feed.send(package="com.android.systemui")
+    feed.send(event_type="TYPE_ANNOUNCEMENT")
+    feed.send(event_time=2000)
+    assert stream.get(timeout=1).event_time == 2000
+    assert stream.get(timeout=0.05) is None
+
+
+def test_wait_drops_stale_events_and_falls_back_without_new_ones():
+    feed = Feed()
+    stream = UiEventStream(feed)
+    feed.send()
+    time.sleep(0.05)
+    assert stream.wait_for_quiet(0.05, timeout=1, first_timeout=0.1) is None
+
+
+def test_wait_is_not_ended_by_a_pause_before_min_wait():
+    feed = Feed()
+    stream = UiEventStream(feed)
+    start = time.monotonic()
+
+    def update():
+        feed.send()
+        time.sleep(0.15)
+        feed.send()
+
+    threading.Timer(0.02, update).start()
+    assert stream.wait_for_quiet(0.1, timeout=2, first_timeout=1, min_wait=0.3) is True
+    # The pause of 0.15s is longer than the quiet window, the wait still covers the second event
+    assert time.monotonic() - start >= 0.17 + 0.1
+    assert stream.get(timeout=0) is None
+
+
+def test_wait_reports_a_screen_that_keeps_changing():
+    feed = Feed()
+    stream = UiEventStream(feed)
+    stop = time.monotonic() + 0.5
+
+    def spin():
+        while time.monotonic() < stop:
+            feed.send()
+            time.sleep(0.02)
+
+    threading.Thread(target=spin, daemon=True).start()
+    assert stream.wait_for_quiet(0.1, timeout=0.3, first_timeout=0.2) is False
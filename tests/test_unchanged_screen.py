@@ -0,0 +1,76 @@
+from concurrent.futures import Future
+
+import numpy as np
+
+from and_controller import AndroidController, PendingState, StateSnapshot, hierarchy_digest
+from frame import Frame
+from utils import PerfStats
+
+SCREEN = '''<?xml version="1.0" encoding="UTF-8"?><hierarchy rotation="0">
+<node index="0" text="" class="android.widget.FrameLayout" package="com.example.notes" bounds="[0,0][1080,2400]">
+<node index="0" text="Shopping" class="android.widget.TextView" package="com.example.notes" checked="false"
+ bounds="[0,200][1080,300]" />
+<node index="1" text="{clock}" class="android.widget.TextClock" package="com.example.notes" bounds="[0,0][200,60]" />
+<node index="2" text="" class="android.widget.ProgressBar" package="com.example.notes"
+ bounds="[{spinner},900][{end},1000]">
+<node index="0" text="{progress}" class="android.widget.TextView" package="com.example.notes" bounds="[0,0][1,1]" />
+</node>
+</node>
+<node index="1" text="{status}" class="android.widget.TextView" package="com.android.systemui"
+ bounds="[0,0][1080,60]" />
+</hierarchy>'''
+
+IGNORED = ["com.android.systemui"]
+IMAGE = np.random.default_rng(0).integers(0, 256, (2400, 1080, 3), dtype=np.uint8)
+
+
+def screen(clock="12:00", spinner=500, progress="10%", status="12:00", title="Shopping", checked="false"):
+    xml = SCREEN.format(clock=clock, spinner=spinner, end=spinner + 100, progress=progress, status=status)
+    return xml.replace('text="Shopping"', f'text="{title}"').replace('checked="false"', f'checked="{checked}"').encode()
+
+
+def test_volatile_classes_and_ignored_packages_are_left_out():
+    digest = hierarchy_digest(screen(), IGNORED)
+    # Clocks and spinners, with everything inside them, change on their own
+    assert hierarchy_digest(screen(clock="12:01", spinner=540, progress="60%"), IGNORED) == digest
+    # So does the status bar
+    assert hierarchy_digest(screen(status="12:01"), IGNORED) == digest
+    assert hierarchy_digest(screen(status="12:01")) != hierarchy_digest(screen())
+
+
+def test_real_changes_are_detected():
+    digest = hierarchy_digest(screen(), IGNORED)
+    assert hierarchy_digest(screen(title="Groceries"), IGNORED) != digest
+    assert hierarchy_digest(screen(checked="true"), IGNORED) != digest
+    assert hierarchy_digest(screen(), IGNORED, volatile_classes=()) != \
+        hierarchy_digest(screen(clock="12:01"), IGNORED, volatile_classes=())
+
+
+def controller():
+    # unchanged_by_action only compares captures, it needs no device
+    controller = AndroidController.__new__(AndroidController)
+    controller.perf = PerfStats()
+    return controller
+
+
+def after_capture(image, xml):
+    future = Future()
+    if xml is not None:
+        future.set_result((xml, (0.0, 0.1)))
+    return PendingState(Frame(image=image), (0.0, 0.1), future if xml is not None else None)
+
+
+def test_unchanged_by_action():
+    before = StateSnapshot(Frame(image=IMAGE), screen(), (0.0, 0.1), (0.0, 0.1))
+    changed = IMAGE.copy()
+    changed[1000:1400, 100:900] = 255 - changed[1000:1400, 100:900]
+    check = controller().unchanged_by_action
+    assert check(before, after_capture(IMAGE, screen(clock="12:01", spinner=520, status="12:01")), tolerance=2)
+    # The screen looks the same but a checkbox was toggled
+    assert not check(before, after_capture(IMAGE, screen(checked="true")), tolerance=2)
+    # The hierarchy is the same but the pixels changed, e.g. in a WebView
+    assert not check(before, after_capture(changed, screen()), tolerance=2)
+    # Without a hierarchy, or when dumping it failed, the screen cannot be proven unchanged
+    assert not check(before, after_capture(IMAGE, None), tolerance=2)
+    assert not check(before, after_capture(IMAGE, "ERROR"), tolerance=2)
+    assert not check(before, None, tolerance=2)